@@ -0,0 +1,204 @@
+import os
+import copy
+import json
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from datetime import datetime
+
+import yaml
+
+import cfgparse
+import runner
+
+
+def set_by_path(config, path, value):
+    """
+    Set value in the raw config dict by dotted path, i.e. sumo.seed
+    or tls.C.constants.mpc_step where list items are found by their
+    id or by integer index
+    """
+    keys = path.split(".")
+    node = config
+    for key in keys[:-1]:
+        if isinstance(node, list):
+            node = get_list_item(node, key)
+        else:
+            node = node.setdefault(key, {})
+
+    if isinstance(node, list):
+        idx = node.index(get_list_item(node, keys[-1]))
+        node[idx] = value
+    else:
+        node[keys[-1]] = value
+    return config
+
+
+def get_list_item(items, key):
+    """
+    Find list item by its id field, falls back to integer index
+    """
+    for item in items:
+        if isinstance(item, dict) and str(item.get("id")) == key:
+            return item
+    assert key.lstrip("-").isdigit(), f"No item with id {key} in {items}"
+    return items[int(key)]
+
+
+def expand_grid(grid):
+    """
+    Expand {path: [values]} to the list of all {path: value} combinations
+    """
+    if not grid:
+        return [{}]
+    paths = list(grid.keys())
+    combinations = itertools.product(*[grid[p] for p in paths])
+    return [dict(zip(paths, values)) for values in combinations]
+
+
+def get_overrides(raw_config, params):
+    """
+    Apply grid parameters to a copy of raw config and return
+    the touched top level sections as config overrides
+    """
+    config = copy.deepcopy(raw_config)
+    for path, value in params.items():
+        set_by_path(config, path, value)
+    sections = set([p.split(".")[0] for p in params])
+    return {s: config[s] for s in sections}
+
+
+def make_job(idx, run_name, config_file, params, overrides, base_port=None, gui=False):
+    """
+    Describe single run of a batch, run name replaces job.name and
+    each job gets its own TraCI label and port
+    """
+    # "_" separates run name from the output file name
+    run_name = run_name.replace("_", "-")
+    overrides = dict(overrides)
+    overrides["job"] = dict(overrides.get("job", {}), name=run_name)
+    overrides["sumo"] = dict(overrides.get("sumo", {}), gui=gui)
+
+    return {
+        "index": idx,
+        "name": run_name,
+        "config": config_file,
+        "params": params,
+        "overrides": overrides,
+        "port": None if base_port is None else base_port + idx
+    }
+
+
+def create_jobs(config_files, grid=None, base_port=None, gui=False):
+    """
+    Create one job per config file and grid combination
+    """
+    jobs = []
+    for config_file in config_files:
+        with open(config_file, "r") as fin:
+            raw_config = yaml.safe_load(fin)
+        base_name = raw_config["job"]["name"]
+
+        for params in expand_grid(grid):
+            idx = len(jobs)
+            overrides = get_overrides(raw_config, params)
+            run_name = f"{base_name}-{idx:03d}"
+            jobs.append(make_job(
+                idx, run_name, config_file, params, overrides, base_port, gui))
+    return jobs
+
+
+def create_replication_jobs(config_file, run_name, seeds, base_port=None, gui=False):
+    """
+    Create one job per SUMO seed, runs are named <run_name>-seed<seed>
+    """
+    jobs = []
+    for idx, seed in enumerate(seeds):
+        params = {"sumo.seed": seed}
+        overrides = {"sumo": {"seed": seed}}
+        jobs.append(make_job(
+            idx, f"{run_name}-seed{seed}", config_file, params, overrides, base_port, gui))
+    return jobs
+
+
+def run_job(job):
+    """
+    Run single simulation job and report its status and timing,
+    executed in a separate worker process
+    """
+    result = {
+        "index": job["index"],
+        "name": job["name"],
+        "config": job["config"],
+        "params": job["params"],
+        "exit_code": 0,
+        "error": None,
+        "started": datetime.now().isoformat(timespec="seconds"),
+    }
+    t_start = time.perf_counter()
+    try:
+        args = argparse.Namespace(config=job["config"])
+        cfg = cfgparse.get_valid_config(args, job["overrides"])
+        runner.simulate(cfg, label=job["name"], port=job["port"])
+    except Exception:
+        result["exit_code"] = 1
+        result["error"] = traceback.format_exc()
+    result["duration"] = time.perf_counter() - t_start
+    return result
+
+
+def run_batch(jobs, n_workers=None):
+    """
+    Run jobs on a pool of worker processes, every worker process
+    is replaced after a job so SUMO instances stay isolated
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    results = []
+    with multiprocessing.Pool(n_workers, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_job, jobs):
+            status = "done" if result["exit_code"] == 0 else "failed"
+            print("{} {} in {:.1f} s".format(
+                result["name"], status, result["duration"]))
+            results.append(result)
+    return sorted(results, key=lambda r: r["index"])
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--configs", type=str, nargs="+", required=True,
+        help="yaml configuration files defining the simulations")
+    ap.add_argument("-g", "--grid", type=str, default=None,
+        help="yaml file mapping dotted config paths to lists of values, " \
+            "i.e. 'sumo.seed: [1, 2, 3]', all combinations are run for every config")
+    ap.add_argument("-n", "--workers", type=int, default=None,
+        help="number of parallel simulations, default: number of cores")
+    ap.add_argument("-p", "--base-port", type=int, default=None,
+        help="TraCI port of the first job, following jobs use consecutive ports")
+    ap.add_argument("-m", "--manifest", type=str, default="batch_manifest.json",
+        help="output JSON with status and timing of all runs")
+    ap.add_argument("--gui", action="store_true",
+        help="keep SUMO GUI enabled for all runs")
+    args = ap.parse_args()
+
+    grid = None
+    if args.grid:
+        with open(args.grid, "r") as fin:
+            grid = yaml.safe_load(fin)
+
+    jobs = create_jobs(args.configs, grid, args.base_port, args.gui)
+    print(f"Running {len(jobs)} jobs")
+
+    t_start = time.perf_counter()
+    results = run_batch(jobs, args.workers)
+    manifest = {
+        "n_jobs": len(jobs),
+        "n_failed": sum([1 for r in results if r["exit_code"] != 0]),
+        "duration": time.perf_counter() - t_start,
+        "runs": results
+    }
+    with open(args.manifest, "w") as fout:
+        json.dump(manifest, fout, indent=4)
@@ -0,0 +1,441 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import sumolib
+
+import cfgparse
+import runner
+import feature_extraction as fe
+import metrics.output_helper as oh
+from profiler import StepProfiler
+from simbackend import sim
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, "benchmarks")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+# recorded TraCI responses of the test network, micro benchmarks replay them without SUMO
+PIPELINE_TRACE = os.path.join(BENCH_DIR, "pipeline.trace")
+PIPELINE_NET = os.path.join(BASE_DIR, "test", "data", "test.net.xml")
+PIPELINE_ROUTES = os.path.join(BASE_DIR, "test", "data", "routes.rou.xml")
+PIPELINE_STEPS = 300
+PIPELINE_TLS = "C"
+
+MACRO_CONFIGS = {
+    "cross": os.path.join(BASE_DIR, "configs", "cross_standart_ops.yml"),
+    "block": os.path.join(BASE_DIR, "configs", "example_block.yml"),
+}
+
+
+def get_timing(times):
+    """
+    Best round is compared, it is the least disturbed by other
+    processes, median is kept to see the spread
+    """
+    return {
+        "value": min(times) * 1e6,
+        "median": float(np.median(times)) * 1e6,
+        "unit": "us",
+        "higher_is_better": False
+    }
+
+
+def time_calls(func, number=1, repeat=5):
+    """
+    Time per call in microseconds over repeat rounds of number calls
+    """
+    times = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t_start) / number)
+    return get_timing(times)
+
+
+def get_pipeline_query(subscribe=False):
+    approaches = ["NC", "EC", "SC", "WC"]
+    return {
+        "subscribe": subscribe,
+        "user_data": [
+            {
+                "feature": "count",
+                "user_class": "passenger",
+                "at": "lane",
+                "mapping": {f"{a}_{i}": f"{a}_cars" for a in approaches for i in [2, 3, 4]}
+            },
+            {
+                "feature": "count",
+                "user_class": "passenger",
+                "at": "phase",
+                "mapping": {0: "A_cars", 2: "B_cars"}
+            },
+            {
+                "feature": "count",
+                "user_class": "pedestrian",
+                "at": "phase",
+                "mapping": {0: "A_peds", 2: "B_peds"}
+            }],
+        "tls_data": [
+            {
+                "feature": "elapsed_time",
+                "to_variable": "elapsed"
+            }]
+        }
+
+
+def create_pipelines():
+    values = {v: 0 for v in [
+        "NC_cars", "EC_cars", "SC_cars", "WC_cars",
+        "A_cars", "B_cars", "A_peds", "B_peds", "elapsed"]}
+    return {
+        "extract": fe.TLSDataPipeline(PIPELINE_TLS, -1, values, get_pipeline_query()),
+        "extract_subscribed": fe.TLSDataPipeline(
+            PIPELINE_TLS, -1, values, get_pipeline_query(subscribe=True))
+    }
+
+
+def typed_phase_count(pipeline):
+    state = {"A_cars": 0}
+    fe.add_typed_phase_count(state, PIPELINE_TLS, 0, "A_cars", "passenger",
+        phase_index=pipeline.phase_index)
+    return state
+
+
+def record_pipeline_trace(trace_file=PIPELINE_TRACE):
+    """
+    Run the test network in SUMO and record the responses
+    needed by the pipeline benchmarks
+    """
+    sim.select("traci")
+    sim.use_trace(trace_file)
+    sim.start([sumolib.checkBinary("sumo"), "-n", PIPELINE_NET, "-r", PIPELINE_ROUTES],
+        label="benchmark")
+    pipelines = create_pipelines()
+    for _ in range(PIPELINE_STEPS):
+        sim.simulationStep()
+        for pipeline in pipelines.values():
+            pipeline.extract()
+        typed_phase_count(pipelines["extract"])
+    sim.close()
+    sim.select("traci")
+
+
+def bench_pipelines(repeat=20):
+    """
+    Time per call of the pipeline extraction over all steps of the replayed trace
+    """
+    if not os.path.isfile(PIPELINE_TRACE):
+        record_pipeline_trace()
+
+    sim.select("replay")
+    sim.use_trace(PIPELINE_TRACE)
+    sim.start([])
+    pipelines = create_pipelines()
+    funcs = {
+        "extract": pipelines["extract"].extract,
+        "extract_subscribed": pipelines["extract_subscribed"].extract,
+        "add_typed_phase_count": lambda: typed_phase_count(pipelines["extract"])
+    }
+
+    results = {}
+    for name, func in funcs.items():
+        times = []
+        for _ in range(repeat):
+            sim.start([])
+            total = 0
+            for _ in range(PIPELINE_STEPS):
+                sim.simulationStep()
+                t_start = time.perf_counter()
+                func()
+                total += time.perf_counter() - t_start
+            times.append(total / PIPELINE_STEPS)
+        results[name] = get_timing(times)
+    sim.select("traci")
+    return results
+
+
+def write_detector_xml(path, n_lanes=100, n_intervals=300):
+    with open(path, "w") as fout:
+        fout.write("<detector>\n")
+        for i in range(n_intervals):
+            for lane in range(n_lanes):
+                fout.write(
+                    f'    <interval begin="{i * 60}.00" end="{(i + 1) * 60}.00" '
+                    f'id="e2det_L{lane}_0" meanTimeLoss="{lane % 7}.5" meanSpeed="{i % 13}.25" '
+                    f'meanHaltingDuration="1.00" maxVehicleNumber="{lane % 5}" '
+                    f'maxHaltingDuration="3.00" maxJamLengthInVehicles="2" '
+                    f'maxJamLengthInMeters="15.30"/>\n')
+        fout.write("</detector>\n")
+
+
+def write_emission_xml(path, n_edges=50, n_intervals=300):
+    with open(path, "w") as fout:
+        fout.write("<meandata>\n")
+        for i in range(n_intervals):
+            fout.write(f'    <interval begin="{i * 60}.00" end="{(i + 1) * 60}.00" id="emit">\n')
+            for edge in range(n_edges):
+                fout.write(f'        <edge id="L{edge}">\n')
+                for lane in range(2):
+                    fout.write(
+                        f'            <lane id="L{edge}_{lane}" CO2_abs="{edge}.5" '
+                        f'fuel_abs="{i % 11}.5" NOx_abs="0.1"/>\n')
+                fout.write('        </edge>\n')
+            fout.write('    </interval>\n')
+        fout.write("</meandata>\n")
+
+
+def bench_output_readers(repeat=5):
+    """
+    Time of parsing synthetic detector and emission outputs of 30000 lanes intervals
+    """
+    det_metrics = {
+        "meanTimeLoss": "mean_time_loss",
+        "meanSpeed": "mean_speed",
+        "maxVehicleNumber": "count",
+        "maxJamLengthInMeters": "max_queue_meters"
+    }
+    emit_metrics = {"CO2_abs": "total_co2", "fuel_abs": "total_fuel"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        det_file = os.path.join(tmp, "run_det.xml")
+        emit_file = os.path.join(tmp, "run_emit.xml")
+        write_detector_xml(det_file)
+        write_emission_xml(emit_file)
+        det_root = ET.parse(det_file).getroot()
+        emit_root = ET.parse(emit_file).getroot()
+
+        return {
+            "get_detector_intervals": time_calls(
+                lambda: oh.get_detector_intervals(det_root, det_metrics), repeat=repeat),
+            "get_emission_intervals": time_calls(
+                lambda: oh.get_emission_intervals(emit_root, emit_metrics), repeat=repeat),
+            "read_detectors_to_pandas": time_calls(
+                lambda: oh.read_detectors_to_pandas(det_file, det_metrics), repeat=repeat),
+            "read_emissions_to_pandas": time_calls(
+                lambda: oh.read_emissions_to_pandas(emit_file, emit_metrics), repeat=repeat),
+        }
+
+
+def make_output_frame(n_runs=10, n_lanes=100, n_intervals=500):
+    n = n_lanes * n_intervals
+    frames = []
+    rng = np.random.default_rng(0)
+    for run in range(n_runs):
+        frames.append(pd.DataFrame({
+            "run_name": f"run{run}",
+            "begin": np.repeat(np.arange(n_intervals) * 60.0, n_lanes),
+            "end": np.repeat(np.arange(1, n_intervals + 1) * 60.0, n_lanes),
+            "lane": np.tile([f"L{lane}_0" for lane in range(n_lanes)], n_intervals),
+            "lane_group": np.tile([f"G{lane % 4}" for lane in range(n_lanes)], n_intervals),
+            "count": rng.integers(0, 10, n).astype(float),
+            "mean_speed": rng.random(n) * 14,
+            "max_queue_meters": rng.random(n) * 50,
+            "total_co2": rng.random(n) * 100,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def bench_datamodel(repeat=5):
+    """
+    Time of indexing 500000 rows of outputs and of the time series lookups of the app
+    """
+    # the app imports the helper as a sibling module
+    sys.path.insert(0, os.path.join(BASE_DIR, "metrics"))
+    from output_app import DataModel
+
+    df = make_output_frame()
+    model = DataModel(df)
+    runs = df["run_name"].unique()
+    metrics = model.get_metrics()
+    keys = [(r, m, g) for r in runs for m in metrics for g in ["G0", "G1", "G2", "G3"]]
+
+    def lookup_all():
+        for key in keys:
+            model.get_timeseries(*key)
+
+    # time per lookup
+    lookups = time_calls(lookup_all, repeat=repeat)
+    lookups["value"] /= len(keys)
+    lookups["median"] /= len(keys)
+    return {
+        "DataModel": time_calls(lambda: DataModel(df), repeat=repeat),
+        "get_timeseries": lookups
+    }
+
+
+def run_macro(config_file, max_steps):
+    """
+    Run the config without GUI and logging output, executed in a separate process
+    """
+    args = argparse.Namespace(config=config_file)
+    overrides = {
+        "job": {"name": "benchmark"},
+        "sumo": {"gui": False, "max_steps": max_steps},
+        "logging": {"to_file": False, "to_console": False}
+    }
+    cfg = cfgparse.get_valid_config(args, overrides)
+    profiler = StepProfiler()
+    t_start = time.perf_counter()
+    runner.simulate(cfg, label="benchmark", profiler=profiler)
+    duration = time.perf_counter() - t_start
+    loop = sum([sum(d) for d in profiler.durations.values()]) / 1e9
+    return {"steps": profiler.step, "loop": loop, "wall": duration}
+
+
+def bench_macro(max_steps=1000):
+    """
+    Steps per second of the simulation loop, SUMO start up is excluded
+    """
+    results = {}
+    for name, config_file in MACRO_CONFIGS.items():
+        with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+            try:
+                run = pool.apply(run_macro, (config_file, max_steps))
+            except Exception as e:
+                # reported with the results, fails the comparison and the baseline
+                results[f"steps_per_second_{name}"] = {"error": f"{type(e).__name__}: {e}"}
+                continue
+        results[f"steps_per_second_{name}"] = {
+            "value": run["steps"] / run["loop"],
+            "steps": run["steps"],
+            "wall": run["wall"],
+            "unit": "steps/s",
+            "higher_is_better": True
+        }
+    return results
+
+
+# benchmark groups, each returns {case name: result}
+SUITES = {
+    "micro": {
+        "pipeline": bench_pipelines,
+        "output_readers": bench_output_readers,
+        "datamodel": bench_datamodel,
+    },
+    "macro": {
+        "simulation": bench_macro,
+    }
+}
+
+
+def run_suites(suites):
+    results = {}
+    for suite in suites:
+        for group, func in SUITES[suite].items():
+            print(f"Running {suite}/{group}")
+            for name, result in func().items():
+                results[f"{suite}/{name}"] = result
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.2, suites=None):
+    """
+    Relative change of every baseline case of the suites, a case regressed
+    if it is slower than the baseline by more than tolerance, failed
+    or is missing. Cases not in the baseline are not compared
+    """
+    comparison = {}
+    for name, base in baseline.items():
+        if "value" not in base:
+            continue
+        if suites is not None and name.split("/")[0] not in suites:
+            continue
+        result = results.get(name, {"error": "missing"})
+        if "value" not in result:
+            comparison[name] = {
+                "baseline": base["value"],
+                "value": None,
+                "change": None,
+                "error": result.get("error"),
+                "regressed": True
+            }
+            continue
+        change = result["value"] / base["value"] - 1
+        if result["higher_is_better"]:
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+        comparison[name] = {
+            "baseline": base["value"],
+            "value": result["value"],
+            "change": change,
+            "regressed": regressed
+        }
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = ["{:<40} {:>14} {:>14} {:>9}".format("case", "baseline", "current", "change")]
+    for name, c in comparison.items():
+        if c["value"] is None:
+            lines.append("{:<40} {:>14.2f} {:>14} {:>9}  REGRESSED ({})".format(
+                name, c["baseline"], "-", "-", c["error"]))
+            continue
+        flag = "  REGRESSED" if c["regressed"] else ""
+        lines.append("{:<40} {:>14.2f} {:>14.2f} {:>+8.1%}{}".format(
+            name, c["baseline"], c["value"], c["change"], flag))
+    return "\n".join(lines)
+
+
+def get_meta():
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-s", "--suites", type=str, nargs="+", default=list(SUITES),
+        choices=list(SUITES), help="benchmark suites to run")
+    ap.add_argument("-o", "--output", type=str, default="benchmark_results.json",
+        help="output JSON with the results")
+    ap.add_argument("-b", "--baseline", type=str, default=BASELINE_FILE,
+        help="baseline JSON to compare with")
+    ap.add_argument("-t", "--tolerance", type=float, default=0.2,
+        help="allowed relative slow down against the baseline")
+    ap.add_argument("--save-baseline", action="store_true",
+        help="store the results as the new baseline")
+    ap.add_argument("--record", action="store_true",
+        help="record the TraCI trace of the pipeline benchmarks again, requires SUMO")
+    args = ap.parse_args()
+
+    if args.record:
+        record_pipeline_trace()
+
+    report = {"meta": get_meta(), "results": run_suites(args.suites)}
+    with open(args.output, "w") as fout:
+        json.dump(report, fout, indent=4)
+
+    failed = [name for name, result in report["results"].items() if "error" in result]
+    for name in failed:
+        print(f"{name} failed: {report['results'][name]['error']}")
+
+    if args.save_baseline:
+        if failed:
+            sys.exit(f"Baseline not saved, failed cases: {', '.join(failed)}")
+        with open(args.baseline, "w") as fout:
+            json.dump(report, fout, indent=4)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, "r") as fin:
+            baseline = json.load(fin)
+        comparison = compare_results(
+            report["results"], baseline["results"], args.tolerance, args.suites)
+        print(format_comparison(comparison))
+        if any([c["regressed"] for c in comparison.values()]):
+            sys.exit(1)
@@ -7,6 +7,7 @@ import json
 
 
 from tlsagents.base import TLSFactory
+import simbackend
 
 
 class FilenameValidate(confuse.Filename):
@@ -51,12 +52,15 @@ class AllowedContainers(confuse.templates.TypeTemplate):
         return repr(self.typ)
 
 
-def get_valid_config(args):
+def get_valid_config(args, overrides=None):
     """
-    Get a config dict for CLI and valdate all parameters
+    Get a config dict for CLI and valdate all parameters,
+    overrides dict takes priority over the values in the file
     """
     source = confuse.YamlSource(args.config)
     config = confuse.RootView([source])
+    if overrides:
+        config.set(overrides)
 
     job_template = {
         "job": {
@@ -74,10 +78,21 @@ def get_valid_config(args):
             confuse.MappingTemplate({
                 'ids': confuse.StrSeq(),
                 'data': confuse.Sequence(
-                   confuse.Choice(['objectives', 'state', 'variables'])),
+                   confuse.Choice(['objectives', 'state', 'variables', 'solver', 'shadows'])),
                 'timestamped': confuse.Optional(bool, default=True),
                 "to_file": confuse.Optional(bool, default=True),
-                "to_console": confuse.Optional(bool, default=False)
+                "to_console": confuse.Optional(bool, default=False),
+                "format": confuse.Optional(
+                    confuse.Choice(["text", "json", "binary"]), default="text")
+            })
+        )
+
+    job_template["job"]["replications"] = confuse.Optional(
+            confuse.MappingTemplate({
+                "seeds": confuse.Optional(confuse.Sequence(int)),
+                "n": confuse.Optional(int),
+                "base_seed": confuse.Optional(int, default=0),
+                "workers": confuse.Optional(int)
             })
         )
 
@@ -85,7 +100,12 @@ def get_valid_config(args):
         "dir": FilenameValidate(
             cwd=job_config.job.dir),
         "gui": confuse.Optional(bool, default=True),
+        "backend": confuse.Optional(
+            confuse.Choice(list(simbackend.BACKENDS)), default="traci"),
+        "trace": confuse.Optional(
+            confuse.Filename(cwd=job_config.job.dir), default=None),
         "max_steps": confuse.Optional(int, default=10e5),
+        "seed": confuse.Optional(int, default=None),
         "network": FilenameValidate(relative_to="dir"),
     }
     sumo_config = config.get({"sumo": sumo_template})
@@ -94,11 +114,7 @@ def get_valid_config(args):
     sumo_template["route"] = confuse.Sequence(
             FilenameValidate(cwd=sumo_config.sumo.dir))
 
-    tls_template = confuse.Sequence({
-        "id": str,
-        "controller": confuse.Choice(
-            TLSFactory.get_registered_keys()),
-        "constants": confuse.MappingValues(
+    constants_template = confuse.MappingValues(
             confuse.OneOf([
                 confuse.Number(),
                 AllowedContainers(list),
@@ -106,14 +122,28 @@ def get_valid_config(args):
                 FilenameValidate(cwd=job_config.job.dir),
                 ExecutableValidate()
             ])
-        ),
+        )
+    tls_template = confuse.Sequence({
+        "id": str,
+        "controller": confuse.Choice(
+            TLSFactory.get_registered_keys()),
+        "constants": constants_template,
         "variables": confuse.MappingValues(
             confuse.OneOf([
                 confuse.Number(),
                 AllowedContainers(list)
             ])
         ),
+        "neighbours": confuse.Optional(confuse.StrSeq(), default=None),
+        "shadows": confuse.Optional(
+            confuse.Sequence({
+                "name": str,
+                "controller": confuse.Choice(
+                    TLSFactory.get_registered_keys()),
+                "constants": confuse.Optional(constants_template, default={})
+            }), default=[]),
         "extract": {
+            "subscribe": confuse.Optional(bool, default=False),
             "user_data": confuse.Sequence({
                 "feature": confuse.Choice(
                     ["count", "speed", "eta", "delay", "waiting_time"]),
@@ -142,7 +172,35 @@ def get_valid_config(args):
     # second round of sumo validation
     assert len(valid_config.sumo.route) > 0, \
         "No demand definition: sumo.route is an empty list, expected at least one *.rou.xml"
+    assert simbackend.is_available(valid_config.sumo.backend), \
+        f"Backend {valid_config.sumo.backend} is requested by sumo.backend, but can not be imported"
+    assert not (valid_config.sumo.backend == "libsumo" and valid_config.sumo.gui), \
+        "libsumo backend runs SUMO in-process without GUI, set sumo.gui: False"
+    if valid_config.sumo.backend == "replay":
+        assert valid_config.sumo.trace is not None and os.path.isfile(valid_config.sumo.trace), \
+            "replay backend serves TraCI responses from a recorded trace, set sumo.trace to a recorded file"
     
+    # second round of tls validation, neighbours have to be controlled
+    tls_ids = [tls.id for tls in valid_config.tls]
+    for tls in valid_config.tls:
+        for neighbour in tls.neighbours or []:
+            assert neighbour in tls_ids, \
+                f"@tls: neighbour {neighbour} of {tls.id} is not a controlled TLS"
+        shadow_names = [shadow.name for shadow in tls.shadows]
+        assert len(shadow_names) == len(set(shadow_names)), \
+            f"@tls: shadows of {tls.id} have to have unique names, got {shadow_names}"
+
+    # second round of replications validation, expand seeds
+    replications = valid_config.job.replications
+    if replications:
+        if replications.seeds is None:
+            assert replications.n is not None and replications.n > 0, \
+                "job.replications requires either a list of seeds or a number of replications n"
+            replications.seeds = list(range(
+                replications.base_seed, replications.base_seed + replications.n))
+        assert len(set(replications.seeds)) == len(replications.seeds), \
+            "job.replications.seeds should be unique"
+
     # second round of logger validation, look if ids are given
     if valid_config.logging:
         if valid_config.logging.ids and valid_config.logging.data:
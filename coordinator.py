@@ -0,0 +1,171 @@
+import copy
+from time import perf_counter
+
+from feature_extraction import StepCache
+
+
+def get_lane_edge(lane_id):
+    """
+    Edge of a lane, i.e. NC_2 -> NC
+    """
+    return lane_id.rsplit("_", 1)[0]
+
+
+def get_neighbours(topo, tls_ids):
+    """
+    TLS are neighbours if an edge leaving one of them is controlled
+    by the other one, pedestrian links are ignored
+    """
+    incoming = {}
+    outgoing = {}
+    for tls_id in tls_ids:
+        if topo is None or not topo.has_tls(tls_id):
+            continue
+        links = [link for links in topo.get_controlled_links(tls_id) for link in links]
+        incoming[tls_id] = set(
+            [get_lane_edge(l[0]) for l in links if not l[0].startswith(":")])
+        outgoing[tls_id] = set(
+            [get_lane_edge(l[1]) for l in links if not l[1].startswith(":")])
+
+    neighbours = {tls_id: [] for tls_id in tls_ids}
+    for a in incoming:
+        for b in incoming:
+            if a != b and (outgoing[a] & incoming[b] or outgoing[b] & incoming[a]):
+                neighbours[a].append(b)
+    return neighbours
+
+
+class StepCoordinator:
+    """
+    Network level step of all agents. Observations are extracted with a
+    shared StepCache, so lanes observed by several TLS are queried once per
+    step, and agents can read observations of their neighbours. TLS are
+    extracted only once their observation is requested, from the next
+    step on in one pass before the agents update. Shadow agents of a TLS, {tls_id:
+    {name: agent}}, decide on the same observation without switching the TLS.
+    Stages of the step are timed per TLS if a StepProfiler is given
+    """
+    def __init__(self, tls_list, neighbours=None, shadows=None, profiler=None):
+        self.agents = {tls.tls_id: tls for tls in tls_list}
+        self.neighbours = neighbours if neighbours is not None else {}
+        self.shadows = shadows if shadows is not None else {}
+        self.profiler = profiler
+        self.latencies = {}
+        self.cache = StepCache()
+        self.observations = {}
+        self.observed = set()
+        for tls in tls_list:
+            tls.coordinator = self
+        for tls_shadows in self.shadows.values():
+            for shadow in tls_shadows.values():
+                shadow.coordinator = self
+                shadow.actuate = False
+
+    def run_stage(self, stage, tls_id, func, *args):
+        """
+        Call func, timed as the stage of the TLS if there is a profiler
+        """
+        if self.profiler is None:
+            return func(*args)
+        t_start = self.profiler.start()
+        result = func(*args)
+        self.profiler.stop(t_start, stage, tls_id)
+        return result
+
+    def begin_step(self):
+        """
+        Drop observations of the previous step
+        """
+        self.cache = StepCache()
+        self.observations = {}
+
+    def observe_all(self):
+        """
+        Batched extraction of the TLS observed in earlier steps, agents
+        that never observe, i.e. timed ones, are not extracted
+        """
+        for tls_id in self.agents:
+            if tls_id in self.observed and tls_id not in self.observations:
+                self.run_stage("extract", tls_id, self.extract, tls_id)
+        return self.observations
+
+    def prepare_all(self):
+        """
+        Let all agents start their work for the step before any agent updates
+        """
+        for tls in self.agents.values():
+            self.run_stage("prepare", tls.tls_id, self.prepare_agent, tls)
+
+    def prepare_agent(self, tls):
+        tls.prepare_step()
+        for shadow in self.shadows.get(tls.tls_id, {}).values():
+            shadow.prepare_step()
+
+    def update_agent(self, tls):
+        """
+        Let the agent decide and switch its TLS, then its shadows decide
+        """
+        next_phase = self.run_stage("decide", tls.tls_id, tls.calculate_next_phase)
+        self.run_stage("set_phase", tls.tls_id, tls.apply_phase, next_phase)
+        if tls.tls_id in self.shadows:
+            self.run_stage("shadows", tls.tls_id, self.update_shadows, tls.tls_id)
+
+    def update_shadows(self, tls_id):
+        """
+        Let the shadows of the TLS decide and time their decisions
+        """
+        for name, shadow in self.shadows.get(tls_id, {}).items():
+            t_start = perf_counter()
+            next_phase = shadow.calculate_next_phase()
+            self.latencies[(tls_id, name)] = perf_counter() - t_start
+            shadow.apply_phase(next_phase)
+
+    def describe_shadows(self, tls_id):
+        """
+        {name: decision} of the shadows of the TLS in the step, latency
+        of the decision in seconds and whether it agrees with the active agent
+        """
+        active = self.agents[tls_id]
+        return {name: {
+            "phase": shadow.phase,
+            "elapsed": shadow.elapsed,
+            "latency": self.latencies.get((tls_id, name)),
+            "agrees": shadow.phase == active.phase
+            } for name, shadow in self.shadows.get(tls_id, {}).items()}
+
+    def extract(self, tls_id):
+        pipeline = self.agents[tls_id].data_pipeline
+        self.observations[tls_id] = None
+        if pipeline is not None:
+            self.observations[tls_id] = pipeline.extract(self.cache)
+
+    def get_observation(self, tls_id, agent=None):
+        """
+        Observation of the TLS in the current step, None for agents without data
+        pipeline. The agent of the TLS gets the extracted variables, neighbours,
+        shadows and other callers a copy they can not change them through
+        """
+        self.observed.add(tls_id)
+        if tls_id not in self.observations:
+            self.extract(tls_id)
+        observation = self.observations[tls_id]
+        if observation is None or agent is self.agents[tls_id]:
+            return observation
+        return copy.deepcopy(observation)
+
+    def get_neighbour_observations(self, tls_id):
+        """
+        {neighbour_id: observation} of the neighbours running in this coordinator
+        """
+        return {n: self.get_observation(n)
+            for n in self.neighbours.get(tls_id, []) if n in self.agents}
+
+    def step(self):
+        """
+        Observe all, prepare all and let every agent update its tls
+        """
+        self.begin_step()
+        self.observe_all()
+        self.prepare_all()
+        for tls in self.agents.values():
+            self.update_agent(tls)
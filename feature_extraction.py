@@ -1,12 +1,49 @@
-import traci
+from simbackend import sim
+import traci.constants as tc
 import copy
 
+import topology
+
+def get_topology(tls_id):
+    """
+    Active network topology if it knows the tls, static network data
+    is then read from it instead of querying SUMO
+    """
+    topo = topology.get_active()
+    if topo is not None and topo.has_tls(tls_id):
+        return topo
+    return None
+
+def get_controlled_links(tls_id):
+    topo = get_topology(tls_id)
+    if topo is not None:
+        return topo.get_controlled_links(tls_id)
+    return sim.trafficlight.getControlledLinks(tls_id)
+
+def get_controlled_lanes(tls_id):
+    topo = get_topology(tls_id)
+    if topo is not None:
+        return topo.get_controlled_lanes(tls_id)
+    return sim.trafficlight.getControlledLanes(tls_id)
+
+def get_walking_edges(tls_id):
+    topo = get_topology(tls_id)
+    if topo is not None:
+        return topo.get_walking_edges(tls_id)
+    return [e for e in sim.edge.getIDList() if e.startswith(f":{tls_id}_w")]
+
+def get_crossing_edges(tls_id):
+    topo = get_topology(tls_id)
+    if topo is not None:
+        return topo.get_crossing_edges(tls_id)
+    return [e for e in sim.edge.getIDList() if e.startswith(f":{tls_id}_c")]
+
 def add_phase(state, target, tls_id):
     """
     Extracts and inserts TLS phase with traci 
     to the state passed to Stratego
     """
-    phase = traci.trafficlight.getPhase(tls_id)
+    phase = sim.trafficlight.getPhase(tls_id)
     if isinstance(state[target], list):
         state[target][phase] = 1
     else:
@@ -18,7 +55,7 @@ def add_duration(state, target, tls_id):
     Extracts and inserts TLS phase duration with traci 
     to the state dict
     """
-    duration = traci.trafficlight.getPhaseDuration(tls_id)
+    duration = sim.trafficlight.getPhaseDuration(tls_id)
     state[target] = float(duration)
     return state
 
@@ -26,8 +63,8 @@ def add_elapsed(state, target, tls_id):
     """
     Extracts and inserts elapsed time of TLS phase to the state dict 
     """
-    duration = traci.trafficlight.getPhaseDuration(tls_id)
-    remainder = traci.trafficlight.getNextSwitch(tls_id) - traci.simulation.getTime()
+    duration = sim.trafficlight.getPhaseDuration(tls_id)
+    remainder = sim.trafficlight.getNextSwitch(tls_id) - sim.simulation.getTime()
     state[target] = float(duration - remainder)
     return state
 
@@ -36,7 +73,7 @@ def add_queue(state, target, lane):
     Extracts and inserts accumulated number of vehicles
     to the state passed to Stratego
     """
-    number = traci.lane.getLastStepVehicleNumber(lane)
+    number = sim.lane.getLastStepVehicleNumber(lane)
     if isinstance(target, list):
         key, idx = target
         state[key][idx] += number
@@ -55,52 +92,215 @@ def add_to_state(state, target, value):
         state[target] += value
     return state
 
-def add_typed_lane_count(state, lane, target, user_class="passenger"):
+def add_typed_lane_count(state, lane, target, user_class="passenger", cache=None):
     """
     Extracts accumulated number of users from a lane and inserts
     to the state passed to Stratego
     """
-    ids = traci.lane.getLastStepVehicleIDs(lane)
-    number = sum([1 for i in ids if traci.vehicle.getVehicleClass(i) == user_class])
+    if cache is None:
+        cache = StepCache()
+    ids = cache.get_lane_vehicle_ids(lane)
+    number = sum([1 for i in ids if cache.get_vehicle_class(i) == user_class])
+    state = add_to_state(state, target, number)
+    return state
+
+def subscribe_lane(lane):
+    """
+    Subscribes to the ids of the vehicles on the lane, the results
+    are refreshed by SUMO after every simulation step
+    """
+    sim.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_ID_LIST])
+
+def get_subscribed_vehicle_class(vehicle, vehicle_results):
+    """
+    Reads vehicle class from subscription results, vehicles seen for the
+    first time are subscribed to, the subscription ends when they leave
+    """
+    result = vehicle_results.get(vehicle)
+    if not result or tc.VAR_VEHICLECLASS not in result:
+        sim.vehicle.subscribe(vehicle, [tc.VAR_VEHICLECLASS])
+        result = sim.vehicle.getSubscriptionResults(vehicle)
+    return result[tc.VAR_VEHICLECLASS]
+
+def add_subscribed_lane_count(state, lane, target, lane_results, vehicle_results,
+        user_class="passenger"):
+    """
+    Same as add_typed_lane_count, but reads vehicle ids and classes from
+    lane and vehicle subscription results instead of querying them
+    """
+    ids = lane_results[lane][tc.LAST_STEP_VEHICLE_ID_LIST]
+    number = sum([1 for i in ids
+        if get_subscribed_vehicle_class(i, vehicle_results) == user_class])
     state = add_to_state(state, target, number)
     return state
 
-def add_typed_phase_count(state, tls_id, phase_id, target, user_class="passenger"):
+def add_typed_phase_count(state, tls_id, phase_id, target, user_class="passenger",
+        phase_index=None, cache=None):
     """
     Extracts accumulated number of users served by tls phase and inserts
-    to the state passed to Stratego
+    to the state passed to Stratego, lanes and crossings of the phase are
+    taken from phase_index if given, otherwise they are queried
     """
+    if cache is None:
+        cache = StepCache()
 
     # if pedestrian requested just use tls function to get served count at phase_id,
     # otherwise, extract lanes enabled for the phase_id and reuse lane count fcn
-    ctrl_links = traci.trafficlight.getControlledLinks(tls_id)
-    phase_lights = traci.trafficlight.getAllProgramLogics(
-        tls_id)[-1].getPhases()[phase_id].state
-
-    phase_links = set(
-        [lane[0] for lane, col in zip(ctrl_links, phase_lights) if col.lower() == 'g'])
+    if phase_index is None:
+        phase_index = TLSPhaseIndex(tls_id, phases=[phase_id])
 
     if user_class == "pedestrian":
-        ped_edges = [e for e in traci.edge.getIDList() if e.startswith(f":{tls_id}_w")]
-        phase_cross_edges = [link[1].rsplit("_", 1)[0] for link in phase_links if link[0].startswith(":")]
+        phase_cross_edges = phase_index.get_crossing_edges(phase_id)
+        ped_edges = phase_index.walking_edges
         
         number = 0
         for edge in ped_edges:
-            peds = traci.edge.getLastStepPersonIDs(edge)
+            peds = cache.get_edge_person_ids(edge)
             # what?
             for ped in peds:
-                if (traci.person.getWaitingTime(ped) >= 1 and 
-                    traci.person.getNextEdge(ped) in phase_cross_edges):
+                waiting_time, next_edge = cache.get_person_state(ped)
+                if waiting_time >= 1 and next_edge in phase_cross_edges:
                     number += 1
         state = add_to_state(state, target, number)
     else:
-        lanes = set([lanes[0] for lanes in phase_links])
+        lanes = phase_index.get_lanes(phase_id)
         for lane in lanes:
-            state = add_typed_lane_count(state, lane, target, user_class)
+            state = add_typed_lane_count(state, lane, target, user_class, cache)
 
     return state
 
 
+class StepCache:
+    """
+    Memoizes SUMO queries of a single simulation step, pipelines sharing
+    the cache read overlapping lanes, vehicles and pedestrians only once
+    """
+    def __init__(self):
+        self.lane_vehicles = {}
+        self.vehicle_classes = {}
+        self.edge_persons = {}
+        self.persons = {}
+        self.subscription_results = None
+
+    def get_lane_vehicle_ids(self, lane):
+        if lane not in self.lane_vehicles:
+            self.lane_vehicles[lane] = sim.lane.getLastStepVehicleIDs(lane)
+        return self.lane_vehicles[lane]
+
+    def get_vehicle_class(self, vehicle):
+        if vehicle not in self.vehicle_classes:
+            self.vehicle_classes[vehicle] = sim.vehicle.getVehicleClass(vehicle)
+        return self.vehicle_classes[vehicle]
+
+    def get_edge_person_ids(self, edge):
+        if edge not in self.edge_persons:
+            self.edge_persons[edge] = sim.edge.getLastStepPersonIDs(edge)
+        return self.edge_persons[edge]
+
+    def get_person_state(self, person):
+        """
+        Waiting time and next edge of a pedestrian
+        """
+        if person not in self.persons:
+            self.persons[person] = (
+                sim.person.getWaitingTime(person), sim.person.getNextEdge(person))
+        return self.persons[person]
+
+    def get_subscription_results(self):
+        """
+        Lane and vehicle subscription results of all pipelines, fetched once per step
+        """
+        if self.subscription_results is None:
+            self.subscription_results = (
+                sim.lane.getAllSubscriptionResults(),
+                sim.vehicle.getAllSubscriptionResults())
+        return self.subscription_results
+
+
+def get_program_logic(tls_id, tls_program_id=-1):
+    """
+    Logic of the tls program, tls_program_id is the position in the
+    loaded programs or the SUMO program id
+    """
+    logics = sim.trafficlight.getAllProgramLogics(tls_id)
+    if isinstance(tls_program_id, str):
+        for logic in logics:
+            if logic.programID == tls_program_id:
+                return logic
+        raise KeyError(f"TLS {tls_id} has no program {tls_program_id}")
+    return logics[tls_program_id]
+
+
+class TLSPhaseIndex:
+    """
+    Lookup of green incoming lanes and pedestrian crossing edges for
+    each phase of a tls program. Built once and rebuilt only after
+    invalidate() is called on program switch
+    """
+    def __init__(self, tls_id, tls_program_id=-1, phases=None):
+        self.tls_id = tls_id
+        self.tls_program_id = tls_program_id
+        self.phases = phases
+
+        self.program_id = None
+        self.walking_edges = []
+        self.lanes = {}
+        self.crossing_edges = {}
+        self.is_valid = False
+        self.build()
+
+    def build(self):
+        """
+        Query controlled links and phase states of the program
+        and group the green links by phase
+        """
+        logic = get_program_logic(self.tls_id, self.tls_program_id)
+        ctrl_links = get_controlled_links(self.tls_id)
+
+        self.program_id = logic.programID
+        self.walking_edges = get_walking_edges(self.tls_id)
+        self.lanes = {}
+        self.crossing_edges = {}
+
+        phase_ids = self.phases
+        if phase_ids is None:
+            phase_ids = range(len(logic.getPhases()))
+
+        for phase_id in phase_ids:
+            phase_lights = logic.getPhases()[int(phase_id)].state
+            phase_links = set(
+                [lane[0] for lane, col in zip(ctrl_links, phase_lights) if col.lower() == 'g'])
+            self.lanes[int(phase_id)] = set([link[0] for link in phase_links])
+            self.crossing_edges[int(phase_id)] = set(
+                [link[1].rsplit("_", 1)[0] for link in phase_links if link[0].startswith(":")])
+        self.is_valid = True
+
+    def invalidate(self, tls_program_id=None):
+        """
+        Mark the index outdated, i.e. after switching tls program,
+        it is rebuilt on next lookup
+        """
+        if tls_program_id is not None:
+            self.tls_program_id = tls_program_id
+        self.is_valid = False
+
+    def get_lanes(self, phase_id):
+        """
+        Incoming lanes that have green light during the phase
+        """
+        if not self.is_valid:
+            self.build()
+        return self.lanes[int(phase_id)]
+
+    def get_crossing_edges(self, phase_id):
+        """
+        Pedestrian crossing edges that have green light during the phase
+        """
+        if not self.is_valid:
+            self.build()
+        return self.crossing_edges[int(phase_id)]
+
+
 class TLSDataPipeline:
     """
     Populates state with data about tls and lanes depending on
@@ -114,15 +314,49 @@ class TLSDataPipeline:
         self.state = {}
 
         self.detectors = None
-        self.controlled_lanes = traci.trafficlight.getControlledLanes(self.tls_id)
-        self.walking_edges = [
-            e for e in traci.edge.getIDList() if e.startswith(f":{self.tls_id}_w")]
-        self.crossing_edges = [
-            e for e in traci.edge.getIDList() if e.startswith(f":{self.tls_id}_c")]
+        self.controlled_lanes = get_controlled_lanes(self.tls_id)
+        self.walking_edges = get_walking_edges(self.tls_id)
+        self.crossing_edges = get_crossing_edges(self.tls_id)
         self.n_ped_signals = len(self.crossing_edges)
 
         self.validate_targets()
 
+        self.phase_index = TLSPhaseIndex(self.tls_id, self.tls_program_id)
+
+        # lanes whose vehicles are read from subscription results
+        self.is_subscribed = query.get("subscribe", False)
+        if self.is_subscribed:
+            self.subscribe()
+
+    def switch_program(self, tls_program_id):
+        """
+        Point the pipeline to another program of the tls, position or SUMO
+        program id, the phase index and lane subscriptions are renewed
+        for the new program
+        """
+        self.tls_program_id = tls_program_id
+        # rebuilt right away, so the index names the program in use
+        self.phase_index.invalidate(tls_program_id)
+        self.phase_index.build()
+        if self.is_subscribed:
+            self.subscribe()
+
+    def subscribe(self):
+        """
+        Registers subscriptions for all lanes the query counts vehicles at,
+        pedestrian counts are still queried every step
+        """
+        for q in self.query["user_data"]:
+            if q["feature"] != "count" or q["user_class"] == "pedestrian":
+                continue
+            if q["at"] == "lane":
+                for lane in q["mapping"]:
+                    subscribe_lane(lane)
+            elif q["at"] == "phase":
+                for phase in q["mapping"]:
+                    for lane in self.phase_index.get_lanes(phase):
+                        subscribe_lane(lane)
+
     def reset_state(self):
         self.state = copy.deepcopy(self.state_template)
 
@@ -131,9 +365,9 @@ class TLSDataPipeline:
         Check whether state template variables area available for writting 
         extracted simulation data
         """
-        lane_ids = traci.lane.getIDList()
-        phase_count = len(traci.trafficlight.getAllProgramLogics(
-            self.tls_id)[self.tls_program_id].getPhases())
+        topo = get_topology(self.tls_id)
+        lane_ids = topo.lanes if topo is not None else sim.lane.getIDList()
+        phase_count = len(get_program_logic(self.tls_id, self.tls_program_id).getPhases())
 
         # validate user data
         for q in self.query["user_data"]:
@@ -159,11 +393,21 @@ class TLSDataPipeline:
                     assert target_var in self.state_template.keys(), \
                     f"{target_var} is not in target variables"
 
-    def extract(self):
+    def extract(self, cache=None):
+        """
+        Extract the state, cache shares the queries with the other
+        pipelines extracted in the same step
+        """
+        if cache is None:
+            cache = StepCache()
+        # program switched in SUMO, i.e. by setProgram
+        program_id = sim.trafficlight.getProgram(self.tls_id)
+        if program_id != self.phase_index.program_id:
+            self.switch_program(program_id)
         self.reset_state()
         for q in self.query["user_data"]:
             if q["feature"] == "count":
-                self.extract_counts(q["at"], q["user_class"], q["mapping"])
+                self.extract_counts(q["at"], q["user_class"], q["mapping"], cache)
             elif q["feature"] == "speed":
                 raise NotImplementedError
             elif q["feature"] == "eta":
@@ -181,17 +425,40 @@ class TLSDataPipeline:
            
         return self.state
 
-    def extract_counts(self, origin, user_class, mapping):
+    def extract_counts(self, origin, user_class, mapping, cache=None):
         """
         Extracts and adds queue length of given vtype
         """
-        if origin == "lane": 
+        if cache is None:
+            cache = StepCache()
+        if self.is_subscribed and user_class != "pedestrian":
+            self.extract_subscribed_counts(origin, user_class, mapping, cache)
+        elif origin == "lane": 
             for lane, target_var in mapping.items():
-                add_typed_lane_count(self.state, lane, target_var, user_class)
+                add_typed_lane_count(self.state, lane, target_var, user_class, cache)
         elif origin == "detector":
             #for detector, target_var in mapping.items():
             NotImplementedError
         elif origin == "phase":
             for phase, target_var in mapping.items():
                 add_typed_phase_count(
-                    self.state, self.tls_id, phase, target_var, user_class)
+                    self.state, self.tls_id, phase, target_var, user_class,
+                    self.phase_index, cache)
+
+    def extract_subscribed_counts(self, origin, user_class, mapping, cache=None):
+        """
+        Extracts and adds queue length of given vtype from the
+        subscription results of the last simulation step
+        """
+        if cache is None:
+            cache = StepCache()
+        lane_results, vehicle_results = cache.get_subscription_results()
+        if origin == "lane":
+            for lane, target_var in mapping.items():
+                add_subscribed_lane_count(self.state, lane, target_var,
+                    lane_results, vehicle_results, user_class)
+        elif origin == "phase":
+            for phase, target_var in mapping.items():
+                for lane in self.phase_index.get_lanes(phase):
+                    add_subscribed_lane_count(self.state, lane, target_var,
+                        lane_results, vehicle_results, user_class)
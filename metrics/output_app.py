@@ -1,5 +1,6 @@
 import argparse
 import json
+from collections import OrderedDict
 
 import dash
 import dash_core_components as dcc
@@ -35,10 +36,68 @@ class DataModel():
         "mean": weighted_mean_agg
     }
 
-    def __init__(self, data: pd.DataFrame):
+    def __init__(self, data: pd.DataFrame, cache_size: int=8):
         self.data = data
+        self.cache_size = cache_size
 
-    def get_timeseries(self, run, metric, lane_group):
+        # time series of every (run, lane_group, metric) per lane group column,
+        # the default grouping is aggregated at load, others on first use
+        self.group_columns = sorted(
+            [c for c in data.columns if oh.is_lane_group_column(c)],
+            key=lambda c: (c != oh.LANE_GROUP, c))
+        self.indices = {oh.LANE_GROUP: self.build_index(self.data)}
+        self.group_map_indices = OrderedDict()
+
+    def build_index(self, data: pd.DataFrame, group_column: str=oh.LANE_GROUP) -> dict:
+        """
+        Vectorized time wise aggregation of all metrics for all runs and lane groups,
+        aggregation depends on the metric prefix as in aggregation_strategy
+        """
+        keys = ["run_name", group_column, "begin"]
+        metrics = self.get_metrics()
+        df_agg = oh.aggregate_metrics(data[keys + ["count"] + metrics], keys)
+
+        index = {}
+        for (run, lane_group), df in df_agg.groupby(
+                ["run_name", group_column], sort=False, observed=True):
+            t = df["begin"].to_numpy()
+            for metric in metrics:
+                index[(run, lane_group, metric)] = (t, df[metric].to_numpy())
+        return index
+
+    def get_index(self, group_map: dict=None, group_column: str=oh.LANE_GROUP) -> dict:
+        """
+        Index of the loaded lane group column or, if given, of an ad-hoc group map,
+        indices of the recently used group maps are memoized
+        """
+        if group_map is None:
+            if group_column not in self.indices:
+                self.indices[group_column] = self.build_index(self.data, group_column)
+            return self.indices[group_column]
+
+        key = json.dumps(group_map, sort_keys=True)
+        if key in self.group_map_indices:
+            self.group_map_indices.move_to_end(key)
+        else:
+            data = self.data[["run_name", "begin", "lane", "count"] + self.get_metrics()]
+            data = oh.add_lane_group_column(data, group_map)
+            self.group_map_indices[key] = self.build_index(data)
+            if len(self.group_map_indices) > self.cache_size:
+                self.group_map_indices.popitem(last=False)
+        return self.group_map_indices[key]
+
+    def get_timeseries(self, run, metric, lane_group, group_map=None, group_column=oh.LANE_GROUP):
+        index = self.get_index(group_map, group_column)
+        series = index.get((run, lane_group, metric))
+        if series is None:
+            t, x = np.array([[0, 0]]).T
+            series = (t, x)
+        return series
+
+    def scan_timeseries(self, run, metric, lane_group):
+        """
+        Reference aggregation scanning the whole frame on every call
+        """
         df = self.data.loc[
             (self.data["run_name"] == run) &
             (self.data["lane_group"] == lane_group)
@@ -78,20 +137,39 @@ class DataModel():
         Return list of metrics found in the runs
         """
         non_metric = DataModel.NON_METRICS
-        return [c for c in self.data.columns if c not in non_metric]
+        return [c for c in self.data.columns
+            if c not in non_metric and not oh.is_lane_group_column(c)]
 
-    def get_lane_groups(self):
+    def get_group_columns(self):
+        """
+        Return list of lane group columns, one per loaded group map
+        """
+        return self.group_columns
+
+    def get_lane_groups(self, group_column=oh.LANE_GROUP):
         """
         Return list of lane_groups found in the runs
         """
-        return self.data["lane_group"].unique()
+        return self.data[group_column].unique()
 
 class DashView():
     COLOR_PALETTE = px.colors.qualitative.Plotly
     MAX_COLORS = len(COLOR_PALETTE)
-    def __init__(self, datamodel):
+    TRACE_TYPES = {
+        "svg": go.Scatter,
+        "webgl": go.Scattergl
+    }
+    def __init__(self, datamodel, render_mode="svg", max_points=None, downsample="lttb"):
         self.app = dash.Dash(__name__)
         self.datamodel = datamodel
+        self.trace_type = DashView.TRACE_TYPES[render_mode]
+        self.max_points = max_points
+        self.downsample = oh.DOWNSAMPLERS[downsample]
+
+        # colors follow the run, not its position in the selection
+        run_names = list(self.datamodel.get_run_names())
+        self.run_colors = {r: DashView.COLOR_PALETTE[k % DashView.MAX_COLORS]
+            for k, r in enumerate(run_names)}
         self.generate_layout()
         self.generate_callbacks()
 
@@ -118,6 +196,13 @@ class DashView():
                 value=self.datamodel.get_metrics()[:1],
                 multi=True
             ),
+            html.Label('Group lanes by'),
+            dcc.Dropdown(
+                id="input_grouping",
+                options=[{"label": c, "value": c} for c in self.datamodel.get_group_columns()],
+                value=oh.LANE_GROUP,
+                clearable=False
+            ),
             html.Label('Select lane groups'),
             dcc.Dropdown(
                 id="input_groups",
@@ -134,12 +219,27 @@ class DashView():
 
 
     def generate_callbacks(self):
+        self.app.callback(
+            [dd.Output('input_groups', 'options'),
+            dd.Output('input_groups', 'value')],
+            [dd.Input('input_grouping', 'value')],
+        )(self.update_groups)
+
         self.app.callback(
             dd.Output('graph', 'figure'),
             [dd.Input('input_runs', 'value'),
             dd.Input('input_metrics', 'value'),
             dd.Input('input_groups', 'value')],
-        )(self.update_subplot)
+            [dd.State('input_grouping', 'value'),
+            dd.State('graph', 'figure')],
+        )(self.update_figure)
+
+    def update_groups(self, grouping):
+        """
+        Lists lane groups of the selected group column
+        """
+        groups = [g for g in self.datamodel.get_lane_groups(grouping) if not pd.isna(g)]
+        return [{"label": r, "value": r} for r in groups], list(groups[:1])
 
     def update_labels(self, figure, row_names, column_names):
         """
@@ -157,7 +257,57 @@ class DashView():
                     {xaxis_name: {"title": "time [s]"}})
     
 
-    def update_subplot(self, runs, metrics, groups):
+    def make_trace(self, run, metric, group, grouping, show_legend):
+        """
+        Trace of a single time series, downsampled to max_points if set
+        """
+        t, x = self.datamodel.get_timeseries(
+            run, metric, group, group_column=grouping)
+        if self.max_points and len(t) > self.max_points:
+            t, x = self.downsample(t, x, self.max_points)
+
+        return self.trace_type(**{
+            "x": t,
+            "y": x,
+            "name": run,
+            "legendgroup": run,
+            "marker": {"color": self.run_colors.get(run), "size": 12},
+            "showlegend": show_legend,
+            })
+
+    def update_figure(self, runs, metrics, groups, grouping=oh.LANE_GROUP, figure=None):
+        """
+        Adds and removes traces of the existing figure when only the selected runs change,
+        other changes rebuild the subplots
+        """
+        layout_key = {"metrics": metrics, "groups": groups, "grouping": grouping}
+        if figure is None or figure["layout"].get("meta") != layout_key:
+            return self.update_subplot(runs, metrics, groups, grouping)
+
+        patch = dash.Patch() if hasattr(dash, "Patch") else figure
+        shown = [trace["name"] for trace in figure["data"]]
+        # delete from the back so the remaining indices stay valid
+        for k in reversed(range(len(shown))):
+            if shown[k] not in runs:
+                del patch["data"][k]
+
+        n_groups = len(groups)
+        new_traces = []
+        for run in runs:
+            if run in shown:
+                continue
+            for i, metric in enumerate(metrics):
+                for j, group in enumerate(groups):
+                    p = i * n_groups + j
+                    trace = self.make_trace(
+                        run, metric, group, grouping, i == 0 and j == 0).to_plotly_json()
+                    trace["xaxis"] = "x" if p == 0 else f"x{p + 1}"
+                    trace["yaxis"] = "y" if p == 0 else f"y{p + 1}"
+                    new_traces.append(trace)
+        patch["data"].extend(new_traces)
+        return patch
+
+    def update_subplot(self, runs, metrics, groups, grouping=oh.LANE_GROUP):
         """
         Updates the amount adn the contetns of the plots depending on the dropbox
         entries 
@@ -176,28 +326,19 @@ class DashView():
             subplot_titles=groups)
         
         # generate plots
-        for k, run in enumerate(runs):
-            color = DashView.COLOR_PALETTE[k % DashView.MAX_COLORS]
+        for run in runs:
             for i, metric in enumerate(metrics):
                 for j, group in enumerate(groups):    
-                    
-                    # x = self.datamodel.get_data(run, metric, user)
-                    t, x = self.datamodel.get_timeseries(run, metric, group)
-
-                    fig.append_trace(go.Scatter(**{
-                        "x": t,
-                        "y": x,
-                        "name": run,
-                        "marker": {"color": color, "size": 12},
-                        "showlegend": i == 0 and j == 0,
-                        }), i + 1, j + 1)
+                    fig.append_trace(self.make_trace(
+                        run, metric, group, grouping, i == 0 and j == 0), i + 1, j + 1)
 
         # update labels and legend
         self.update_labels(
             fig, row_names=metrics, column_names=groups)
         fig.update_layout(
             barmode="overlay",
-            legend_title_text='Run names:')
+            legend_title_text='Run names:',
+            meta={"metrics": metrics, "groups": groups, "grouping": grouping})
         return fig
 
 
@@ -217,24 +358,45 @@ def main(args):
     df = oh.output_folder_to_pandas(
         args.folder, 
         DET_METRICS,
-        EMIT_METRICS)
+        EMIT_METRICS,
+        use_cache=not args.no_cache,
+        n_workers=args.workers,
+        interval=args.interval,
+        compact=args.compact)
 
 
-    group_map = {}
-    if args.groups:
-        with open(args.groups, "r") as fin:
-            group_map = json.load(fin)
+    group_maps = oh.read_group_maps(args.groups)
+    group_map = next(iter(group_maps.values()), {})
     df = oh.add_lane_group_column(df, group_map)
+    if len(group_maps) > 1:
+        df = oh.add_lane_group_columns(df, group_maps)
+    if args.compact:
+        df = oh.compact_frame(df)
 
     dm = DataModel(df)
-    view = DashView(dm)
+    view = DashView(dm, args.render_mode, args.max_points, args.downsample)
     view.start()
 
 if __name__ == '__main__':
     ag = argparse.ArgumentParser()
     ag.add_argument("-f", "--folder", type=str, required=True, help=
         "Path to the folder with detector and lane emissions output")
-    ag.add_argument("-g", "--groups", type=str, default=None, help=
-        "path to JSON for grouping lanes by leg and creating lane_groups column in Pandas")
+    ag.add_argument("-g", "--groups", type=str, nargs="+", default=[], help=
+        "paths to JSONs for grouping lanes by leg, the first one creates lane_group column, " \
+        "all of them lane_group_<file name> columns selectable in the app")
+    ag.add_argument("-j", "--workers", type=int, default=None, help=
+        "number of processes parsing runs in parallel, default: number of cores")
+    ag.add_argument("-i", "--interval", type=float, default=None, help=
+        "merge detector intervals to bins of this many seconds before plotting")
+    ag.add_argument("--compact", action="store_true", help=
+        "store identifiers as categoricals and metrics as float32 to save memory")
+    ag.add_argument("--render-mode", type=str, default="svg", choices=DashView.TRACE_TYPES, help=
+        "draw traces as SVG or with WebGL, which stays responsive with many long series")
+    ag.add_argument("--max-points", type=int, default=None, help=
+        "downsample every trace to at most this many points, about the plot width in pixels")
+    ag.add_argument("--downsample", type=str, default="lttb", choices=oh.DOWNSAMPLERS, help=
+        "downsampling method, lttb keeps the shape, minmax keeps all peaks")
+    ag.add_argument("--no-cache", action="store_true", help=
+        "parse all outputs again instead of reusing runs cached in <folder>/.cache")
     args = ag.parse_args()
     main(args)
@@ -1,12 +1,39 @@
 
 import os
+import glob
 import argparse
+import hashlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import Element
+from statistics import NormalDist
+import numpy as np
 import pandas as pd
 import json
 from dataclasses import dataclass
 
+# columns that are not aggregated as metrics
+NON_METRICS = ["run_name", "experiment", "replication",
+    "begin", "end", "lane", "lane_group", "count"]
+
+# lane group columns, lane_group or lane_group_<map name> for additional group maps
+LANE_GROUP = "lane_group"
+
+# string columns stored as categoricals in compact frames
+ID_COLUMNS = ["run_name", "experiment", "replication", "lane"]
+
+# replication runs are named <experiment>-seed<seed>
+REPLICATION_SEP = "-seed"
+
+# parsed runs are cached next to the outputs, as parquet if pyarrow is installed
+CACHE_DIR = ".cache"
+try:
+    import pyarrow
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pkl"
+
 @dataclass(frozen=True)
 class Metric:
     sumo_name: str
@@ -180,7 +207,9 @@ def search_folder(path: str, extensions: dict, prefix_sep="_") -> dict:
     the same run.
     """
     runs = {}
-    for filename in os.listdir(path):
+    for filename in sorted(os.listdir(path)):
+        if not any([filename.endswith(p) for p in extensions.values()]):
+            continue
         run_name = filename.split(prefix_sep)[0]
         if run_name not in runs:
             runs[run_name] = {k: "" for k in extensions.keys()}
@@ -191,15 +220,104 @@ def search_folder(path: str, extensions: dict, prefix_sep="_") -> dict:
     return runs
 
 
+def init_interval_columns(metrics: dict) -> dict:
+    """
+    Typed column arrays for interval data, lanes are kept as strings
+    """
+    columns = {"begin": array("d"), "end": array("d"), "lane": []}
+    for name in metrics.values():
+        columns[name] = array("d")
+    return columns
+
+def interval_columns_to_pandas(columns: dict) -> pd.DataFrame:
+    """
+    Wraps filled column arrays into DataFrame without copying floats
+    """
+    data = {}
+    for name, values in columns.items():
+        if isinstance(values, array):
+            values = np.frombuffer(values, dtype=np.float64) if len(values) else np.empty(0)
+        data[name] = values
+    return pd.DataFrame(data)
+
+def iterparse_root(file: str, tag: str):
+    """
+    Start streaming parse of the file and check the root tag,
+    returns the root element and the event iterator
+    """
+    context = ET.iterparse(file, events=("start", "end"))
+    _, root = next(context)
+    if root.tag != tag:
+        raise TypeError(
+            F"Wrong input tag, {root.tag} was given but, <{tag}> expected.")
+    return root, context
+
+def stream_detector_intervals(file: str, metrics: dict, prefix: str="e2det_") -> dict:
+    """
+    Streaming counterpart of get_detector_intervals, parsed intervals are
+    cleared from memory and their values go directly into column arrays
+    """
+    root, context = iterparse_root(file, "detector")
+    columns = init_interval_columns(metrics)
+    metric_items = list(metrics.items())
+    nan = float("nan")
+
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                attrib = elem.attrib
+                columns["begin"].append(float(attrib["begin"]))
+                columns["end"].append(float(attrib["end"]))
+                columns["lane"].append(attrib["id"].split(prefix)[-1])
+                for k, name in metric_items:
+                    v = attrib.get(k)
+                    columns[name].append(nan if v is None else float(v))
+        else:
+            depth -= 1
+            if depth == 0:
+                root.clear()
+    return columns
+
+def stream_emission_intervals(file: str, metrics: dict) -> dict:
+    """
+    Streaming counterpart of get_emission_intervals, parsed intervals are
+    cleared from memory and their values go directly into column arrays
+    """
+    root, context = iterparse_root(file, "meandata")
+    columns = init_interval_columns(metrics)
+    metric_items = list(metrics.items())
+
+    depth = 0
+    begin = end = 0.0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                begin = float(elem.attrib["begin"])
+                end = float(elem.attrib["end"])
+            elif depth == 3:
+                attrib = elem.attrib
+                columns["begin"].append(begin)
+                columns["end"].append(end)
+                columns["lane"].append(attrib["id"])
+                for k, name in metric_items:
+                    v = attrib.get(k)
+                    columns[name].append(0.00 if v is None else float(v))
+        else:
+            depth -= 1
+            if depth == 0:
+                root.clear()
+    return columns
+
 def read_detectors_to_pandas(file: str, det_metrics: dict) -> pd.DataFrame:
-    root = ET.parse(file).getroot()
-    dct = get_detector_intervals(root, det_metrics)
-    return pd.DataFrame(dct)
+    columns = stream_detector_intervals(file, det_metrics)
+    return interval_columns_to_pandas(columns)
 
 def read_emissions_to_pandas(file: str, emit_metrics: dict) -> pd.DataFrame:
-    root = ET.parse(file).getroot()
-    dct = get_emission_intervals(root, emit_metrics)
-    return pd.DataFrame(dct)
+    columns = stream_emission_intervals(file, emit_metrics)
+    return interval_columns_to_pandas(columns)
 
 def merge_detectors_and_emissions(det: pd.DataFrame, emit: pd.DataFrame) -> pd.DataFrame:
     """
@@ -207,36 +325,347 @@ def merge_detectors_and_emissions(det: pd.DataFrame, emit: pd.DataFrame) -> pd.D
     """
     return pd.merge(det, emit, how="inner", on=["begin", "end", "lane"])
 
-def add_lane_group_column(df: pd.DataFrame, group_map: dict) -> pd.DataFrame:
+def get_lane_lookup(group_map: dict) -> dict:
+    """
+    Reverse {group: [lanes]} map to {lane: group}, a lane listed in
+    several groups belongs to the first one as in assign_stream
+    """
+    lookup = {}
+    for group, lanes in group_map.items():
+        for lane in lanes:
+            lookup.setdefault(lane, group)
+    return lookup
+
+def get_lane_group_column(name: str=None) -> str:
+    """
+    Column holding lane groups of the named group map, i.e. lane_group_approach
     """
-    Adds a stream column based on the dictionary
+    if name is None:
+        return LANE_GROUP
+    return f"{LANE_GROUP}_{name}"
+
+def is_lane_group_column(column: str) -> bool:
+    return column == LANE_GROUP or column.startswith(LANE_GROUP + "_")
+
+def add_lane_group_column(df: pd.DataFrame, group_map: dict, column: str=LANE_GROUP) -> pd.DataFrame:
+    """
+    Adds a stream column based on the dictionary, lanes are looked up
+    once per unique lane instead of once per row
     """
     if not group_map:
-        df.insert(0, "lane_group", df["lane"])
+        df.insert(0, column, df["lane"])
+    else:
+        lookup = get_lane_lookup(group_map)
+        codes, lanes = pd.factorize(df["lane"])
+        groups = np.array([lookup.get(lane) for lane in lanes] + [None], dtype=object)
+        # code -1 marks missing lanes and picks the trailing None
+        df.insert(0, column, groups[codes])
+    return df
+
+def read_group_maps(files: list) -> dict:
+    """
+    Read group map JSON files, maps are named by the file name without extension
+    """
+    group_maps = {}
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        with open(file, "r") as fin:
+            group_maps[name] = json.load(fin)
+    return group_maps
+
+def add_lane_group_columns(df: pd.DataFrame, group_maps: dict) -> pd.DataFrame:
+    """
+    Adds a lane group column per named group map, i.e. {"approach": {...}, "movement": {...}}
+    gives lane_group_approach and lane_group_movement columns
+    """
+    for name, group_map in group_maps.items():
+        df = add_lane_group_column(df, group_map, get_lane_group_column(name))
+    return df
+
+def read_run_to_pandas(run_files: dict, det_metrics: dict, emit_metrics: dict) -> pd.DataFrame:
+    """
+    Parse detector and emission outputs of a single run to a merged DataFrame
+    """
+    df_det = read_detectors_to_pandas(run_files["det"], det_metrics)
+    df_emit = read_emissions_to_pandas(run_files["emit"], emit_metrics)
+    return merge_detectors_and_emissions(df_det, df_emit)
+
+def get_cache_key(run_files: dict, det_metrics: dict, emit_metrics: dict) -> str:
+    """
+    Hash of output file paths, modification times, sizes and metric
+    mappings, changes whenever the parsed run would change
+    """
+    files = []
+    for key in sorted(run_files):
+        stat = os.stat(run_files[key])
+        files.append([key, os.path.abspath(run_files[key]), stat.st_mtime_ns, stat.st_size])
+    payload = json.dumps(
+        {"files": files, "det": det_metrics, "emit": emit_metrics}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+def read_run_cached(run_name: str, run_files: dict, det_metrics: dict, emit_metrics: dict,
+        cache_dir: str) -> pd.DataFrame:
+    """
+    Read merged DataFrame of the run from cache, parse and cache it
+    if the run is new or its output files have changed
+    """
+    key = get_cache_key(run_files, det_metrics, emit_metrics)
+    path = os.path.join(cache_dir, f"{run_name}_{key}.{CACHE_FORMAT}")
+    if os.path.exists(path):
+        if CACHE_FORMAT == "parquet":
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    df = read_run_to_pandas(run_files, det_metrics, emit_metrics)
+
+    # replace outdated entries of the run
+    os.makedirs(cache_dir, exist_ok=True)
+    for outdated in glob.glob(os.path.join(cache_dir, f"{glob.escape(run_name)}_*")):
+        os.remove(outdated)
+    if CACHE_FORMAT == "parquet":
+        df.to_parquet(path, index=False)
     else:
-        df.insert(0, "lane_group", df["lane"].apply(
-            assign_stream, args=[group_map]))
+        df.to_pickle(path)
     return df
 
-def output_folder_to_pandas(output_dir: str, det_metrics: dict, emit_metrics: dict) -> pd.DataFrame:
+def load_run(run_name: str, run_files: dict, det_metrics: dict, emit_metrics: dict,
+        cache_dir: str=None, interval: float=None, compact: bool=False) -> pd.DataFrame:
+    """
+    Read single run with run_name column, from cache if cache_dir is given,
+    optionally downsampled to interval seconds and compacted
+    """
+    if cache_dir:
+        df = read_run_cached(
+            run_name, run_files, det_metrics, emit_metrics, cache_dir)
+    else:
+        df = read_run_to_pandas(run_files, det_metrics, emit_metrics)
+    df.insert(0, "run_name", run_name)
+    if interval:
+        df = downsample_intervals(df, interval)
+    if compact:
+        df = compact_frame(df)
+    return df
+
+def output_folder_to_pandas(output_dir: str, det_metrics: dict, emit_metrics: dict,
+        use_cache: bool=False, n_workers: int=1, interval: float=None,
+        compact: bool=False) -> pd.DataFrame:
     """
     Combine all contents of the output folder to a single DataFrame.
+    With use_cache parsed runs are stored in <output_dir>/.cache
+    and only new or changed runs are parsed again. Runs are parsed
+    by n_workers processes, None uses all cores, and concatenated
+    in the order of run names. Intervals can be merged to interval
+    seconds and with compact identifiers are stored as categoricals
+    and metrics as float32
     """
     runs = search_folder(
         output_dir,
         extensions={"det": "det.xml", "emit": "emit.xml"}
     )
+    cache_dir = os.path.join(output_dir, CACHE_DIR) if use_cache else None
 
-    dfs = []
-    for run_name, run_files in runs.items():
-        df_det = read_detectors_to_pandas(run_files["det"], det_metrics)
-        df_emit = read_emissions_to_pandas(run_files["emit"], emit_metrics)
-        df = merge_detectors_and_emissions(df_det, df_emit)
-        df.insert(0, "run_name", run_name)
-        dfs.append(df)
-    
-    return pd.concat(dfs, axis=0)
+    run_names = list(runs.keys())
+    n_runs = len(run_names)
+    args = (
+        run_names,
+        [runs[r] for r in run_names],
+        [det_metrics] * n_runs,
+        [emit_metrics] * n_runs,
+        [cache_dir] * n_runs,
+        [interval] * n_runs,
+        [compact] * n_runs
+    )
+
+    if n_workers == 1 or n_runs < 2:
+        dfs = list(map(load_run, *args))
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            dfs = list(pool.map(load_run, *args))
     
+    df = pd.concat(dfs, axis=0)
+    if compact:
+        # categories differ between runs, concat falls back to strings
+        df = compact_frame(df)
+    return df
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store identifier and lane group columns as categoricals and
+    metrics as float32, begin and end keep their precision
+    """
+    columns = {}
+    for c in df.columns:
+        if c in ID_COLUMNS or is_lane_group_column(c):
+            if not isinstance(df[c].dtype, pd.CategoricalDtype):
+                columns[c] = "category"
+        elif c not in ("begin", "end") and df[c].dtype == np.float64:
+            columns[c] = np.float32
+    return df.astype(columns)
+
+def downsample_intervals(df: pd.DataFrame, interval: float) -> pd.DataFrame:
+    """
+    Merge intervals of every run and lane to interval seconds long
+    bins, metrics are aggregated as in aggregate_metrics
+    """
+    keys = [c for c in df.columns if c in ID_COLUMNS or is_lane_group_column(c)]
+    tmp = df.drop(columns="end")
+    tmp["begin"] = (df["begin"] // interval) * interval
+    result = aggregate_metrics(tmp, keys + ["begin"])
+    result.insert(result.columns.get_loc("begin") + 1, "end", result["begin"] + interval)
+    return result
+
+def get_metric_columns(df: pd.DataFrame) -> list:
+    """
+    Return names of metric columns in the frame
+    """
+    return [c for c in df.columns
+        if c not in NON_METRICS and not is_lane_group_column(c)]
+
+def aggregate_metrics(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """
+    Vectorized aggregation of metric columns over rows sharing the keys,
+    the method depends on the column prefix: total_ sums positive values,
+    max_ takes maximum, mean_ is weighted by count, count is summed
+    """
+    weights = df["count"]
+    tmp = df[list(keys)].copy()
+    agg_spec = {"count": "sum"}
+    tmp["count"] = weights
+
+    weighted = []
+    for metric in get_metric_columns(df):
+        prefix = metric.split("_")[0]
+        if prefix == "total":
+            tmp[metric] = df[metric].where(df[metric] > 0, 0.0)
+            agg_spec[metric] = "sum"
+        elif prefix == "max":
+            tmp[metric] = df[metric]
+            agg_spec[metric] = "max"
+        elif prefix == "mean":
+            tmp[metric] = df[metric] * weights
+            agg_spec[metric] = "sum"
+            weighted.append(metric)
+        else:
+            tmp[metric] = df[metric]
+            agg_spec[metric] = "mean"
+
+    result = tmp.groupby(list(keys), sort=True, observed=True, dropna=False).agg(agg_spec)
+    weight_sum = result["count"].where(result["count"] != 0, np.nan)
+    for metric in weighted:
+        result[metric] = result[metric] / weight_sum
+    return result.reset_index()
+
+def t_quantile(p: float, dof: np.ndarray) -> np.ndarray:
+    """
+    Quantile of Student t distribution, exact for 1 and 2 degrees
+    of freedom and Cornish-Fisher expansion around normal quantile otherwise
+    """
+    dof = np.asarray(dof, dtype=float)
+    z = NormalDist().inv_cdf(p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (z
+            + (z**3 + z) / (4 * dof)
+            + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * dof**3)
+            + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * dof**4))
+    t = np.where(dof == 1, np.tan(np.pi * (p - 0.5)), t)
+    t = np.where(dof == 2, (2 * p - 1) / np.sqrt(2 * p * (1 - p)), t)
+    return np.where(dof < 1, np.nan, t)
+
+def minmax_downsample(t: np.ndarray, x: np.ndarray, n_out: int) -> tuple:
+    """
+    Keep minimum and maximum of n_out / 2 equally sized buckets in time order,
+    peaks survive so the line looks the same at the plot resolution
+    """
+    n = len(t)
+    n_buckets = max(n_out // 2, 1)
+    if n <= n_out:
+        return t, x
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = x
+    buckets = padded.reshape(n_buckets, size)
+    valid = ~np.all(np.isnan(buckets), axis=1)
+
+    offsets = np.arange(n_buckets)[valid] * size
+    i_min = offsets + np.nanargmin(buckets[valid], axis=1)
+    i_max = offsets + np.nanargmax(buckets[valid], axis=1)
+    idx = np.unique(np.concatenate([i_min, i_max]))
+    return t[idx], x[idx]
+
+def lttb_downsample(t: np.ndarray, x: np.ndarray, n_out: int) -> tuple:
+    """
+    Largest-Triangle-Three-Buckets, keeps first and last point and from every
+    bucket the point forming the largest triangle with the previous selected
+    point and the mean of the next bucket
+    """
+    n = len(t)
+    if n <= n_out or n_out < 3:
+        return t, x
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(x, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    idx = np.zeros(n_out, dtype=int)
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        t_next = t[hi:next_hi].mean()
+        y_next = y[hi:next_hi].mean()
+        area = np.abs(
+            (t[a] - t_next) * (y[lo:hi] - y[a])
+            - (t[a] - t[lo:hi]) * (y_next - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return t[idx], np.asarray(x)[idx]
+
+DOWNSAMPLERS = {
+    "lttb": lttb_downsample,
+    "minmax": minmax_downsample
+}
+
+def split_replication_name(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds experiment and replication columns parsed from
+    <experiment>-seed<seed> run names
+    """
+    parts = df["run_name"].astype(str).str.rsplit(REPLICATION_SEP, n=1, expand=True)
+    if parts.shape[1] == 1:
+        parts[1] = None
+    df = df.copy()
+    df["experiment"] = parts[0]
+    df["replication"] = parts[1].fillna("")
+    return df
+
+def aggregate_replications(df: pd.DataFrame, keys: list=("begin", "end", "lane"),
+        confidence: float=0.95) -> pd.DataFrame:
+    """
+    Aggregate metrics of replications of the same experiment into mean,
+    standard deviation and confidence interval half width, one row per
+    experiment and keys. Use keys=() for a single summary row per experiment
+    """
+    df = split_replication_name(df)
+    keys = list(keys)
+
+    # one value per replication and key, then statistics across replications
+    per_replication = aggregate_metrics(df, ["experiment", "replication"] + keys)
+    metrics = ["count"] + get_metric_columns(per_replication)
+    stats = per_replication.groupby(["experiment"] + keys, sort=True)[metrics].agg(
+        ["mean", "std", "count"])
+
+    result = pd.DataFrame(index=stats.index)
+    n = stats[(metrics[0], "count")]
+    result["n_replications"] = n
+    t = t_quantile((1 + confidence) / 2, n - 1)
+    for metric in metrics:
+        std = stats[(metric, "std")]
+        result[f"{metric}_mean"] = stats[(metric, "mean")]
+        result[f"{metric}_std"] = std
+        result[f"{metric}_ci"] = t * std / np.sqrt(n)
+    return result.reset_index()
+
 """
 metrics = [
     Metric(sumo_name, display_name, units, aggregation_method),
@@ -248,8 +677,17 @@ if __name__ == "__main__":
     ag = argparse.ArgumentParser()
     ag.add_argument("-f", "--folder", type=str, required=True, help=
         "Path to the folder with detector and lane emissions output")
-    ag.add_argument("-g", "--groups", type=str, default=None, help=
-        "path to JSON for grouping lanes by leg and creating lane_groups column in Pandas")
+    ag.add_argument("-g", "--groups", type=str, nargs="+", default=[], help=
+        "paths to JSONs for grouping lanes by leg, the first one creates lane_group column, " \
+        "all of them lane_group_<file name> columns in Pandas")
+    ag.add_argument("-i", "--interval", type=float, default=None, help=
+        "merge detector intervals to bins of this many seconds")
+    ag.add_argument("--compact", action="store_true", help=
+        "store identifiers as categoricals and metrics as float32")
+    ag.add_argument("-r", "--replications", action="store_true", help=
+        "print mean and confidence interval over <name>-seed<seed> replication runs")
+    ag.add_argument("--confidence", type=float, default=0.95, help=
+        "confidence level of the replication intervals")
     args = ag.parse_args()
 
     DET_METRICS = {
@@ -279,12 +717,18 @@ if __name__ == "__main__":
     df = output_folder_to_pandas(
         args.folder, 
         DET_METRICS,
-        EMIT_METRICS)
+        EMIT_METRICS,
+        interval=args.interval,
+        compact=args.compact)
+
+    group_maps = read_group_maps(args.groups)
+    group_map = next(iter(group_maps.values()), {})
 
-    group_map = {}
-    if args.groups:
-        with open(args.groups, "r") as fin:
-            group_map = json.load(fin)
-    
     df = add_lane_group_column(df, group_map)
+    if len(group_maps) > 1:
+        df = add_lane_group_columns(df, group_maps)
     print(df.head())
+
+    if args.replications:
+        summary = aggregate_replications(df, keys=(), confidence=args.confidence)
+        print(summary.to_string())
@@ -0,0 +1,72 @@
+import csv
+from array import array
+from time import perf_counter_ns
+
+import numpy as np
+
+
+class StepProfiler:
+    """
+    Collects perf_counter_ns durations of the runner stages, per stage
+    and TLS. With timeline every measurement is also kept with its step
+    """
+    def __init__(self, timeline=False):
+        self.durations = {}
+        self.timeline = [] if timeline else None
+        self.step = 0
+
+    def start(self):
+        return perf_counter_ns()
+
+    def stop(self, t_start, stage, tls_id="-"):
+        duration = perf_counter_ns() - t_start
+        key = (stage, tls_id)
+        if key not in self.durations:
+            self.durations[key] = array("q")
+        self.durations[key].append(duration)
+        if self.timeline is not None:
+            self.timeline.append((self.step, stage, tls_id, duration))
+
+    def next_step(self):
+        self.step += 1
+
+    def get_summary(self):
+        """
+        Rows with count, p50, p95, max and total in ms and share
+        of the total profiled time for every stage and TLS
+        """
+        grand_total = sum([sum(d) for d in self.durations.values()]) or 1
+        rows = []
+        for (stage, tls_id), durations in self.durations.items():
+            d = np.frombuffer(durations, dtype=np.int64) / 1e6
+            p50, p95 = np.percentile(d, [50, 95])
+            rows.append({
+                "stage": stage,
+                "tls": tls_id,
+                "n": len(d),
+                "p50": p50,
+                "p95": p95,
+                "max": d.max(),
+                "total": d.sum(),
+                "share": sum(durations) / grand_total
+            })
+        return rows
+
+    def format_summary(self):
+        header = "{:<16} {:<12} {:>8} {:>10} {:>10} {:>10} {:>12} {:>7}".format(
+            "stage", "tls", "n", "p50 [ms]", "p95 [ms]", "max [ms]", "total [ms]", "share")
+        lines = [header, "-" * len(header)]
+        for r in self.get_summary():
+            lines.append("{:<16} {:<12} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.1f} {:>6.1%}".format(
+                r["stage"], r["tls"], r["n"], r["p50"], r["p95"], r["max"], r["total"], r["share"]))
+        return "\n".join(lines)
+
+    def write_timeline(self, path):
+        """
+        Write step, stage, tls and duration in microseconds of every measurement as CSV
+        """
+        with open(path, "w", newline="") as fout:
+            writer = csv.writer(fout)
+            writer.writerow(["step", "stage", "tls", "duration_us"])
+            for step, stage, tls_id, duration in self.timeline:
+                writer.writerow([step, stage, tls_id, duration / 1e3])
@@ -1,8 +1,12 @@
 import logging
 import json
 import os
+import queue
+import threading
 from datetime import datetime
 
+import numpy as np
+
 class TLSLogger():
     def __init__(self, run_name, tls_ids, data_types,
             to_file=False, to_console=False, directory=None, is_timestamped=False, fmt="log"):
@@ -39,15 +43,159 @@ class TLSLogger():
         output_dict.update(output_data_dict)
 
         if self.to_file and self.logger:
-            self.logger.info('%s', output_dict)
+            if self.fmt == "jsonl":
+                self.logger.info('%s', json.dumps(output_dict))
+            else:
+                self.logger.info('%s', output_dict)
         if self.to_console:
             print(f"{output_dict}")
 
-def get_logger(run_name, directory=None, is_timestamped=False, fmt="log"):
+    def close(self):
+        """
+        Flush log file at the end of the simulation
+        """
+        if self.logger:
+            for handler in self.logger.handlers:
+                handler.flush()
+
+
+class BufferedTLSLogger(TLSLogger):
     """
-    Logger for results
+    Logger that appends step records to in-memory columnar buffers, one per
+    TLS. Full buffers are written by a background thread as chunks of numpy
+    structured arrays, so logging does not block the simulation loop
+    """
+    def __init__(self, run_name, tls_ids, data_types,
+            to_file=False, to_console=False, directory=None, is_timestamped=False,
+            fmt="npy", chunk_size=10000):
+        super().__init__(run_name, tls_ids, data_types, to_file=False,
+            to_console=to_console, directory=directory,
+            is_timestamped=is_timestamped, fmt=fmt)
+        self.to_file = to_file
+        self.chunk_size = chunk_size
+        self.buffers = {}
+
+        self.path = None
+        self.queue = None
+        self.writer = None
+        if self.to_file and self.directory:
+            self.path = get_log_path(
+                self.run_name, directory, is_timestamped, fmt)
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(
+                target=write_log_chunks, args=(self.path, self.queue), daemon=True)
+            self.writer.start()
+
+    def log(self, time, data_dict):
+        """
+        Append step record to the buffer of the TLS
+        """
+        output_dict = {"time": time}
+        output_data_dict = self.build_output_dict(data_dict)
+        output_dict.update(output_data_dict)
+
+        if self.path:
+            self.append(data_dict["state"]["id"], flatten_dict(output_dict))
+        if self.to_console:
+            print(f"{output_dict}")
+
+    def append(self, tls_id, record):
+        """
+        Add flat record to columns, the buffer is flushed when full
+        or when the record brings different columns
+        """
+        columns = self.buffers.get(tls_id)
+        if columns is not None and columns.keys() != record.keys():
+            self.flush(tls_id)
+            columns = None
+        if columns is None:
+            columns = {k: [] for k in record}
+            self.buffers[tls_id] = columns
+
+        for k, v in record.items():
+            columns[k].append(v)
+        if len(columns["time"]) >= self.chunk_size:
+            self.flush(tls_id)
+
+    def flush(self, tls_id):
+        """
+        Hand the buffer of the TLS over to the writer thread
+        """
+        columns = self.buffers.pop(tls_id, None)
+        if columns:
+            self.queue.put((tls_id, columns))
+
+    def close(self):
+        """
+        Write remaining buffers and wait for the writer thread
+        """
+        if self.writer is None:
+            return
+        for tls_id in list(self.buffers):
+            self.flush(tls_id)
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+
+
+def flatten_dict(data, prefix=""):
+    """
+    Flatten nested dicts and lists to {"parent.child.0": value}
+    """
+    flat = {}
+    items = data.items() if isinstance(data, dict) else enumerate(data)
+    for k, v in items:
+        key = f"{prefix}{k}"
+        if isinstance(v, (dict, list, tuple)):
+            flat.update(flatten_dict(v, key + "."))
+        else:
+            flat[key] = v
+    return flat
+
+
+def columns_to_array(tls_id, columns):
+    """
+    Convert columns of a buffer to a structured array with leading id column
+    """
+    n_rows = len(columns["time"])
+    names = ["id"] + list(columns.keys())
+    arrays = [np.full(n_rows, str(tls_id))]
+    for values in columns.values():
+        array = np.asarray(values)
+        if array.dtype == object:
+            array = array.astype(str)
+        arrays.append(array)
+    return np.rec.fromarrays(arrays, names=names).view(np.ndarray)
+
+
+def write_log_chunks(path, chunk_queue):
+    """
+    Writer thread loop, appends chunks from the queue to the file
+    until None is received
+    """
+    with open(path, "wb") as fout:
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                break
+            tls_id, columns = item
+            np.save(fout, columns_to_array(tls_id, columns), allow_pickle=False)
+
+
+def read_log_chunks(path):
+    """
+    Generator of structured arrays written by BufferedTLSLogger
+    """
+    with open(path, "rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        while fin.tell() < size:
+            yield np.load(fin, allow_pickle=False)
+
+
+def get_log_path(run_name, directory=None, is_timestamped=False, fmt="log"):
+    """
+    Assemble path of the log file
     """
-    
     if directory is None:
         directory = os.getcwd()
     else:
@@ -58,7 +206,15 @@ def get_logger(run_name, directory=None, is_timestamped=False, fmt="log"):
         name_id = "_" + datetime.now().strftime('%Y%m%d%H%M%S')
     
     run_id = run_name + name_id + "." + fmt
-    path = os.path.join(directory, run_id)
+    return os.path.join(directory, run_id)
+
+
+def get_logger(run_name, directory=None, is_timestamped=False, fmt="log"):
+    """
+    Logger for results
+    """
+    
+    path = get_log_path(run_name, directory, is_timestamped, fmt)
     
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
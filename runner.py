@@ -3,63 +3,83 @@ import os
 import argparse
 
 import sumolib
-import traci
 
 
+from simbackend import sim
+import topology
 from tlsagents.base import TLSFactory
-from resultlogger import TLSLogger
+from coordinator import StepCoordinator, get_neighbours
+from profiler import StepProfiler
+from resultlogger import TLSLogger, BufferedTLSLogger
 import cfgparse
 
 
-SUMO_GUI_CONFIG = "sumo_gui_config.xml"
+LOG_EXTENSIONS = {"text": "log", "json": "jsonl", "binary": "npy"}
+SUMO_GUI_CONFIG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "sumo_gui_config.xml")
 
-def run(tls_list, logger, max_steps=10000):
+def log_step(logger, time, tls, coordinator):
+    data_dict = tls.decsribe_step()
+    data_dict["shadows"] = coordinator.describe_shadows(tls.tls_id)
+    logger.log(time, data_dict)
+
+
+def run(tls_list, logger, max_steps=10000, coordinator=None):
     """
-    Main simulation loop
+    Main simulation loop, observations of the TLS are extracted
+    by the coordinator before the agents update. Stages of every
+    step are timed by the profiler of the coordinator if it has one
     """
+    if coordinator is None:
+        coordinator = StepCoordinator(tls_list)
+    profiler = coordinator.profiler
+
     step = 0
-    while traci.simulation.getMinExpectedNumber() > 0 and step < max_steps:
+    while sim.simulation.getMinExpectedNumber() > 0 and step < max_steps:
         # update simulation state
-        traci.simulationStep()
+        coordinator.run_stage("simulation_step", "-", sim.simulationStep)
         step += 1
-        time = traci.simulation.getTime()
+        time = sim.simulation.getTime()
 
         # update tls state and data
-        for tls in tls_list:
-            tls.update_state()
-        
-            # log tls states
-            if logger:
-                if tls.tls_id in logger.tls_ids:
-                    data_dict = tls.decsribe_step()
-                    logger.log(time, data_dict)
+        coordinator.step()
 
+        # log tls states
         if logger:
-            print()
+            for tls in tls_list:
+                if tls.tls_id in logger.tls_ids:
+                    coordinator.run_stage("log", tls.tls_id, log_step, logger, time, tls, coordinator)
+            if logger.to_console:
+                print()
+        if profiler is not None:
+            profiler.next_step()
 
     # finalize
+    if logger:
+        logger.close()
     sys.stdout.flush()
-    traci.close()
+    sim.close()
 
 
-if __name__ == "__main__":
-    ap = argparse.ArgumentParser()
-    ap.add_argument("-c", "--config", type=str, required=True,
-        help="yaml configuration file defining the simulation")
-    args = ap.parse_args()
-    cfg = cfgparse.get_valid_config(args)
-
-    # validate nodes
-    net = sumolib.net.readNet(cfg.sumo.network)
-    valid_tls_id = [i.getID() for i in net.getTrafficLights()]
+def validate_tls_ids(cfg):
+    """
+    Check that controlled and logged TLS exist in the network
+    """
+    net = topology.load(cfg.sumo.network)
+    valid_tls_id = net.get_tls_ids()
     for tls in cfg.tls:
         assert tls.id in valid_tls_id, \
         "@tls: TLS at node {} does not exist".format(tls.id)
-    for tls_id in cfg.logging.ids:  
-        assert tls_id in valid_tls_id, \
-        "@logging: TLS at node {} does not exist".format(tls_id) 
+    if cfg.get('logging'):
+        for tls_id in cfg.logging.ids:  
+            assert tls_id in valid_tls_id, \
+            "@logging: TLS at node {} does not exist".format(tls_id) 
+
 
-    # Initialize SUMO simulator and prepare arguments
+def get_sumo_command(cfg):
+    """
+    Assemble SUMO command line from the config
+    """
     sumo_bin_name = 'sumo-gui' if cfg.sumo.gui else 'sumo'
     sumo_bin = sumolib.checkBinary(sumo_bin_name)
     
@@ -70,6 +90,7 @@ if __name__ == "__main__":
         "--gui-settings-file": SUMO_GUI_CONFIG,
         "--device.emissions.probability": "1.0",
         "--output-prefix": cfg.job.name + "_",
+        "--seed": None if cfg.sumo.seed is None else str(cfg.sumo.seed),
     }
 
     sumo_command = [sumo_bin]
@@ -77,10 +98,13 @@ if __name__ == "__main__":
         if v:
             sumo_command.append(k)
             sumo_command.append(v)
+    return sumo_command
 
-    print("Starting simulation with:\n{}".format(" ".join(sumo_command)))
-    traci.start(sumo_command)
 
+def create_agents(cfg):
+    """
+    Create TLS agents from config, requires running simulation
+    """
     # this is build with a bulder design pattern from config
     tls_list = []
     for tls_cfg in cfg.tls:
@@ -93,21 +117,124 @@ if __name__ == "__main__":
         }
         tls = TLSFactory.create_agent(tls_type, **kwargs)
         tls_list.append(tls)
+    return tls_list
+
+
+def create_shadows(cfg, tls_list):
+    """
+    Shadow agents of every TLS, {tls_id: {name: agent}}, they share
+    the variables and data pipeline of the active agent
+    """
+    agents = {tls.tls_id: tls for tls in tls_list}
+    shadows = {}
+    for tls_cfg in cfg.tls:
+        for shadow_cfg in tls_cfg.get("shadows") or []:
+            active = agents[tls_cfg.id]
+            kwargs = {
+                "tls_id": tls_cfg.id,
+                "constants": shadow_cfg.constants,
+                "variables": tls_cfg.variables,
+                "data_query": None
+            }
+            shadow = TLSFactory.create_agent(shadow_cfg.controller, **kwargs)
+            shadow.data_pipeline = active.data_pipeline
+            shadows.setdefault(tls_cfg.id, {})[shadow_cfg.name] = shadow
+    return shadows
+
+
+def create_coordinator(cfg, tls_list, profiler=None):
+    """
+    Coordinator of all agents, neighbours are found in the network
+    topology unless listed in the tls config
+    """
+    tls_ids = [tls.tls_id for tls in tls_list]
+    neighbours = get_neighbours(topology.get_active(), tls_ids)
+    for tls_cfg in cfg.tls:
+        if tls_cfg.get("neighbours") is not None:
+            neighbours[tls_cfg.id] = list(tls_cfg.neighbours)
+    return StepCoordinator(tls_list, neighbours, create_shadows(cfg, tls_list), profiler)
+
 
-    # create logger
+def create_logger(cfg):
+    """
+    Create TLS logger from config if logging is requested
+    """
     logger = None
     if cfg.get('logging'):
-        logger = TLSLogger(
+        logger_class = TLSLogger
+        if cfg.logging.format == "binary":
+            logger_class = BufferedTLSLogger
+        logger = logger_class(
             cfg.job.name,
             cfg.logging.ids,
             cfg.logging.data,
             to_file=cfg.logging.to_file,
             to_console=cfg.logging.to_console,
             directory=cfg.logging.dir,
-            is_timestamped=cfg.logging.timestamped
+            is_timestamped=cfg.logging.timestamped,
+            fmt=LOG_EXTENSIONS[cfg.logging.format]
         )
+    return logger
 
-    # simulate
-    run(tls_list, logger, max_steps=cfg.sumo.max_steps)
 
+def simulate(cfg, label="default", port=None, profiler=None):
+    """
+    Start SUMO, create agents and logger from config and run the
+    simulation. label and port separate parallel TraCI connections
+    """
+    validate_tls_ids(cfg)
+
+    sumo_command = get_sumo_command(cfg)
+    print("Starting {} simulation with:\n{}".format(
+        cfg.sumo.backend, " ".join(sumo_command)))
+    sim.select(cfg.sumo.backend)
+    if cfg.sumo.trace:
+        sim.use_trace(cfg.sumo.trace)
+    sim.start(sumo_command, label=label, port=port)
 
+    tls_list = create_agents(cfg)
+    coordinator = create_coordinator(cfg, tls_list, profiler)
+    logger = create_logger(cfg)
+    run(tls_list, logger, max_steps=cfg.sumo.max_steps, coordinator=coordinator)
+
+
+def simulate_replications(config_file, cfg):
+    """
+    Run the config once per replication seed in parallel processes,
+    outputs of each replication are prefixed with <job.name>-seed<seed>
+    """
+    import batch_runner
+
+    jobs = batch_runner.create_replication_jobs(
+        config_file, cfg.job.name, cfg.job.replications.seeds)
+    results = batch_runner.run_batch(jobs, cfg.job.replications.workers)
+    failed = [r["name"] for r in results if r["exit_code"] != 0]
+    assert not failed, "Replications failed: {}".format(", ".join(failed))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--config", type=str, required=True,
+        help="yaml configuration file defining the simulation")
+    ap.add_argument("--profile", action="store_true",
+        help="time simulation step, extraction, decision, set phase and logging " \
+            "of every TLS and print p50 / p95 / max per stage at the end")
+    ap.add_argument("--profile-timeline", type=str, default=None,
+        help="with --profile write duration of every stage and step to this CSV file")
+    args = ap.parse_args()
+    cfg = cfgparse.get_valid_config(args)
+
+    # simulate
+    if cfg.job.replications:
+        assert not args.profile, "--profile is not supported with job.replications"
+        simulate_replications(args.config, cfg)
+    else:
+        profiler = None
+        if args.profile:
+            profiler = StepProfiler(timeline=args.profile_timeline is not None)
+        simulate(cfg, profiler=profiler)
+
+        if profiler:
+            print(profiler.format_summary())
+            if args.profile_timeline:
+                profiler.write_timeline(args.profile_timeline)
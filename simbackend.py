@@ -0,0 +1,87 @@
+import importlib
+import importlib.util
+
+
+# registered backends, name: module implementing the TraCI API
+BACKENDS = {
+    "traci": "traci",
+    "libsumo": "libsumo",
+    "replay": "tracireplay",
+}
+
+
+def is_available(name):
+    """
+    Check whether the module of the backend can be imported
+    """
+    return importlib.util.find_spec(BACKENDS[name]) is not None
+
+
+class SimulationBackend:
+    """
+    Proxy to the module that talks to SUMO. Agents and data pipeline
+    call `sim.<domain>.<getter>` and the selected backend decides whether
+    the call goes over a TraCI socket or to SUMO running in-process with libsumo
+    """
+    def __init__(self, name="traci"):
+        self.name = None
+        self.module = None
+        self.trace_file = None
+        self.select(name)
+
+    def select(self, name):
+        """
+        Switch the backend, has to be done before the simulation is started
+        """
+        assert name in BACKENDS, \
+            f"Unknown simulation backend {name}, expected one of {list(BACKENDS)}"
+        module = importlib.import_module(BACKENDS[name])
+        self.clear_cache()
+        self.name = name
+        self.module = module
+        self.trace_file = None
+
+    def use_trace(self, trace_file):
+        """
+        Record responses of the selected backend to the trace file,
+        with the replay backend serve them from the trace instead of SUMO
+        """
+        import tracireplay
+
+        if self.name == "replay":
+            module = tracireplay.TracePlayer(trace_file)
+        else:
+            module = tracireplay.TraceRecorder(self.module, trace_file)
+        self.clear_cache()
+        self.module = module
+        self.trace_file = trace_file
+
+    def clear_cache(self):
+        """
+        Drop attributes cached from the previous module
+        """
+        for attr in list(self.__dict__):
+            if attr not in ("name", "module", "trace_file"):
+                del self.__dict__[attr]
+
+    def start(self, cmd, label="default", port=None):
+        """
+        Start SUMO with the command, libsumo runs in-process
+        and does not use label / port, replay does not start SUMO
+        """
+        if self.name == "replay":
+            assert self.trace_file is not None, \
+                "replay backend needs a recorded trace, see SimulationBackend.use_trace"
+            return self.module.start(cmd)
+        if self.name == "libsumo":
+            return self.module.start(cmd)
+        return self.module.start(cmd, port=port, label=label)
+
+    def __getattr__(self, attr):
+        # resolve domains once per backend, i.e. sim.lane, sim.simulationStep
+        value = getattr(self.module, attr)
+        setattr(self, attr, value)
+        return value
+
+
+sim = SimulationBackend()
@@ -1,4 +1,5 @@
 import ast
+import json
 
 
 def read_log(logfile):
@@ -6,58 +7,95 @@ def read_log(logfile):
     Reads log line by line, converts strings to dicts and
     appends them to list
     """
-    output = []
+    return list(iter_log(logfile))
+
+def get_line_parser(line):
+    """
+    Choose parser by the first record, newline-delimited JSON is parsed
+    with json, Python dict representation with ast
+    """
+    try:
+        json.loads(line)
+        return json.loads
+    except ValueError:
+        return ast.literal_eval
+
+def iter_log(logfile):
+    """
+    Lazily reads log line by line and yields record dicts,
+    only one line is held in memory at a time
+    """
+    parse = None
     with open(logfile, "r") as fin:
-        for line in fin.readlines():
-            output.append(ast.literal_eval(line))
-    return output
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            if parse is None:
+                parse = get_line_parser(line)
+            yield parse(line)
 
-def split_loglist(data, final_duration=100):
+def get_state(line):
     """
-    Splits the log into a dictionary wher keys are tls_id
-    {"tls_id": [{"phase": int, "time": int}, {}, ... , {}], ...}
+    TLS state of a record, logged under "state" by TLSLogger
     """
-    output = {}
+    if "state" in line:
+        return line["state"]
+    return line["states"]
+
+def iter_splits(data, final_duration=100):
+    """
+    Incrementally splits records into phases, yields (tls_id, {"phase": int, "duration": int})
+    as soon as the phase of the tls changes, last phases get final_duration
+    """
+    current = {}
     prev_time = {}
     for line in data:
-        tls_id = line["states"]["id"]
-        tls_phase = line["states"]["phase"]
-        elapsed = line["states"]["elapsed"]
+        state = get_state(line)
+        tls_id = state["id"]
+        tls_phase = state["phase"]
+        elapsed = state["elapsed"]
         if elapsed > 0:
             prev_time[tls_id] = elapsed
 
         # initialize
-        if tls_id not in output:
-            output[tls_id] = [{"phase": tls_phase, "duration": -1}]
+        if tls_id not in current:
+            current[tls_id] = {"phase": tls_phase, "duration": -1}
 
-        # append
-        elif tls_phase != output[tls_id][-1]["phase"]:
-            # update previous time
-            output[tls_id][-1]["duration"] = prev_time[tls_id]
-            output[tls_id].append(
-                {"phase": tls_phase, "duration": -1})
+        # close previous phase
+        elif tls_phase != current[tls_id]["phase"]:
+            current[tls_id]["duration"] = prev_time[tls_id]
+            yield tls_id, current[tls_id]
+            current[tls_id] = {"phase": tls_phase, "duration": -1}
 
     # fix last
-    for val in output.values():
-        if val[-1]["duration"] == -1:
-            val[-1]["duration"] = final_duration
-          
+    for tls_id, val in current.items():
+        val["duration"] = final_duration
+        yield tls_id, val
+
+def split_loglist(data, final_duration=100):
+    """
+    Splits the log into a dictionary wher keys are tls_id
+    {"tls_id": [{"phase": int, "time": int}, {}, ... , {}], ...}
+    """
+    output = {}
+    for tls_id, split in iter_splits(data, final_duration):
+        output.setdefault(tls_id, []).append(split)
     return output
 
 def get_tls_dicts(logfile):
     """
     get tls sequences from logfile
     """
-    loglist = read_log(logfile)
+    loglist = iter_log(logfile)
     splits = split_loglist(loglist)
-    return splits 
+    return splits
 
 
 if __name__ == "__main__":
-    import json
     import sys
     logfile = sys.argv[-1]
     splits = get_tls_dicts(logfile)
-    
+
     with open("results.txt", "w") as fout:
-        json.dump(splits, fout, indent=4)
\ No newline at end of file
+        json.dump(splits, fout, indent=4)
@@ -0,0 +1,39 @@
+import unittest
+
+import batch_runner as br
+
+
+class TestBatchRunner(unittest.TestCase):
+    """
+    Test cases for expanding batch runs from a parameter grid
+    """
+    raw_config = {
+        "job": {"name": "cross_run"},
+        "sumo": {"dir": "sumo", "seed": 0},
+        "tls": [
+            {"id": "A", "constants": {"mpc_step": 1}},
+            {"id": "B", "constants": {"mpc_step": 1}}
+        ]
+    }
+
+    def test_expand_grid(self):
+        result = br.expand_grid({"a": [1, 2], "b": [3]})
+        self.assertEqual(result, [{"a": 1, "b": 3}, {"a": 2, "b": 3}])
+        self.assertEqual(br.expand_grid(None), [{}])
+
+    def test_get_overrides(self):
+        params = {"sumo.seed": 5, "tls.B.constants.mpc_step": 4}
+        result = br.get_overrides(self.raw_config, params)
+
+        self.assertEqual(set(result.keys()), {"sumo", "tls"})
+        self.assertEqual(result["sumo"]["seed"], 5)
+        self.assertEqual(result["tls"][0]["constants"]["mpc_step"], 1)
+        self.assertEqual(result["tls"][1]["constants"]["mpc_step"], 4)
+
+        # original stays untouched
+        self.assertEqual(self.raw_config["sumo"]["seed"], 0)
+
+    def test_set_by_path_index(self):
+        config = {"tls": [{"id": "A", "constants": {}}]}
+        br.set_by_path(config, "tls.0.constants.x", 1)
+        self.assertEqual(config["tls"][0]["constants"]["x"], 1)
@@ -0,0 +1,52 @@
+import unittest
+
+import benchmark
+
+
+class TestCompareResults(unittest.TestCase):
+    baseline = {
+        "micro/extract": {"value": 100.0, "higher_is_better": False},
+        "macro/steps_per_second_block": {"value": 500.0, "higher_is_better": True},
+        "macro/steps_per_second_cross": {"error": "ConfigValueError"},
+    }
+
+    def test_within_tolerance(self):
+        results = {
+            "micro/extract": {"value": 110.0, "higher_is_better": False},
+            "macro/steps_per_second_block": {"value": 450.0, "higher_is_better": True},
+        }
+        comparison = benchmark.compare_results(results, self.baseline, tolerance=0.2)
+        self.assertFalse(any([c["regressed"] for c in comparison.values()]))
+        self.assertAlmostEqual(comparison["micro/extract"]["change"], 0.1)
+
+    def test_regressions(self):
+        results = {
+            "micro/extract": {"value": 130.0, "higher_is_better": False},
+            "macro/steps_per_second_block": {"value": 350.0, "higher_is_better": True},
+            "macro/steps_per_second_cross": {"value": 10.0, "higher_is_better": True},
+            "micro/new_case": {"value": 1.0, "higher_is_better": False},
+        }
+        comparison = benchmark.compare_results(results, self.baseline, tolerance=0.2)
+        # cases failed or missing in the baseline are not compared
+        self.assertEqual(
+            sorted(comparison), ["macro/steps_per_second_block", "micro/extract"])
+        self.assertTrue(all([c["regressed"] for c in comparison.values()]))
+        self.assertIn("REGRESSED", benchmark.format_comparison(comparison))
+
+    def test_failed_and_missing(self):
+        results = {
+            "micro/extract": {"value": 100.0, "higher_is_better": False},
+            "macro/steps_per_second_block": {"error": "RuntimeError: SUMO died"},
+        }
+        comparison = benchmark.compare_results(results, self.baseline, tolerance=0.2)
+        self.assertFalse(comparison["micro/extract"]["regressed"])
+        self.assertTrue(comparison["macro/steps_per_second_block"]["regressed"])
+        self.assertIn("SUMO died", benchmark.format_comparison(comparison))
+
+        comparison = benchmark.compare_results({}, self.baseline, tolerance=0.2)
+        self.assertEqual(comparison["micro/extract"]["error"], "missing")
+        self.assertTrue(all([c["regressed"] for c in comparison.values()]))
+
+        # cases of suites that were not run are not missing
+        comparison = benchmark.compare_results({}, self.baseline, tolerance=0.2, suites=["micro"])
+        self.assertEqual(list(comparison), ["micro/extract"])
@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import traci
+import sumolib
+
+import topology
+import feature_extraction as fe
+from coordinator import StepCoordinator, get_neighbours
+from profiler import StepProfiler
+from tlsagents.base import TLSFactory
+
+
+class Agent:
+    """
+    Minimal agent with a data pipeline, observes when it decides
+    """
+    def __init__(self, tls_id, data_pipeline, observes=True):
+        self.tls_id = tls_id
+        self.data_pipeline = data_pipeline
+        self.observes = observes
+        self.coordinator = None
+        self.variables = None
+        self.updates = 0
+
+    def prepare_step(self):
+        pass
+
+    def calculate_next_phase(self):
+        if self.observes:
+            self.variables = self.coordinator.get_observation(self.tls_id, self)
+        self.updates += 1
+        return 0
+
+    def apply_phase(self, next_phase):
+        pass
+
+
+class TestStepCoordinator(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    network_path = os.path.join(base_dir, "data", "test.net.xml")
+    routes_path = os.path.join(base_dir, "data", "routes.rou.xml")
+
+    def setUp(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        traci.start([sumo_bin, "-n", self.network_path, "-r", self.routes_path])
+        traci.simulationStep()
+
+    def tearDown(self):
+        traci.close()
+
+    def get_query(self, lanes):
+        return {
+            "user_data": [
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "phase",
+                    "mapping": {0: 'cars'}
+                },
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "lane",
+                    "mapping": {lane: 'lane_cars' for lane in lanes}
+                }],
+            "tls_data": []
+            }
+
+    def test_shared_observations(self):
+        values = {"cars": 0, "lane_cars": 0}
+        a = Agent("a", fe.TLSDataPipeline('C', -1, values, self.get_query(['NC_2', 'NC_3'])))
+        b = Agent("b", fe.TLSDataPipeline('C', -1, values, self.get_query(['NC_3'])))
+        timed = Agent("timed", fe.TLSDataPipeline('C', -1, values, self.get_query(['NC_2'])),
+            observes=False)
+        coordinator = StepCoordinator([a, b, timed], neighbours={"a": ["b"]})
+        self.assertIs(a.coordinator, coordinator)
+
+        for _ in range(2):
+            coordinator.step()
+        observations = coordinator.observations
+        self.assertDictEqual(observations["a"], a.data_pipeline.extract())
+        self.assertDictEqual(observations["b"], b.data_pipeline.extract())
+        self.assertEqual((a.updates, b.updates, timed.updates), (2, 2, 2))
+        # agents that do not observe are not extracted
+        self.assertNotIn("timed", observations)
+        self.assertIs(a.variables, observations["a"])
+
+        # lanes of the phase and the lane query of both pipelines are read once
+        phase_lanes = a.data_pipeline.phase_index.get_lanes(0)
+        self.assertEqual(
+            set(coordinator.cache.lane_vehicles), phase_lanes | {'NC_2', 'NC_3'})
+
+        neighbours = coordinator.get_neighbour_observations("a")
+        self.assertEqual(list(neighbours), ["b"])
+        # neighbours get a copy of the observation of the agent
+        self.assertEqual(neighbours["b"], observations["b"])
+        self.assertIsNot(neighbours["b"], observations["b"])
+        self.assertEqual(coordinator.get_neighbour_observations("b"), {})
+
+    def test_profiled_step(self):
+        values = {"cars": 0, "lane_cars": 0}
+        a = Agent("a", fe.TLSDataPipeline('C', -1, values, self.get_query(['NC_2'])))
+        profiler = StepProfiler()
+        coordinator = StepCoordinator([a], profiler=profiler)
+        for _ in range(3):
+            coordinator.step()
+        self.assertEqual(a.updates, 3)
+        self.assertEqual(
+            sorted(profiler.durations),
+            [("decide", "a"), ("extract", "a"), ("prepare", "a"), ("set_phase", "a")])
+        # extracted when deciding in the first step, in one pass from then on
+        self.assertEqual(len(profiler.durations[("extract", "a")]), 2)
+        self.assertEqual(len(profiler.durations[("decide", "a")]), 3)
+
+
+class TestShadows(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    network_path = os.path.join(base_dir, "data", "test.net.xml")
+    routes_path = os.path.join(base_dir, "data", "routes.rou.xml")
+
+    def setUp(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        traci.start([sumo_bin, "-n", self.network_path, "-r", self.routes_path])
+
+    def tearDown(self):
+        traci.close()
+
+    def test_shadow_follows_active(self):
+        variables = {"cars": 0}
+        query = {
+            "user_data": [{
+                "feature": "count",
+                "user_class": "passenger",
+                "at": "phase",
+                "mapping": {0: 'cars'}
+            }],
+            "tls_data": []
+        }
+        active = TLSFactory.create_agent("base_timed",
+            tls_id="C", constants={}, variables=variables, data_query=query)
+        same = TLSFactory.create_agent("base_timed",
+            tls_id="C", constants={}, variables=variables)
+        external = TLSFactory.create_agent("external",
+            tls_id="C", constants={}, variables=variables)
+        external.data_pipeline = active.data_pipeline
+        external.set_action(3)
+        coordinator = StepCoordinator(
+            [active], shadows={"C": {"same": same, "external": external}})
+        self.assertFalse(same.actuate or external.actuate)
+
+        switches = 0
+        for _ in range(100):
+            traci.simulationStep()
+            phase = active.phase
+            coordinator.step()
+            switches += active.phase != phase
+            shadows = coordinator.describe_shadows("C")
+
+            # a shadow with the same logic keeps the program timing
+            # of the active agent, shadows never switch the tls
+            self.assertTrue(shadows["same"]["agrees"])
+            self.assertEqual(shadows["external"]["phase"], 3)
+            self.assertEqual(traci.trafficlight.getPhase("C"), active.phase)
+            self.assertGreaterEqual(shadows["external"]["latency"], 0)
+        self.assertGreater(switches, 0)
+
+        # shadows read a copy of the observation extracted for the active agent
+        self.assertEqual(external.variables, coordinator.observations["C"])
+        self.assertIsNot(external.variables, coordinator.observations["C"])
+
+
+class TestNeighbours(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    network_path = os.path.join(base_dir, "examples", "block", "sumo", "block.net.xml")
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_grid(self):
+        topo = topology.NetworkTopology.load(self.network_path, self.cache_dir)
+        neighbours = get_neighbours(topo, topo.get_tls_ids())
+        self.assertEqual(sorted(neighbours["A1"]), ["A2", "B1"])
+        self.assertEqual(sorted(neighbours["B2"]), ["A2", "C2"])
+        self.assertEqual(get_neighbours(None, ["A1"]), {"A1": []})
@@ -5,6 +5,8 @@ import traci
 import sumolib
 
 import feature_extraction as fe
+import simbackend
+from simbackend import sim
 
 
 class TestFeatureExtractionCrossing(unittest.TestCase):
@@ -45,3 +47,85 @@ class TestFeatureExtractionCrossing(unittest.TestCase):
         pipeline = fe.TLSDataPipeline('C', -1, values, query)
         result = pipeline.extract()
         self.assertDictEqual(result, {'cars': 3})
+
+    def test_subscribed(self):
+        values = {"cars": 0, "lane_cars": 0}
+        query = {
+            "subscribe": True,
+            "user_data": [
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "phase",
+                    "mapping": {0: 'cars'}
+                },
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "lane",
+                    "mapping": {'NC_2': 'lane_cars', 'NC_3': 'lane_cars'}
+                }],
+            "tls_data": []
+            }
+        pipeline = fe.TLSDataPipeline('C', -1, values, query)
+        result = pipeline.extract()
+        self.assertDictEqual(result, {'cars': 3, 'lane_cars': 2})
+
+    def test_phase_index(self):
+        index = fe.TLSPhaseIndex('C')
+        values = {"cars": 0}
+        indexed = fe.add_typed_phase_count(values.copy(), 'C', 0, 'cars',
+            phase_index=index)
+        queried = fe.add_typed_phase_count(values.copy(), 'C', 0, 'cars')
+        self.assertDictEqual(indexed, queried)
+        self.assertTrue(index.get_lanes(0))
+
+        index.invalidate()
+        self.assertFalse(index.is_valid)
+        self.assertEqual(index.get_lanes(0), fe.TLSPhaseIndex('C').get_lanes(0))
+
+    def test_program_switch(self):
+        values = {"cars": 0}
+        query = {
+            "user_data": [
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "phase",
+                    "mapping": {0: 'cars'}
+                }],
+            "tls_data": []
+            }
+        pipeline = fe.TLSDataPipeline('C', -1, values, query)
+        pipeline.extract()
+        lanes = {i: pipeline.phase_index.get_lanes(i) for i in [0, 2]}
+        self.assertNotEqual(lanes[0], lanes[2])
+
+        # program with the states of phase 0 and 2 swapped, active once set
+        logic = sim.trafficlight.getAllProgramLogics('C')[0]
+        phases = list(logic.getPhases())
+        phases[0], phases[2] = phases[2], phases[0]
+        logic.programID = "swapped"
+        logic.phases = phases
+        sim.trafficlight.setProgramLogic('C', logic)
+        self.assertEqual(sim.trafficlight.getProgram('C'), "swapped")
+
+        pipeline.extract()
+        self.assertEqual(pipeline.phase_index.program_id, "swapped")
+        self.assertEqual(pipeline.phase_index.get_lanes(0), lanes[2])
+
+
+@unittest.skipUnless(simbackend.is_available("libsumo"), "libsumo is not installed")
+class TestFeatureExtractionLibsumo(TestFeatureExtractionCrossing):
+    """
+    Same test cases running SUMO in-process through libsumo backend
+    """
+    def setUp(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        sim.select("libsumo")
+        sim.start([sumo_bin, "-n", self.network_path, "-r", self.routes_path])
+        sim.simulationStep()
+
+    def tearDown(self):
+        sim.close()
+        sim.select("traci")
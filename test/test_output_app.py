@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import metrics.output_helper as oh
+
+# output_app imports output_helper as a top level module
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "metrics"))
+from output_app import DataModel
+
+
+class TestDataModel(unittest.TestCase):
+    """
+    Indexed time series have to match the reference scan of the frame
+    """
+    group_map = {"NS": ["a", "b"], "EW": ["c"]}
+    metrics = ["mean_speed", "max_queue_veh", "total_co2"]
+
+    def get_frame(self, group_map):
+        rng = np.random.default_rng(1)
+        rows = []
+        for run in ["timed", "mpc"]:
+            for begin in [0.0, 60.0, 120.0]:
+                for lane in ["a", "b", "c", "d"]:
+                    rows.append({
+                        "run_name": run,
+                        "begin": begin,
+                        "end": begin + 60,
+                        "lane": lane,
+                        "count": int(rng.integers(1, 10)),
+                        "mean_speed": rng.uniform(0, 15),
+                        "max_queue_veh": float(rng.integers(0, 8)),
+                        # negative values are left out of totals
+                        "total_co2": rng.uniform(-50, 500)
+                    })
+        return oh.add_lane_group_column(pd.DataFrame(rows), group_map)
+
+    def assert_series_equal(self, result, expected):
+        np.testing.assert_array_equal(result[0], expected[0])
+        np.testing.assert_allclose(result[1], expected[1])
+
+    def test_index_matches_scan(self):
+        model = DataModel(self.get_frame(self.group_map))
+        self.assertEqual(model.get_metrics(), self.metrics)
+        for run in ["timed", "mpc"]:
+            for lane_group in ["NS", "EW"]:
+                for metric in self.metrics:
+                    self.assert_series_equal(
+                        model.get_timeseries(run, metric, lane_group),
+                        model.scan_timeseries(run, metric, lane_group))
+
+        # unknown lane groups give the empty series of the scan
+        self.assert_series_equal(
+            model.get_timeseries("timed", "mean_speed", "d"),
+            model.scan_timeseries("timed", "mean_speed", "d"))
+
+    def test_group_map(self):
+        group_map = {"all": ["a", "b", "c", "d"], "d": ["d"]}
+        model = DataModel(self.get_frame(self.group_map))
+        reference = DataModel(self.get_frame(group_map))
+        for metric in self.metrics:
+            self.assert_series_equal(
+                model.get_timeseries("mpc", metric, "all", group_map=group_map),
+                reference.scan_timeseries("mpc", metric, "all"))
+
+    def test_group_map_cache(self):
+        model = DataModel(self.get_frame(self.group_map), cache_size=2)
+        group_maps = [{"g": [lane]} for lane in ["a", "b", "c"]]
+        keys = [json.dumps(g, sort_keys=True) for g in group_maps]
+
+        first = model.get_index(group_maps[0])
+        model.get_index(group_maps[1])
+        # a hit returns the memoized index and makes it the most recent
+        self.assertIs(model.get_index(group_maps[0]), first)
+        self.assertEqual(list(model.group_map_indices), [keys[1], keys[0]])
+
+        # the least recently used group map is evicted
+        model.get_index(group_maps[2])
+        self.assertEqual(list(model.group_map_indices), [keys[0], keys[2]])
+        self.assertIs(model.get_index(group_maps[0]), first)
+
+        self.assert_series_equal(
+            model.get_timeseries("timed", "total_co2", "g", group_map=group_maps[1]),
+            DataModel(self.get_frame(group_maps[1])).scan_timeseries("timed", "total_co2", "g"))
+        self.assertEqual(len(model.group_map_indices), 2)
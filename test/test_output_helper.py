@@ -0,0 +1,246 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+import metrics.output_helper as oh
+
+
+class TestReplications(unittest.TestCase):
+    """
+    Test cases for aggregating metrics over replications
+    """
+    def get_frame(self, n_replications=4):
+        rows = []
+        for rep in range(n_replications):
+            for begin in [0.0, 60.0]:
+                for lane in ["a", "b"]:
+                    rows.append({
+                        "run_name": f"ctrl-seed{rep}",
+                        "begin": begin,
+                        "end": begin + 60,
+                        "lane": lane,
+                        "count": rep + 1,
+                        "mean_speed": 10.0 + rep,
+                        "max_queue_veh": float(rep),
+                        "total_co2": 100.0 * rep
+                    })
+        return pd.DataFrame(rows)
+
+    def test_t_quantile(self):
+        result = oh.t_quantile(0.975, [1, 2, 5, 30])
+        expected = [12.706, 4.303, 2.571, 2.042]
+        np.testing.assert_allclose(result, expected, atol=2e-3)
+
+    def test_aggregate_metrics(self):
+        df = pd.DataFrame({
+            "lane": ["a", "a", "b"],
+            "count": [1.0, 3.0, 0.0],
+            "mean_speed": [4.0, 8.0, 5.0],
+            "max_queue_veh": [1.0, 2.0, 3.0],
+            "total_co2": [-1.0, 2.0, 3.0]
+        })
+        result = oh.aggregate_metrics(df, ["lane"]).set_index("lane")
+        self.assertEqual(result.loc["a", "mean_speed"], 7.0)
+        self.assertTrue(np.isnan(result.loc["b", "mean_speed"]))
+        self.assertEqual(result.loc["a", "max_queue_veh"], 2.0)
+        self.assertEqual(result.loc["a", "total_co2"], 2.0)
+        self.assertEqual(result.loc["a", "count"], 4.0)
+
+    def test_aggregate_replications(self):
+        df = self.get_frame()
+        result = oh.aggregate_replications(df)
+        self.assertEqual(len(result), 4)
+        self.assertTrue((result["experiment"] == "ctrl").all())
+        self.assertTrue((result["n_replications"] == 4).all())
+        np.testing.assert_allclose(result["mean_speed_mean"], 11.5)
+        np.testing.assert_allclose(result["mean_speed_std"], np.std([10, 11, 12, 13], ddof=1))
+
+        summary = oh.aggregate_replications(df, keys=())
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary.loc[0, "total_co2_mean"], 4 * 150.0)
+
+
+class TestStreamingReaders(unittest.TestCase):
+    """
+    Test cases comparing streaming readers with the ElementTree reference
+    """
+    det_metrics = {"meanSpeed": "mean_speed", "maxVehicleNumber": "count"}
+    emit_metrics = {"CO2_abs": "total_co2", "fuel_abs": "total_fuel"}
+
+    det_xml = """<detector>
+    <interval begin="0.00" end="60.00" id="e2det_NC_1" meanSpeed="3.5" maxVehicleNumber="2"/>
+    <interval begin="0.00" end="60.00" id="e2det_NC_2" meanSpeed="-1.00" maxVehicleNumber="0"/>
+    <interval begin="60.00" end="120.00" id="e2det_NC_1" meanSpeed="4.5" maxVehicleNumber="1"/>
+</detector>"""
+
+    emit_xml = """<meandata>
+    <interval begin="0.00" end="60.00" id="emit">
+        <edge id="NC">
+            <lane id="NC_1" CO2_abs="10.5" fuel_abs="1.5"/>
+            <lane id="NC_2" fuel_abs="0.5"/>
+        </edge>
+    </interval>
+    <interval begin="60.00" end="120.00" id="emit">
+        <edge id="NC">
+            <lane id="NC_1" CO2_abs="11.5" fuel_abs="2.5"/>
+        </edge>
+    </interval>
+</meandata>"""
+
+    def write(self, folder, name, text):
+        path = os.path.join(folder, name)
+        with open(path, "w") as fout:
+            fout.write(text)
+        return path
+
+    def test_detectors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write(tmp, "run_det.xml", self.det_xml)
+            result = oh.read_detectors_to_pandas(path, self.det_metrics)
+            root = ET.parse(path).getroot()
+        expected = pd.DataFrame(oh.get_detector_intervals(root, self.det_metrics))
+        pd.testing.assert_frame_equal(result, expected, check_like=True)
+
+    def test_emissions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write(tmp, "run_emit.xml", self.emit_xml)
+            result = oh.read_emissions_to_pandas(path, self.emit_metrics)
+            root = ET.parse(path).getroot()
+        expected = pd.DataFrame(oh.get_emission_intervals(root, self.emit_metrics))
+        pd.testing.assert_frame_equal(result, expected, check_like=True)
+
+    def test_wrong_root(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write(tmp, "run_emit.xml", self.emit_xml)
+            self.assertRaises(TypeError, oh.read_detectors_to_pandas, path, self.det_metrics)
+
+    def test_cached_folder(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write(tmp, "run_det.xml", self.det_xml)
+            self.write(tmp, "run_emit.xml", self.emit_xml)
+            self.write(tmp, "run.log", "")
+
+            expected = oh.output_folder_to_pandas(tmp, self.det_metrics, self.emit_metrics)
+            first = oh.output_folder_to_pandas(
+                tmp, self.det_metrics, self.emit_metrics, use_cache=True)
+            cached = os.listdir(os.path.join(tmp, oh.CACHE_DIR))
+            second = oh.output_folder_to_pandas(
+                tmp, self.det_metrics, self.emit_metrics, use_cache=True)
+
+            pd.testing.assert_frame_equal(first, expected)
+            pd.testing.assert_frame_equal(second, expected)
+            self.assertEqual(len(cached), 1)
+
+            # changed output replaces the cache entry
+            self.write(tmp, "run_det.xml", self.det_xml.replace("3.5", "5.25"))
+            third = oh.output_folder_to_pandas(
+                tmp, self.det_metrics, self.emit_metrics, use_cache=True)
+            recached = os.listdir(os.path.join(tmp, oh.CACHE_DIR))
+            self.assertEqual(len(recached), 1)
+            self.assertNotEqual(cached, recached)
+            self.assertIn(5.25, third["mean_speed"].values)
+
+    def test_parallel_folder(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for run in ["b", "a", "c"]:
+                self.write(tmp, f"{run}_det.xml", self.det_xml)
+                self.write(tmp, f"{run}_emit.xml", self.emit_xml)
+
+            expected = oh.output_folder_to_pandas(tmp, self.det_metrics, self.emit_metrics)
+            result = oh.output_folder_to_pandas(
+                tmp, self.det_metrics, self.emit_metrics, n_workers=2)
+
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(list(result["run_name"].unique()), ["a", "b", "c"])
+
+
+class TestLaneGroups(unittest.TestCase):
+    def setUp(self):
+        self.group_map = {
+            "EW": ["EC_1", "WC_1"],
+            "NS": ["NC_1", "SC_1", "EC_1"]
+        }
+        lanes = ["EC_1", "NC_1", "XC_1", "WC_1", "SC_1"] * 4
+        self.df = pd.DataFrame({"lane": lanes, "count": np.arange(len(lanes))})
+
+    def test_lookup_matches_assign_stream(self):
+        result = oh.add_lane_group_column(self.df.copy(), self.group_map)
+        expected = self.df["lane"].apply(oh.assign_stream, args=[self.group_map])
+        self.assertEqual(list(result["lane_group"]), list(expected))
+        self.assertTrue(pd.isna(result["lane_group"][2]))
+
+    def test_multiple_group_maps(self):
+        group_maps = {"approach": self.group_map, "side": {"E": ["EC_1"]}}
+        result = oh.add_lane_group_columns(self.df.copy(), group_maps)
+        self.assertEqual(list(result["lane_group_approach"][:2]), ["EW", "NS"])
+        self.assertEqual(result["lane_group_side"][0], "E")
+        self.assertTrue(pd.isna(result["lane_group_side"][1]))
+        self.assertEqual(oh.get_metric_columns(result), [])
+
+
+class TestCompactFrames(unittest.TestCase):
+    def setUp(self):
+        n = 6
+        self.df = pd.DataFrame({
+            "run_name": ["a"] * 2 * n,
+            "begin": np.tile(np.arange(n) * 60.0, 2),
+            "end": np.tile(np.arange(1, n + 1) * 60.0, 2),
+            "lane": ["L0"] * n + ["L1"] * n,
+            "count": np.arange(2 * n, dtype=float),
+            "mean_speed": np.linspace(1, 2, 2 * n),
+            "total_co2": np.ones(2 * n),
+            "max_queue": np.arange(2 * n, dtype=float),
+        })
+
+    def test_compact_dtypes(self):
+        result = oh.compact_frame(self.df)
+        self.assertIsInstance(result["lane"].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(result["run_name"].dtype, pd.CategoricalDtype)
+        self.assertEqual(result["mean_speed"].dtype, np.float32)
+        self.assertEqual(result["begin"].dtype, np.float64)
+        np.testing.assert_allclose(result["mean_speed"], self.df["mean_speed"], rtol=1e-6)
+
+    def test_downsample_intervals(self):
+        result = oh.downsample_intervals(self.df, 180)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(list(result["end"] - result["begin"]), [180] * 4)
+        self.assertEqual(result["total_co2"].sum(), self.df["total_co2"].sum())
+        self.assertEqual(result["count"].sum(), self.df["count"].sum())
+        self.assertEqual(list(result["max_queue"]), [2, 5, 8, 11])
+
+        first = self.df.iloc[:3]
+        expected = np.average(first["mean_speed"], weights=first["count"])
+        self.assertAlmostEqual(result["mean_speed"][0], expected)
+
+
+class TestDownsampling(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(10000, dtype=float)
+        self.x = np.sin(self.t / 300)
+        self.x[1234] = 5.0
+
+    def test_short_series_unchanged(self):
+        for downsample in oh.DOWNSAMPLERS.values():
+            t, x = downsample(self.t[:100], self.x[:100], 200)
+            np.testing.assert_array_equal(t, self.t[:100])
+
+    def test_downsample(self):
+        for name, downsample in oh.DOWNSAMPLERS.items():
+            t, x = downsample(self.t, self.x, 500)
+            self.assertLessEqual(len(t), 500, name)
+            self.assertTrue(np.all(np.diff(t) > 0), name)
+            self.assertEqual(x.max(), 5.0, name)
+
+    def test_minmax_keeps_extremes(self):
+        t, x = oh.minmax_downsample(self.t, self.x, 500)
+        self.assertEqual(x.min(), self.x.min())
+        self.assertEqual(x.max(), self.x.max())
+
+    def test_lttb_keeps_end_points(self):
+        t, x = oh.lttb_downsample(self.t, self.x, 500)
+        self.assertEqual(len(t), 500)
+        self.assertEqual((t[0], t[-1]), (self.t[0], self.t[-1]))
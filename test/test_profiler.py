@@ -0,0 +1,45 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from profiler import StepProfiler
+
+
+class TestStepProfiler(unittest.TestCase):
+
+    def test_summary(self):
+        profiler = StepProfiler()
+        for step in range(10):
+            profiler.stop(profiler.start(), "simulation_step")
+            for tls_id in ["a", "b"]:
+                profiler.stop(profiler.start(), "decide", tls_id)
+            profiler.next_step()
+
+        rows = profiler.get_summary()
+        self.assertEqual(
+            [(r["stage"], r["tls"], r["n"]) for r in rows],
+            [("simulation_step", "-", 10), ("decide", "a", 10), ("decide", "b", 10)])
+        for r in rows:
+            self.assertLessEqual(r["p50"], r["p95"])
+            self.assertLessEqual(r["p95"], r["max"])
+        self.assertAlmostEqual(sum([r["share"] for r in rows]), 1.0)
+        self.assertEqual(len(profiler.format_summary().splitlines()), 2 + len(rows))
+        self.assertIsNone(profiler.timeline)
+
+    def test_timeline(self):
+        profiler = StepProfiler(timeline=True)
+        for step in range(3):
+            profiler.stop(profiler.start(), "extract", "a")
+            profiler.next_step()
+
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            profiler.write_timeline(path)
+            with open(path, newline="") as fin:
+                rows = list(csv.DictReader(fin))
+        finally:
+            os.remove(path)
+        self.assertEqual([int(r["step"]) for r in rows], [0, 1, 2])
+        self.assertTrue(all([r["stage"] == "extract" and r["tls"] == "a" for r in rows]))
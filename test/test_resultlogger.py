@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+import resultlogger as rl
+
+
+class TestBufferedTLSLogger(unittest.TestCase):
+    """
+    Test cases for the buffered binary logger
+    """
+    def get_step(self, tls_id, phase, waiting):
+        return {
+            "state": {"id": tls_id, "phase": phase, "elapsed": 0},
+            "variables": {"waiting": waiting},
+            "objectives": {}
+        }
+
+    def test_flatten_dict(self):
+        result = rl.flatten_dict({"time": 1.0, "variables": {"w": [1, 2], "p": 0}})
+        expected = {"time": 1.0, "variables.w.0": 1, "variables.w.1": 2, "variables.p": 0}
+        self.assertDictEqual(result, expected)
+
+    def test_write_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            logger = rl.BufferedTLSLogger("run", ["A", "B"], ["state", "variables"],
+                to_file=True, directory=tmp, chunk_size=3)
+            for t in range(10):
+                logger.log(float(t), self.get_step("A", t % 2, [t, 0]))
+                logger.log(float(t), self.get_step("B", 0, [0, t]))
+            logger.close()
+
+            chunks = list(rl.read_log_chunks(os.path.join(tmp, "run.npy")))
+
+        # 10 records per TLS in chunks of 3
+        self.assertEqual(len(chunks), 8)
+        rows_a = [r for c in chunks for r in c if r["id"] == "A"]
+        self.assertEqual(len(rows_a), 10)
+        self.assertEqual([r["variables.waiting.0"] for r in rows_a], list(range(10)))
+        self.assertEqual([r["state.phase"] for r in rows_a], [t % 2 for t in range(10)])
+        self.assertNotIn("objectives", chunks[0].dtype.names)
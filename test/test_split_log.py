@@ -0,0 +1,46 @@
+import os
+import json
+import tempfile
+import unittest
+
+import split_log as sl
+
+
+class TestSplitLog(unittest.TestCase):
+    """
+    Test cases for reading and splitting TLS logs
+    """
+    phases = [0, 0, 0, 1, 1, 2]
+
+    def get_records(self):
+        records = []
+        elapsed = 0
+        for t, phase in enumerate(self.phases):
+            if t > 0 and phase != self.phases[t - 1]:
+                elapsed = 0
+            records.append({"time": float(t), "state": {"id": "A", "phase": phase, "elapsed": elapsed}})
+            elapsed += 1
+        return records
+
+    def write_log(self, folder, name, lines):
+        path = os.path.join(folder, name)
+        with open(path, "w") as fout:
+            fout.write("\n".join(lines) + "\n")
+        return path
+
+    def test_iter_log_formats(self):
+        records = self.get_records()
+        with tempfile.TemporaryDirectory() as tmp:
+            repr_log = self.write_log(tmp, "a.log", [str(r) for r in records])
+            json_log = self.write_log(tmp, "a.jsonl", [json.dumps(r) for r in records])
+            self.assertEqual(list(sl.iter_log(repr_log)), records)
+            self.assertEqual(list(sl.iter_log(json_log)), records)
+
+    def test_split_loglist(self):
+        result = sl.split_loglist(iter(self.get_records()), final_duration=10)
+        expected = {"A": [
+            {"phase": 0, "duration": 2},
+            {"phase": 1, "duration": 1},
+            {"phase": 2, "duration": 10}
+        ]}
+        self.assertDictEqual(result, expected)
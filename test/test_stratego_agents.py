@@ -0,0 +1,308 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+from concurrent.futures import ThreadPoolExecutor
+
+import traci
+import sumolib
+import strategoutil as sutil
+
+import resultlogger as rl
+import tlsagents.stratego_agents as sa
+from tlsagents.stratego_agents import (
+    Stratego2TLS, StategoOptimizer, ModelTemplate, DecisionCache, SolverStats, quantize)
+
+
+class FakeOptimizer:
+    """
+    Stands in for verifyta, always proposes movement phase 1
+    """
+    template_hash = "fake"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.n_runs = 0
+
+    def init_simfile(self):
+        pass
+
+    def update_state(self, values):
+        self.states = dict(values)
+
+    def insert_state(self):
+        pass
+
+    def run(self, queryfile="", learning_args=None, verifyta_command="verifyta", timeout=None):
+        self.n_runs += 1
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired(verifyta_command, timeout)
+        time.sleep(self.delay)
+        return (10, 20), (1, 2)
+
+
+class FakeStrategoTLS(Stratego2TLS):
+    def create_optimizer(self):
+        return FakeOptimizer(self.constants.get("delay", 0.0))
+
+
+class TestAsyncStratego(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sumo_dir = os.path.join(base_dir, "examples", "cross", "sumo")
+    network_path = os.path.join(sumo_dir, "networks", "cross6_LFR_exits.net.xml")
+    tll_path = os.path.join(sumo_dir, "tll", "cross_standart_left_wt.tll.xml")
+    routes_path = os.path.join(sumo_dir, "demands", "vehicles.rou.xml")
+
+    def setUp(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        traci.start([sumo_bin, "-n", self.network_path, "-a", self.tll_path,
+            "-r", self.routes_path])
+        traci.simulationStep()
+
+    def tearDown(self):
+        traci.close()
+
+    def create_agent(self, **constants):
+        query = {
+            "user_data": [{
+                "feature": "count",
+                "user_class": "passenger",
+                "at": "lane",
+                "mapping": {"NC_2": "cars"}
+            }],
+            "tls_data": []
+        }
+        constants = dict({"mpc_step": 2, "min_green": 4, "n_movement_phases": 8}, **constants)
+        return FakeStrategoTLS("C", constants, {"cars": 0}, query)
+
+    def run_agent(self, agent, n_steps):
+        phases = []
+        for _ in range(n_steps):
+            agent.prepare_step()
+            agent.update_state()
+            phases.append(agent.phase)
+        return phases
+
+    def test_async_matches_sync(self):
+        sync_phases = self.run_agent(self.create_agent(), 6)
+        agent = self.create_agent(async_solve=True)
+        self.assertEqual(self.run_agent(agent, 6), sync_phases)
+        # decision at elapsed 4 switches to transition (0, 1)
+        self.assertEqual(sync_phases[4], 8)
+
+    def test_single_extraction(self):
+        agent = self.create_agent(async_solve=True)
+        extract = agent.data_pipeline.extract
+        calls = []
+        agent.data_pipeline.extract = lambda *args: calls.append(1) or extract(*args)
+        self.run_agent(agent, 6)
+        self.assertEqual(len(calls), 6)
+
+    def test_decision_latency(self):
+        agent = self.create_agent(async_solve=True, decision_latency=2)
+        phases = self.run_agent(agent, 8)
+        self.assertEqual(phases[4:7], [0, 0, 8])
+        self.assertEqual(agent.optimizer.n_runs, 1)
+
+    def test_stale_decision(self):
+        agent = self.create_agent(async_solve=True, decision_latency=2)
+        agent.elapsed = 4
+        agent.prepare_step()
+        self.assertEqual(agent.calculate_next_phase(), 0)
+
+        # phase 3 started while waiting, there is no transition (3, 1)
+        agent.phase, agent.elapsed = 3, 0
+        for _ in range(2):
+            next_phase = agent.calculate_next_phase()
+        self.assertIsNone(agent.pending)
+        self.assertLess(next_phase, agent.n_movement_phases)
+
+        agent.phase = 0
+        self.assertIsNone(agent.get_transition(3))
+        self.assertEqual(agent.get_transition(1), 8)
+
+    def test_decision_cache(self):
+        agent = self.create_agent(decision_cache_size=4, decision_cache_quantum=100)
+        next_phases = []
+        for _ in range(3):
+            agent.phase, agent.elapsed = 0, 4
+            next_phases.append(agent.calculate_next_phase())
+        agent.phase, agent.elapsed = 1, 4
+        next_phases.append(agent.calculate_next_phase())
+
+        self.assertEqual(next_phases, [8, 8, 8, 1])
+        self.assertEqual(agent.optimizer.n_runs, 2)
+        self.assertEqual(agent.decision_cache.get_stats(),
+            {"hits": 2, "misses": 2, "size": 2, "hit_rate": 0.5})
+
+    def test_timeout_fallback(self):
+        agent = self.create_agent(delay=0.5, solve_timeout=0.05)
+        agent.elapsed = 4
+        # timed program keeps the phase, no transition to (0, 1)
+        self.assertEqual(agent.calculate_next_phase(), 0)
+
+        stats = agent.get_solver_stats()
+        self.assertEqual((stats["n"], stats["timeouts"]), (1, 1))
+        self.assertGreaterEqual(stats["last"], 0.05)
+        self.assertLess(stats["last"], 0.5)
+
+        self.assertTrue(stats["solved"])
+
+        # steps without solve report the same statistics
+        agent.elapsed = 5
+        agent.calculate_next_phase()
+        stats = agent.get_solver_stats()
+        self.assertFalse(stats["solved"])
+        self.assertEqual(stats["n"], 1)
+
+    def test_solver_log_chunks(self):
+        agent = self.create_agent(decision_cache_size=4)
+        with tempfile.TemporaryDirectory() as tmp:
+            logger = rl.BufferedTLSLogger("run", ["C"], ["state", "solver"],
+                to_file=True, directory=tmp)
+            for t in range(20):
+                agent.prepare_step()
+                agent.update_state()
+                logger.log(float(t), agent.decsribe_step())
+            logger.close()
+            chunks = list(rl.read_log_chunks(os.path.join(tmp, "run.npy")))
+
+        # steps with and without solve share the columns of one chunk
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(chunks[0]), 20)
+        self.assertTrue(0 < chunks[0]["solver.solved"].sum() < 20)
+        self.assertEqual(chunks[0]["solver.last"].dtype, float)
+
+    def test_parallel_solves(self):
+        # shared pool has one worker per core, do not depend on the machine
+        pool = sa.solver_pool
+        sa.solver_pool = ThreadPoolExecutor(4)
+        self.addCleanup(setattr, sa, "solver_pool", pool)
+
+        agents = [self.create_agent(async_solve=True, delay=0.5) for _ in range(4)]
+        for agent in agents:
+            agent.elapsed = 4
+
+        t_start = time.perf_counter()
+        for agent in agents:
+            agent.prepare_step()
+        next_phases = [agent.calculate_next_phase() for agent in agents]
+        duration = time.perf_counter() - t_start
+
+        self.assertEqual(next_phases, [8] * 4)
+        self.assertLess(duration, 1.5)
+
+
+class TestDecisionCache(unittest.TestCase):
+    def test_lru(self):
+        cache = DecisionCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_stats(),
+            {"hits": 1, "misses": 1, "size": 2, "hit_rate": 0.5})
+
+    def test_solver_stats(self):
+        stats = SolverStats()
+        for duration in [0.005, 0.02, 0.02, 2.0, 500.0]:
+            stats.record(duration)
+        summary = stats.get_summary()
+        self.assertEqual(summary["histogram"], [1, 2, 0, 0, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(summary["max"], 500.0)
+        self.assertEqual(summary["last"], 500.0)
+        self.assertAlmostEqual(summary["mean"], 502.045 / 5)
+
+    def test_quantize(self):
+        state = {"waiting": [0, 1, 2, 6], "phase": 3}
+        self.assertEqual(quantize(state, 4), (("phase", 4), ("waiting", (0, 0, 0, 8))))
+        self.assertEqual(quantize(state), (("phase", 3), ("waiting", (0, 1, 2, 6))))
+
+
+class TestModelFile(unittest.TestCase):
+    def test_remove_twice(self):
+        path = sa.create_model_file("cross_mpc_template.xml", name="C")
+        self.assertTrue(os.path.basename(path).startswith("cross_mpc_template_C_"))
+        sa.remove_model_file(path)
+        self.assertFalse(os.path.exists(path))
+        # already removed files are ignored
+        sa.remove_model_file(path)
+
+
+class TestModelTemplate(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    template_path = os.path.join(
+        base_dir, "examples", "cross", "stratego", "cross_mpc_template.xml")
+
+    def test_matches_file_insert(self):
+        values = {
+            "phase": "3",
+            "waiting": sutil.array_to_stratego(list(range(20)))
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            model_file = os.path.join(tmp, "model.xml")
+            shutil.copyfile(self.template_path, model_file)
+            for name, value in values.items():
+                sutil.insert_to_modelfile(model_file, "//TAG_" + name, value)
+            with open(model_file, "r") as fin:
+                expected = fin.read()
+
+        template = ModelTemplate(self.template_path)
+        self.assertEqual(template.tags, ["phase", "waiting"])
+        self.assertEqual(template.render(values), expected)
+
+    def test_first_occurrence_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_file = os.path.join(tmp, "model.xml")
+            with open(model_file, "w") as fout:
+                fout.write("int a = //TAG_a; int b = //TAG_b; //TAG_a")
+            template = ModelTemplate(model_file)
+
+        self.assertEqual(template.render({"a": "1"}), "int a = 1; int b = //TAG_b; //TAG_a")
+
+
+class TestRunVerifyta(unittest.TestCase):
+    """
+    verifyta replaced by a script in a fake home directory
+    """
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.optimizer = StategoOptimizer.__new__(StategoOptimizer)
+        self.optimizer.simulationfile = os.path.join(self.home, "model.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def write_verifyta(self, script):
+        path = os.path.join(self.home, "verifyta")
+        with open(path, "w") as fout:
+            fout.write("#!/bin/sh\n" + script)
+        os.chmod(path, 0o755)
+
+    def run_verifyta(self, command):
+        with mock.patch.dict(os.environ, {"HOME": self.home}):
+            return self.optimizer.run(verifyta_command=command, timeout=5)
+
+    def test_command(self):
+        self.write_verifyta('echo "$@"')
+        output = self.optimizer.run_verifyta(
+            verifyta_command=os.path.join(self.home, "verifyta") + " -q", timeout=5)
+        self.assertEqual(output.split(), ["-q", self.optimizer.simulationfile])
+
+    def test_empty_strategy(self):
+        self.write_verifyta("echo")
+        self.assertEqual(self.run_verifyta("~/verifyta"), ((), ()))
+
+    def test_errors(self):
+        self.write_verifyta("echo 'syntax error' >&2")
+        with self.assertRaisesRegex(RuntimeError, "syntax error"):
+            self.run_verifyta("~/verifyta")
+        self.write_verifyta("exit 3")
+        with self.assertRaisesRegex(RuntimeError, "exit code 3"):
+            self.run_verifyta("~/verifyta")
@@ -0,0 +1,154 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import yaml
+
+from tlsenv import TLSEnv, VectorTLSEnv, flatten_variables
+
+
+class TestTLSEnv(unittest.TestCase):
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    max_steps = 20
+
+    def setUp(self):
+        config = {
+            "job": {"name": "env", "dir": os.path.join(self.base_dir, "data")},
+            "sumo": {
+                "dir": ".",
+                "gui": False,
+                "max_steps": self.max_steps,
+                "network": "test.net.xml",
+                "additional": [],
+                "route": ["routes.rou.xml"]
+            },
+            "tls": [{
+                "id": "C",
+                "controller": "external",
+                "constants": {},
+                "variables": {"cars": 0, "lanes": [0, 0]},
+                "extract": {
+                    "user_data": [
+                        {
+                            "feature": "count",
+                            "user_class": "passenger",
+                            "at": "phase",
+                            "mapping": {0: "cars"}
+                        },
+                        {
+                            "feature": "count",
+                            "user_class": "passenger",
+                            "at": "lane",
+                            "mapping": {"NC_2": ["lanes", 0], "SC_2": ["lanes", 1]}
+                        }],
+                    "tls_data": []
+                }
+            }]
+        }
+        fd, self.config_file = tempfile.mkstemp(suffix=".yml")
+        with os.fdopen(fd, "w") as fout:
+            yaml.safe_dump(config, fout)
+
+        # random arrivals, so episodes depend on the seed
+        fd, self.routes_file = tempfile.mkstemp(suffix=".rou.xml")
+        with os.fdopen(fd, "w") as fout:
+            fout.write("""<routes>
+    <vType id="car" vClass="passenger"/>
+    <flow id="f" type="car" begin="0" end="100" probability="0.5" departLane="2">
+        <route edges="NC CS"/>
+    </flow>
+</routes>""")
+        config["sumo"]["route"] = [self.routes_file]
+        fd, self.random_config_file = tempfile.mkstemp(suffix=".yml")
+        with os.fdopen(fd, "w") as fout:
+            yaml.safe_dump(config, fout)
+
+    def tearDown(self):
+        os.remove(self.config_file)
+        os.remove(self.random_config_file)
+        os.remove(self.routes_file)
+
+    def test_flatten_variables(self):
+        self.assertEqual(flatten_variables({"a": 1, "b": [2, 3], "c": 4}), [1, 2, 3, 4])
+
+    def test_episode(self):
+        env = TLSEnv(self.config_file)
+        try:
+            obs, info = env.reset(seed=1)
+            # cars, two lanes, phase and elapsed time of C
+            self.assertEqual(obs.shape, (5,))
+            self.assertEqual(obs[0], 3)
+            self.assertEqual(env.get_action_sizes(), [10])
+
+            obs, reward, terminated, truncated, info = env.step([2])
+            self.assertEqual(info["phases"], [2])
+            self.assertEqual(obs[-2:].tolist(), [2, 0])
+            self.assertLessEqual(reward, 0)
+
+            n_steps = 1
+            while not (terminated or truncated):
+                obs, reward, terminated, truncated, info = env.step([2])
+                n_steps += 1
+            self.assertTrue(truncated)
+            self.assertEqual(n_steps, self.max_steps - 1)
+            self.assertEqual(obs[-1], n_steps - 1)
+
+            with self.assertRaises(AssertionError):
+                env.step([10])
+        finally:
+            env.close()
+
+    def test_vector(self):
+        venv = VectorTLSEnv(self.config_file, 2, steps_per_action=5)
+        try:
+            obs, infos = venv.reset(seed=1)
+            self.assertEqual(obs.shape, (2, 5))
+            self.assertEqual(infos[0]["action_sizes"], [10])
+
+            for _ in range(3):
+                obs, rewards, terminated, truncated, infos = venv.step(np.zeros((2, 1), dtype=int))
+            self.assertEqual(obs.shape, (2, 5))
+            self.assertEqual(rewards.shape, (2,))
+            self.assertFalse(truncated.any())
+
+            # the fourth action reaches max_steps, info is of the last
+            # step and environments are reset
+            obs, rewards, terminated, truncated, infos = venv.step(np.zeros((2, 1), dtype=int))
+            self.assertTrue(truncated.all())
+            self.assertEqual(infos[0]["time"], self.max_steps)
+            self.assertIn("final_observation", infos[0])
+            # one step into the new episodes
+            self.assertEqual(obs[:, -1].tolist(), [1, 1])
+        finally:
+            venv.close()
+
+    def run_vector_episode(self, venv):
+        """
+        Observations of every step of the episodes until they are truncated
+        """
+        actions = np.zeros((venv.n_envs, 1), dtype=int)
+        trajectory = []
+        while True:
+            obs, rewards, terminated, truncated, infos = venv.step(actions)
+            if truncated.all():
+                trajectory.append(np.stack([info["final_observation"] for info in infos]))
+                return np.stack(trajectory)
+            trajectory.append(obs)
+
+    def test_vector_seeds(self):
+        venv = VectorTLSEnv(self.random_config_file, 2)
+        try:
+            venv.reset(seed=1)
+            self.run_vector_episode(venv)
+
+            # automatic resets get their own seed per worker
+            second = self.run_vector_episode(venv)
+            self.assertFalse(np.array_equal(second[:, 0], second[:, 1]))
+
+            # without seed, workers start from their index
+            venv.reset()
+            first = self.run_vector_episode(venv)
+            self.assertFalse(np.array_equal(first[:, 0], first[:, 1]))
+        finally:
+            venv.close()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import traci
+import sumolib
+
+import topology
+import feature_extraction as fe
+
+
+class TestNetworkTopology(unittest.TestCase):
+    """
+    Topology parsed from the network has to match what SUMO reports
+    """
+    tls_id = 'C'
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    network_path = os.path.join(base_dir, "data", "test.net.xml")
+    routes_path = os.path.join(base_dir, "data", "routes.rou.xml")
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.topo = topology.NetworkTopology.load(self.network_path, self.cache_dir)
+        sumo_bin = sumolib.checkBinary('sumo')
+        traci.start([sumo_bin, "-n", self.network_path, "-r", self.routes_path])
+        traci.simulationStep()
+
+    def tearDown(self):
+        traci.close()
+        topology.active = None
+        shutil.rmtree(self.cache_dir)
+
+    def test_matches_traci(self):
+        self.assertEqual(self.topo.get_tls_ids(), list(traci.trafficlight.getIDList()))
+        self.assertEqual(self.topo.lanes, set(traci.lane.getIDList()))
+        self.assertEqual(
+            self.topo.get_controlled_links(self.tls_id),
+            [[tuple(l) for l in links]
+                for links in traci.trafficlight.getControlledLinks(self.tls_id)])
+        self.assertEqual(
+            self.topo.get_controlled_lanes(self.tls_id),
+            list(traci.trafficlight.getControlledLanes(self.tls_id)))
+
+        edges = traci.edge.getIDList()
+        self.assertEqual(self.topo.get_walking_edges(self.tls_id),
+            [e for e in edges if e.startswith(":C_w")])
+        self.assertEqual(self.topo.get_crossing_edges(self.tls_id),
+            [e for e in edges if e.startswith(":C_c")])
+
+        phases = traci.trafficlight.getAllProgramLogics(self.tls_id)[-1].getPhases()
+        self.assertEqual(self.topo.get_phase_states(self.tls_id), [p.state for p in phases])
+
+    def test_sidecar(self):
+        sidecar = topology.get_sidecar_path(self.network_path, self.cache_dir)
+        self.assertTrue(os.path.isfile(sidecar))
+
+        # sidecar of a different network is ignored and replaced
+        net_copy = os.path.join(self.cache_dir, "copy.net.xml")
+        shutil.copy(self.network_path, net_copy)
+        shutil.copy(sidecar, topology.get_sidecar_path(net_copy))
+        with open(net_copy, "a") as fout:
+            fout.write("\n")
+        topo = topology.NetworkTopology.load(net_copy)
+        self.assertNotEqual(topo.net_hash, self.topo.net_hash)
+        self.assertEqual(topo.get_tls_ids(), self.topo.get_tls_ids())
+
+    def test_pipeline(self):
+        values = {"cars": 0, "lane_cars": 0}
+        query = {
+            "user_data": [
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "phase",
+                    "mapping": {0: 'cars'}
+                },
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "lane",
+                    "mapping": {'NC_2': 'lane_cars', 'NC_3': 'lane_cars'}
+                }],
+            "tls_data": []
+            }
+        queried = fe.TLSDataPipeline(self.tls_id, -1, values, query)
+        topology.active = self.topo
+        cached = fe.TLSDataPipeline(self.tls_id, -1, values, query)
+
+        self.assertEqual(cached.walking_edges, queried.walking_edges)
+        self.assertEqual(cached.crossing_edges, queried.crossing_edges)
+        self.assertEqual(cached.phase_index.lanes, queried.phase_index.lanes)
+        self.assertEqual(cached.phase_index.crossing_edges, queried.phase_index.crossing_edges)
+        self.assertDictEqual(cached.extract(), queried.extract())
+
+        with self.assertRaises(AssertionError):
+            query["user_data"][1]["mapping"] = {"XX_0": "lane_cars"}
+            fe.TLSDataPipeline(self.tls_id, -1, values, query)
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import sumolib
+
+import feature_extraction as fe
+import simbackend
+import tracireplay
+from simbackend import sim
+
+
+class TestTraceReplay(unittest.TestCase):
+    """
+    Pipelines on a replayed trace have to extract what they extracted
+    on the live simulation
+    """
+    tls_id = 'C'
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    network_path = os.path.join(base_dir, "data", "test.net.xml")
+    routes_path = os.path.join(base_dir, "data", "routes.rou.xml")
+    n_steps = 20
+
+    def setUp(self):
+        fd, self.trace_file = tempfile.mkstemp(suffix=".trace")
+        os.close(fd)
+
+    def tearDown(self):
+        sim.select("traci")
+        os.remove(self.trace_file)
+
+    def get_query(self, subscribe):
+        return {
+            "subscribe": subscribe,
+            "user_data": [
+                {
+                    "feature": "count",
+                    "user_class": "passenger",
+                    "at": "phase",
+                    "mapping": {0: 'cars'}
+                },
+                {
+                    "feature": "count",
+                    "user_class": "pedestrian",
+                    "at": "phase",
+                    "mapping": {2: 'peds'}
+                }],
+            "tls_data": [
+                {
+                    "feature": "elapsed_time",
+                    "to_variable": "elapsed"
+                }]
+            }
+
+    def run_pipelines(self):
+        values = {"cars": 0, "peds": 0, "elapsed": 0}
+        pipelines = [
+            fe.TLSDataPipeline(self.tls_id, -1, values, self.get_query(subscribe))
+            for subscribe in [False, True]]
+        results = []
+        for _ in range(self.n_steps):
+            sim.simulationStep()
+            results.append([(sim.simulation.getTime(), p.extract()) for p in pipelines])
+        sim.close()
+        return results
+
+    def test_replay(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        cmd = [sumo_bin, "-n", self.network_path, "-r", self.routes_path]
+        sim.select("traci")
+        sim.use_trace(self.trace_file)
+        sim.start(cmd)
+        recorded = self.run_pipelines()
+        self.assertTrue(any([r[1]["cars"] > 0 for step in recorded for r in step]))
+
+        sim.select("replay")
+        sim.use_trace(self.trace_file)
+        sim.start(cmd)
+        self.assertEqual(self.run_pipelines(), recorded)
+
+    def test_not_recorded(self):
+        sim.select("traci")
+        sim.use_trace(self.trace_file)
+        sim.start([sumolib.checkBinary('sumo'), "-n", self.network_path])
+        sim.simulationStep()
+        sim.close()
+
+        sim.select("replay")
+        with self.assertRaises(AssertionError):
+            sim.start([])
+        sim.use_trace(self.trace_file)
+        sim.start([])
+        sim.simulationStep()
+        with self.assertRaises(KeyError):
+            sim.lane.getLastStepVehicleIDs("NC_2")
+        self.assertIsNone(sim.trafficlight.setPhase(self.tls_id, 1))
+
+    @unittest.skipUnless(simbackend.is_available("libsumo"), "libsumo is not installed")
+    def test_libsumo(self):
+        sumo_bin = sumolib.checkBinary('sumo')
+        cmd = [sumo_bin, "-n", self.network_path, "-r", self.routes_path]
+        sim.select("libsumo")
+        sim.use_trace(self.trace_file)
+        sim.start(cmd)
+        recorded = self.run_pipelines()
+
+        sim.select("replay")
+        sim.use_trace(self.trace_file)
+        sim.start(cmd)
+        logic = sim.trafficlight.getAllProgramLogics(self.tls_id)[0]
+        self.assertEqual(len(logic.getPhases()), 10)
+        sim.close()
+
+        sim.start(cmd)
+        self.assertEqual(self.run_pipelines(), recorded)
+
+    def test_failed_save(self):
+        tracireplay.save_trace(self.trace_file, {"version": tracireplay.TRACE_VERSION})
+        with self.assertRaises(TypeError):
+            tracireplay.save_trace(self.trace_file, {"steps": [threading.Lock()]})
+        # previous trace is kept and no partial file is left
+        self.assertEqual(tracireplay.load_trace(self.trace_file)["version"], tracireplay.TRACE_VERSION)
+        self.assertFalse(os.path.exists(f"{self.trace_file}.tmp"))
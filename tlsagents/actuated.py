@@ -38,7 +38,7 @@ class ActuatedTLS(TimedTLS):
 		next_phase = self.phase
 
 		# read state
-		self.variables = self.data_pipeline.extract()
+		self.variables = self.observe()
 
 		# remember request
 		if self.is_switch_time() and self.phase in self.decision_phases:
@@ -1,7 +1,7 @@
 import warnings
 import copy
 from typing import Callable
-import traci
+from simbackend import sim
 from feature_extraction import TLSDataPipeline
 
 
@@ -52,7 +52,7 @@ class TLSAgent:
 		self.tls_id = tls_id
 		self.tls_program = -1
 		self.phase = 0
-		self.phase_list = traci.trafficlight.getAllProgramLogics(
+		self.phase_list = sim.trafficlight.getAllProgramLogics(
 			self.tls_id)[self.tls_program].getPhases() # will break if pre-loaded tls
 		self.n_phases = len(self.phase_list)
 		self.elapsed = 0
@@ -70,6 +70,29 @@ class TLSAgent:
 		
 		self.optimizer = optimizer
 
+		# set by StepCoordinator when the agent runs in a coordinated network
+		self.coordinator = None
+
+		# shadow agents decide on the shared observations without switching the tls
+		self.actuate = True
+
+	def observe(self):
+		"""
+		Extract variables of the step, taken from the coordinator
+		if the agent is coordinated
+		"""
+		if self.coordinator is not None:
+			return self.coordinator.get_observation(self.tls_id, self)
+		return self.data_pipeline.extract()
+
+	def get_neighbour_observations(self):
+		"""
+		Observations of neighbouring TLS, {tls_id: variables}
+		"""
+		if self.coordinator is None:
+			return {}
+		return self.coordinator.get_neighbour_observations(self.tls_id)
+
 	def next_phase_id(self):
 		"""
 		calculate id of next phase
@@ -79,6 +102,13 @@ class TLSAgent:
 			next_phase = self.phase_list[self.phase].next[0]
 		return next_phase
 
+	def prepare_step(self):
+		"""
+		Called for all agents before any of them is updated in the step,
+		i.e. to start work that runs in parallel with other agents
+		"""
+		pass
+
 	def calculate_next_phase(self):
 		"""
 		Here goes update logic using constants, 
@@ -91,12 +121,19 @@ class TLSAgent:
 		Given the updated logic the phases are continued and timed
 		"""
 		next_phase = self.calculate_next_phase()
+		self.apply_phase(next_phase)
+
+	def apply_phase(self, next_phase):
+		"""
+		Continue the current phase or switch the tls to the next one
+		"""
 		if self.phase == next_phase:
 			self.elapsed += 1
 		else:
 			self.phase = next_phase
 			self.elapsed = 0
-			traci.trafficlight.setPhase(self.tls_id, self.phase)
+			if self.actuate:
+				sim.trafficlight.setPhase(self.tls_id, self.phase)
 
 	def decsribe_step(self):
 		"""
@@ -106,11 +143,18 @@ class TLSAgent:
             "state": self.get_state(),
             "variables": self.get_variables(),
 			"objectives": self.get_objectives(),
+			"solver": self.get_solver_stats(),
             }
 
 	def get_objectives(self):
 		return self.objectives
 
+	def get_solver_stats(self):
+		"""
+		Statistics of the optimizer runs, {} for controllers without optimizer
+		"""
+		return {}
+
 	def get_state(self):
 		"""
 		Return traffic signal state
@@ -139,7 +183,11 @@ class TimedTLS(TLSAgent):
 		super().__init__(tls_id, constants, variables, data_query, optimizer)
 
 	def is_switch_time(self):
-		dt = traci.trafficlight.getNextSwitch(self.tls_id) - traci.simulation.getTime()
+		if not self.actuate:
+			# shadow phase is not the one running in SUMO, time it by the program
+			dt = self.phase_list[self.phase].duration - (self.elapsed + 1)
+			return int(dt) == 0
+		dt = sim.trafficlight.getNextSwitch(self.tls_id) - sim.simulation.getTime()
 		return int(dt) == 0
 
 	def calculate_next_phase(self):
@@ -196,7 +244,7 @@ class CrosswalkTLS(TimedTLS):
 		next_phase = self.phase
 
 		# read state
-		self.variables = self.data_pipeline.extract()
+		self.variables = self.observe()
 
 		# check if request is sent during vehicle phase
 		is_requested = False
@@ -210,3 +258,29 @@ class CrosswalkTLS(TimedTLS):
 		return next_phase
 
 
+@TLSFactory.register_agent('external')
+class ExternalTLS(TLSAgent):
+	"""
+	Controller class whose phases are chosen outside of the simulation
+	loop, i.e. by a reinforcement learning policy through TLSEnv
+	"""
+	def __init__(self, tls_id, constants=None, variables=None, data_query=None, optimizer=None):
+		super().__init__(tls_id, constants, variables, data_query, optimizer)
+		self.action = None
+
+	def set_action(self, phase):
+		"""
+		Phase to switch to on the next update, kept until the next action
+		"""
+		assert 0 <= phase < self.n_phases, \
+			f"Phase {phase} of {self.tls_id} is out of range, expected 0 - {self.n_phases - 1}"
+		self.action = int(phase)
+
+	def calculate_next_phase(self):
+		if self.data_pipeline is not None:
+			self.variables = self.observe()
+
+		next_phase = self.phase
+		if self.action is not None:
+			next_phase = self.action
+		return next_phase
@@ -1,15 +1,201 @@
+import os
+import re
+import time
+import shlex
+import signal
+import hashlib
+import contextlib
+import subprocess
+import tempfile
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from tlsagents.base import TLSAgent, TimedTLS, TLSFactory
 import strategoutil as sutil
 from strategoutil import StrategoController
 
 
+# verifyta runs as a separate process, threads only wait for it
+solver_pool = None
+
+def get_solver_pool():
+	"""
+	Pool shared by all asynchronous Stratego agents, created on first use
+	"""
+	global solver_pool
+	if solver_pool is None:
+		solver_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+	return solver_pool
+
+
+class ModelTemplate:
+	"""
+	UPPAAL model template parsed once, the text is split at the tags
+	so a model is rendered in memory by joining the parts with values.
+	As with insert_to_modelfile only the first occurrence of a tag is replaced
+	"""
+	def __init__(self, templatefile, tag_rule="//TAG_{}"):
+		with open(templatefile, "r") as fin:
+			text = fin.read()
+		self.tag_rule = tag_rule
+		self.hash = hashlib.sha1(text.encode()).hexdigest()
+
+		pattern = re.compile(re.escape(tag_rule).replace(re.escape("{}"), r"(\w+)"))
+		self.parts = []
+		self.tags = []
+		pos = 0
+		for match in pattern.finditer(text):
+			if match.group(1) in self.tags:
+				continue
+			self.parts.append(text[pos:match.start()])
+			self.tags.append(match.group(1))
+			pos = match.end()
+		self.parts.append(text[pos:])
+
+	def render(self, values):
+		"""
+		Model text with tags replaced by values, tags without value are kept
+		"""
+		text = [self.parts[0]]
+		for tag, part in zip(self.tags, self.parts[1:]):
+			text.append(values.get(tag, self.tag_rule.format(tag)))
+			text.append(part)
+		return "".join(text)
+
+
+def create_model_file(templatefile, name=None):
+	"""
+	Temporary model file of a single optimizer, removed with the optimizer
+	"""
+	stem = os.path.splitext(os.path.basename(templatefile))[0]
+	prefix = f"{stem}_{name}_" if name is not None else f"{stem}_"
+	fd, path = tempfile.mkstemp(prefix=prefix, suffix=".xml")
+	os.close(fd)
+	return path
+
+
+def remove_model_file(path):
+	"""
+	Remove the model file if it still exists, i.e. temp dir cleanup
+	or a copy of the optimizer may have removed it already
+	"""
+	with contextlib.suppress(FileNotFoundError):
+		os.remove(path)
+
+
+def get_file_hash(file):
+	with open(file, "rb") as fin:
+		return hashlib.sha1(fin.read()).hexdigest()
+
+
+class DecisionCache:
+	"""
+	Bounded LRU of solver results keyed by the discretized
+	model state, counts hits and misses
+	"""
+	def __init__(self, max_size=128):
+		self.max_size = max_size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+		return None
+
+	def put(self, key, value):
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		if len(self.entries) > self.max_size:
+			self.entries.popitem(last=False)
+
+	def get_stats(self):
+		n = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"size": len(self.entries),
+			"hit_rate": self.hits / n if n else 0.0
+		}
+
+
+class SolverStats:
+	"""
+	Wall times of solver runs in a histogram with log spaced bins,
+	bins are upper edges in seconds, the last bin counts longer solves
+	"""
+	BINS = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100]
+
+	def __init__(self):
+		self.counts = [0] * (len(SolverStats.BINS) + 1)
+		self.n = 0
+		self.timeouts = 0
+		self.total = 0.0
+		self.max = 0.0
+		# nan until the first solve, so logged columns keep a float type
+		self.last = float("nan")
+
+	def record(self, duration, timeout=False):
+		idx = len(SolverStats.BINS)
+		for i, edge in enumerate(SolverStats.BINS):
+			if duration <= edge:
+				idx = i
+				break
+		self.counts[idx] += 1
+		self.n += 1
+		self.timeouts += int(timeout)
+		self.total += duration
+		self.max = max(self.max, duration)
+		self.last = duration
+
+	def get_summary(self):
+		return {
+			"n": self.n,
+			"timeouts": self.timeouts,
+			"last": self.last,
+			"mean": self.total / self.n if self.n else 0.0,
+			"max": self.max,
+			"histogram": list(self.counts)
+		}
+
+
+def quantize(value, quantum=1):
+	"""
+	Hashable state value rounded to multiples of quantum
+	"""
+	if isinstance(value, (list, tuple)):
+		return tuple([quantize(v, quantum) for v in value])
+	if isinstance(value, dict):
+		return tuple([(k, quantize(v, quantum)) for k, v in sorted(value.items())])
+	if isinstance(value, (int, float)):
+		return round(value / quantum) * quantum
+	return value
+
+
 class StategoOptimizer(StrategoController):
-	def __init__(self, templatefile, model_cfg_dict):
+	def __init__(self, templatefile, model_cfg_dict, name=None, compiled=True):
 		super().__init__(templatefile, model_cfg_dict, interactive_bash=False)
 		 # tag left in model_template.xml
 		self.tagRule = "//TAG_{}"
 		self.objective = 0
 
+		# every optimizer solves its own model file, concurrent solves do not collide
+		self.simulationfile = create_model_file(templatefile, name)
+		weakref.finalize(self, remove_model_file, self.simulationfile)
+
+		# compiled template renders the model in memory and writes it once per solve
+		self.template = None
+		if compiled:
+			self.template = ModelTemplate(templatefile, self.tagRule)
+			self.template_hash = self.template.hash
+		else:
+			self.template_hash = get_file_hash(templatefile)
+
 	def format_state(self, value):
 		"""
 		Lists and scalars are formatted accordingly
@@ -36,27 +222,86 @@ class StategoOptimizer(StrategoController):
 		super().update_state(new_values)
 		self.update_objective()
 
+	def init_simfile(self):
+		"""
+		Copy the template to the model file, not needed with compiled template
+		"""
+		if self.template is None:
+			super().init_simfile()
+
+	def render(self):
+		"""
+		Model text with the current states inserted
+		"""
+		values = {name: self.format_state(value) for name, value in self.states.items()}
+		return self.template.render(values)
+
 	def insert_state(self):
 		"""
 		Override insert state method to format arrays and scalars accodingly
 		"""
+		if self.template is not None:
+			with open(self.simulationfile, "w") as fout:
+				fout.write(self.render())
+			return
+
 		for name, value in self.states.items():
 				tag = self.tagRule.format(name)
 				value = self.format_state(value)
 				sutil.insert_to_modelfile(self.simulationfile, tag, value)
 
-	def run(self, queryfile="", learning_args=None, verifyta_command="verifyta"):
-		output = super().run(queryfile, learning_args, verifyta_command)
+	def run_verifyta(self, queryfile="", learning_args=None, verifyta_command="verifyta",
+		timeout=None):
+		"""
+		Run verifyta directly so it can be killed when the timeout expires,
+		raises subprocess.TimeoutExpired. The command may contain arguments
+		and start with ~ like the shell command run by strategoutil
+		"""
+		cmd = shlex.split(verifyta_command)
+		cmd[0] = os.path.expanduser(cmd[0])
+		cmd.append(self.simulationfile)
+		if queryfile:
+			cmd.append(queryfile)
+		if learning_args:
+			cmd += shlex.split(sutil.merge_verifyta_args(learning_args))
+		# own process group, so wrapper scripts are killed with their children
+		process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+			text=True, start_new_session=True)
+		try:
+			output, error = process.communicate(timeout=timeout)
+		except subprocess.TimeoutExpired:
+			os.killpg(process.pid, signal.SIGKILL)
+			process.communicate()
+			raise
+		if process.returncode != 0 or error:
+			raise RuntimeError(
+				f"Uppaal finished with exit code {process.returncode} and error message:\n\n{error}")
+		return output
+
+	def run(self, queryfile="", learning_args=None, verifyta_command="verifyta", timeout=None):
+		if timeout is None:
+			output = super().run(queryfile, learning_args, verifyta_command)
+		else:
+			output = self.run_verifyta(queryfile, learning_args, verifyta_command, timeout)
 		tpls = sutil.get_int_tuples(output)
 		result = sutil.get_duration_action(tpls, max_time=1000)
-		durations, actions = list(zip(*result)) 
+		# no strategy in the output, i.e. the query is not satisfied
+		if not result:
+			return (), ()
+		durations, actions = list(zip(*result))
 		return durations, actions
 
 
-@TLSFactory.register_agent('stratego')
-class StrategoTLS(TimedTLS):
+class StrategoMPCTLS(TimedTLS):
 	"""
-	Controller class for a pedestrian responsive crosswalk controller
+	Base class of the Stratego MPC controllers. On every mpc_step-th step of
+	a movement phase the UPPAAL model is solved for the next movement phase.
+	With async_solve constant the solve is dispatched to a thread pool in
+	prepare_step(), so solves of all tls in the step run at once, and the
+	decision is applied decision_latency steps after it was requested.
+	With decision_cache_size solutions are reused for the same phase
+	and model state rounded to decision_cache_quantum. Solves longer than
+	solve_timeout seconds are killed and the timed program is followed
 	"""
 	def __init__(self, tls_id, constants=None, variables=None,
 		data_query=None, optimizer=None):
@@ -68,15 +313,41 @@ class StrategoTLS(TimedTLS):
 		self.uppaal_query = self.constants.get('verifyta_query', "")
 		self.uppaal_verifyta = self.constants.get('verifyta_command', 'verifyta')
 		self.uppaal_debug = self.constants.get('debug', False)
+		self.compiled_template = self.constants.get('compiled_template', True)
+		self.async_solve = self.constants.get('async_solve', False)
+		self.decision_latency = self.constants.get('decision_latency', 0)
+		self.decision_cache_quantum = self.constants.get('decision_cache_quantum', 1)
+		self.solve_timeout = self.constants.get('solve_timeout')
 		
 		self.n_movement_phases = self.constants.get('n_movement_phases') 
 		self.movement_phase = True 
+
+		# requested solve, the number of steps it is waiting for, its cache key
+		# and the phase it was requested in
+		self.pending = None
+		self.pending_steps = 0
+		self.pending_key = None
+		self.pending_phase = None
+		# observation of prepare_step is used for the decision of the step
+		self.is_observed = False
 		
 		self.transitions = self.get_transitions()
-		self.optimizer = StategoOptimizer(
-            templatefile=self.uppaal_model_template,
-            model_cfg_dict=self.variables)
+		self.optimizer = self.create_optimizer()
+
+		# wall time of solves, is_solved marks steps that joined a solve
+		self.solver_stats = SolverStats()
+		self.is_solved = False
 
+		self.decision_cache = None
+		if self.constants.get('decision_cache_size', 0) > 0:
+			self.decision_cache = DecisionCache(self.constants['decision_cache_size'])
+
+	def create_optimizer(self):
+		return StategoOptimizer(
+			templatefile=self.uppaal_model_template,
+			model_cfg_dict=self.variables,
+			name=self.tls_id,
+			compiled=self.compiled_template)
 	
 	def get_transitions(self):
 		"""
@@ -87,104 +358,167 @@ class StrategoTLS(TimedTLS):
 			i, j = map(int, p.name.strip("( )").split(","))
 			transitions.append((i, j))
 		return transitions
-	
-	def calculate_next_phase(self):
-		self.variables = self.data_pipeline.extract()
 
+	def get_model_state(self):
+		"""
+		Values inserted to the model template before solving
+		"""
+		return self.variables
+
+	def select_movement_phase(self, durations, phase_seq):
+		"""
+		Next movement phase from the synthesized strategy
+		"""
+		return phase_seq[0]
+
+	def is_decision_step(self):
 		self.movement_phase = self.phase < self.n_movement_phases
+		return (self.pending is None and self.movement_phase 
+			and self.elapsed >= self.min_green and self.elapsed % self.mpc_step == 0)
 
-		# on k-th step of each movement phase
-		if self.movement_phase and self.elapsed >= self.min_green and self.elapsed % self.mpc_step == 0:
-			self.optimizer.init_simfile()
-			self.optimizer.update_state(self.variables)
-			
-			# fix the phase from int to boolean array
-			is_active = [
-				1 if self.phase == i else 0 for i in range(self.n_movement_phases)]
-			self.optimizer.update_state({"is_active": is_active})
-			self.optimizer.insert_state()
-
-			durations, phase_seq  = self.optimizer.run(
-			queryfile=self.uppaal_query,
-			verifyta_command=self.uppaal_verifyta)
-			
-			# decide next movement phase
-			next_movement_phase = phase_seq[0]
-			next_duration = durations[0]
-
-			if next_duration == self.min_green and len(phase_seq) > 1:
-				next_movement_phase = phase_seq[1]
-				next_duration = durations[1]
-			
-			# decide if transition is required
-			next_phase = next_movement_phase
-			if self.phase != next_phase:
-				transition_phase = self.transitions.index((self.phase, next_phase))
-				next_phase = self.n_movement_phases + transition_phase
+	def get_decision_key(self):
+		return (
+			self.phase,
+			quantize(self.get_model_state(), self.decision_cache_quantum),
+			self.optimizer.template_hash)
 
-		else:
-			next_phase = super().calculate_next_phase()
-		
-		return next_phase
+	def request_solve(self):
+		"""
+		Write the model and start the solve, the returned future holds
+		(durations, actions). Cached decisions skip the solver
+		"""
+		self.pending_key = None
+		self.pending_phase = self.phase
+		if self.decision_cache is not None:
+			key = self.get_decision_key()
+			decision = self.decision_cache.get(key)
+			if decision is not None:
+				future = Future()
+				future.set_result((decision, None))
+				return future
+			self.pending_key = key
 
+		self.optimizer.init_simfile()
+		self.optimizer.update_state(self.get_model_state())
+		self.optimizer.insert_state()
 
-@TLSFactory.register_agent('stratego2')
-class StrategoTLS(TimedTLS):
-	"""
-	Controller class for a pedestrian responsive crosswalk controller
-	"""
-	def __init__(self, tls_id, constants=None, variables=None,
-		data_query=None, optimizer=None):
-		super().__init__(tls_id, constants, variables, data_query, optimizer)
+		if self.async_solve:
+			return get_solver_pool().submit(self.timed_solve)
+		future = Future()
+		future.set_result(self.timed_solve())
+		return future
 
-		self.mpc_step = self.constants.get('mpc_step', 5)
-		self.min_green = self.constants.get('min_green', 4)
-		self.uppaal_model_template = self.constants.get('model_template')
-		self.uppaal_query = self.constants.get('verifyta_query', "")
-		self.uppaal_verifyta = self.constants.get('verifyta_command', 'verifyta')
-		self.uppaal_debug = self.constants.get('debug', False)
-		
-		self.n_movement_phases = self.constants.get('n_movement_phases') 
-		self.movement_phase = True 
-		
-		self.transitions = self.get_transitions()
-		self.optimizer = StategoOptimizer(
-            templatefile=self.uppaal_model_template,
-            model_cfg_dict=self.variables)
+	def timed_solve(self):
+		"""
+		Run the solver and measure its wall time, returns (decision, duration)
+		where decision is None if the solve timed out
+		"""
+		t_start = time.perf_counter()
+		try:
+			decision = self.optimizer.run(
+				queryfile=self.uppaal_query,
+				verifyta_command=self.uppaal_verifyta,
+				timeout=self.solve_timeout)
+		except subprocess.TimeoutExpired:
+			decision = None
+		return decision, time.perf_counter() - t_start
 
-	
-	def get_transitions(self):
+	def prepare_step(self):
 		"""
-		Calculate transitions from
+		Dispatch the solve before any tls of the step is updated
 		"""
-		transitions = []
-		for p in self.phase_list[self.n_movement_phases:]:
-			i, j = map(int, p.name.strip("( )").split(","))
-			transitions.append((i, j))
-		return transitions
-	
+		if self.async_solve and self.data_pipeline is not None:
+			self.variables = self.observe()
+			self.is_observed = True
+			if self.is_decision_step():
+				self.pending = self.request_solve()
+				self.pending_steps = 0
+
+	def get_transition(self, next_phase):
+		"""
+		Transition phase from the current to the next movement phase,
+		None if the program has no transition between them
+		"""
+		if self.phase != next_phase:
+			if (self.phase, next_phase) not in self.transitions:
+				return None
+			transition_phase = self.transitions.index((self.phase, next_phase))
+			next_phase = self.n_movement_phases + transition_phase
+		return next_phase
+
+	def get_solver_stats(self):
+		"""
+		Solve time statistics of the solves so far, solved marks steps
+		that joined a solve. Keys are the same in every step, so binary
+		logs are not split into chunks of changing columns
+		"""
+		stats = self.solver_stats.get_summary()
+		stats["solved"] = self.is_solved
+		if self.decision_cache is not None:
+			stats["cache"] = self.decision_cache.get_stats()
+		return stats
+
 	def calculate_next_phase(self):
-		self.variables = self.data_pipeline.extract()
+		if not self.is_observed:
+			self.variables = self.observe()
+		self.is_observed = False
+		self.is_solved = False
 
-		self.movement_phase = self.phase < self.n_movement_phases
+		if self.is_decision_step():
+			self.pending = self.request_solve()
+			self.pending_steps = 0
 
-		# on k-th step of each movement phase
-		if self.movement_phase and self.elapsed >= self.min_green and self.elapsed % self.mpc_step == 0:
-			self.optimizer.init_simfile()
-			self.optimizer.update_state(self.variables)
-			self.optimizer.insert_state()
-
-			_, phase_seq  = self.optimizer.run(
-			queryfile=self.uppaal_query,
-			verifyta_command=self.uppaal_verifyta)
-			
-			# ecide next movement phase and if transition is required
-			next_phase = phase_seq[0]
-			if self.phase != next_phase:
-				transition_phase = self.transitions.index((self.phase, next_phase))
-				next_phase = self.n_movement_phases + transition_phase
+		next_phase = None
+		if self.pending is not None and self.pending_steps >= self.decision_latency:
+			decision, duration = self.pending.result()
+			self.pending = None
+			if duration is not None:
+				self.solver_stats.record(duration, timeout=decision is None)
+				self.is_solved = True
+			if self.pending_key is not None and decision is not None:
+				self.decision_cache.put(self.pending_key, decision)
+			self.pending_key = None
 
-		else:
+			# timed out and empty decisions, and decisions for a phase that ended
+			# while waiting are dropped, the timed program continues
+			if decision is not None and decision[1] and self.phase == self.pending_phase:
+				durations, phase_seq = decision
+				next_movement_phase = self.select_movement_phase(durations, phase_seq)
+				next_phase = self.get_transition(next_movement_phase)
+		elif self.pending is not None:
+			self.pending_steps += 1
+
+		if next_phase is None:
 			next_phase = super().calculate_next_phase()
-		
-		return next_phase
\ No newline at end of file
+		return next_phase
+
+
+@TLSFactory.register_agent('stratego')
+class StrategoTLS(StrategoMPCTLS):
+	"""
+	Controller class for a pedestrian responsive crosswalk controller
+	"""
+	def get_model_state(self):
+		# fix the phase from int to boolean array
+		is_active = [
+			1 if self.phase == i else 0 for i in range(self.n_movement_phases)]
+		state = dict(self.variables)
+		state["is_active"] = is_active
+		return state
+
+	def select_movement_phase(self, durations, phase_seq):
+		# decide next movement phase
+		next_movement_phase = phase_seq[0]
+		next_duration = durations[0]
+
+		if next_duration == self.min_green and len(phase_seq) > 1:
+			next_movement_phase = phase_seq[1]
+			next_duration = durations[1]
+		return next_movement_phase
+
+
+@TLSFactory.register_agent('stratego2')
+class Stratego2TLS(StrategoMPCTLS):
+	"""
+	Controller class for a pedestrian responsive crosswalk controller
+	"""
@@ -0,0 +1,303 @@
+import argparse
+import importlib.util
+import multiprocessing
+import traceback
+
+import numpy as np
+
+import cfgparse
+import runner
+import feature_extraction as fe
+from simbackend import sim
+
+
+def queue_reward(tls_list):
+    """
+    Negative number of halting vehicles on the lanes controlled by the agents
+    """
+    lanes = set([l for tls in tls_list for l in fe.get_controlled_lanes(tls.tls_id)])
+    return -float(sum([sim.lane.getLastStepHaltingNumber(l) for l in lanes]))
+
+
+def waiting_time_reward(tls_list):
+    """
+    Negative waiting time of vehicles on the lanes controlled by the agents
+    """
+    lanes = set([l for tls in tls_list for l in fe.get_controlled_lanes(tls.tls_id)])
+    return -float(sum([sim.lane.getWaitingTime(l) for l in lanes]))
+
+
+# reward of the step computed from the agents controlled by the environment
+REWARDS = {
+    "queue": queue_reward,
+    "waiting_time": waiting_time_reward,
+}
+
+
+def flatten_variables(variables):
+    """
+    Numbers and lists of the variables dict in their
+    definition order as a flat list
+    """
+    values = []
+    for v in variables.values():
+        if isinstance(v, (list, tuple)):
+            values.extend(v)
+        else:
+            values.append(v)
+    return values
+
+
+def merge_overrides(overrides, section, **values):
+    """
+    Copy of config overrides with values set in the section
+    """
+    overrides = dict(overrides)
+    overrides[section] = dict(overrides.get(section, {}), **values)
+    return overrides
+
+
+class TLSEnv:
+    """
+    Gym style environment over the simulation of a run config. TLS with
+    controller 'external' are controlled by the actions, one phase index
+    per TLS in config order, the other TLS run their own controllers.
+    Observation is the flattened variables of the data pipeline followed
+    by phase and elapsed time of every external TLS
+    """
+    def __init__(self, config_file, overrides=None, reward="queue",
+            steps_per_action=1, label="default", port=None):
+        assert reward in REWARDS, \
+            f"Unknown reward {reward}, expected one of {list(REWARDS)}"
+        assert steps_per_action > 0, "steps_per_action has to be positive"
+        self.config_file = config_file
+        self.overrides = overrides if overrides is not None else {}
+        self.reward_fn = REWARDS[reward]
+        self.steps_per_action = steps_per_action
+        self.label = label
+        self.port = port
+
+        self.cfg = None
+        self.tls_list = []
+        self.agents = []
+        self.coordinator = None
+        self.n_steps = 0
+        self.is_running = False
+
+    def get_config(self, seed=None):
+        overrides = self.overrides
+        if seed is not None:
+            overrides = merge_overrides(overrides, "sumo", seed=seed)
+        args = argparse.Namespace(config=self.config_file)
+        cfg = cfgparse.get_valid_config(args, overrides)
+        assert any([tls.controller == "external" for tls in cfg.tls]), \
+            f"No TLS with controller 'external' in {self.config_file}"
+        return cfg
+
+    def reset(self, seed=None, options=None):
+        """
+        Start a new episode, returns observation and info
+        """
+        self.close()
+        self.cfg = self.get_config(seed)
+        runner.validate_tls_ids(self.cfg)
+
+        sim.select(self.cfg.sumo.backend)
+        if self.cfg.sumo.trace:
+            sim.use_trace(self.cfg.sumo.trace)
+        sim.start(runner.get_sumo_command(self.cfg), label=self.label, port=self.port)
+        self.is_running = True
+
+        self.tls_list = runner.create_agents(self.cfg)
+        self.agents = [tls for tls in self.tls_list if hasattr(tls, "set_action")]
+        self.coordinator = runner.create_coordinator(self.cfg, self.tls_list)
+        self.n_steps = 0
+        self.simulation_step()
+        return self.get_observation(), self.get_info()
+
+    def step(self, action):
+        """
+        Apply one phase per external TLS and advance the simulation
+        by steps_per_action, returns observation, reward, terminated,
+        truncated and info
+        """
+        action = np.asarray(action).reshape(-1)
+        assert len(action) == len(self.agents), \
+            f"Expected {len(self.agents)} actions, got {len(action)}"
+        for tls, phase in zip(self.agents, action):
+            tls.set_action(phase)
+
+        reward = 0.0
+        terminated = False
+        for _ in range(self.steps_per_action):
+            self.simulation_step()
+            reward += self.reward_fn(self.agents)
+            terminated = sim.simulation.getMinExpectedNumber() == 0
+            if terminated or self.n_steps >= self.cfg.sumo.max_steps:
+                break
+        truncated = not terminated and self.n_steps >= self.cfg.sumo.max_steps
+        return self.get_observation(), reward, terminated, truncated, self.get_info()
+
+    def simulation_step(self):
+        sim.simulationStep()
+        self.coordinator.step()
+        self.n_steps += 1
+
+    def get_observation(self):
+        values = []
+        for tls in self.agents:
+            variables = self.coordinator.get_observation(tls.tls_id) or {}
+            values.extend(flatten_variables(variables))
+            values.extend([tls.phase, tls.elapsed])
+        return np.array(values, dtype=np.float32)
+
+    def get_info(self):
+        return {
+            "time": sim.simulation.getTime(),
+            "phases": [tls.phase for tls in self.agents]
+        }
+
+    def get_action_sizes(self):
+        """
+        Number of phases of every external TLS
+        """
+        return [tls.n_phases for tls in self.agents]
+
+    def get_spaces(self):
+        """
+        Observation and action spaces if gymnasium is installed, requires reset
+        """
+        if importlib.util.find_spec("gymnasium") is None:
+            return None, None
+        from gymnasium import spaces
+
+        n_obs = len(self.get_observation())
+        observation_space = spaces.Box(-np.inf, np.inf, (n_obs,), dtype=np.float32)
+        action_space = spaces.MultiDiscrete(self.get_action_sizes())
+        return observation_space, action_space
+
+    def close(self):
+        if self.is_running:
+            sim.close()
+            self.is_running = False
+
+
+def env_worker(conn, env_kwargs, index=0, n_envs=1):
+    """
+    Runs one environment in a worker process, episodes that
+    end in step are reset and their last observation is kept in info.
+    The k-th reset after reset(seed) uses seed + k * n_envs, so workers
+    stay independent of each other and of their previous episodes
+    """
+    env = TLSEnv(**env_kwargs)
+    seed = index
+    n_resets = 0
+    try:
+        while True:
+            cmd, data = conn.recv()
+            if cmd == "reset":
+                seed = data if data is not None else index
+                n_resets = 0
+                result = env.reset(seed=seed)
+                result[1]["action_sizes"] = env.get_action_sizes()
+            elif cmd == "step":
+                obs, reward, terminated, truncated, info = env.step(data)
+                if terminated or truncated:
+                    info["final_observation"] = obs
+                    n_resets += 1
+                    obs, _ = env.reset(seed=seed + n_resets * n_envs)
+                result = (obs, reward, terminated, truncated, info)
+            elif cmd == "close":
+                conn.send(("ok", None))
+                break
+            conn.send(("ok", result))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        env.close()
+        conn.close()
+
+
+class VectorTLSEnv:
+    """
+    n independent environments of the config stepped in parallel
+    worker processes, each with its own SUMO instance and seed.
+    Observations are stacked to (n_envs, n_obs) arrays, rewards and
+    done flags to (n_envs,) arrays and actions are (n_envs, n_agents)
+    """
+    def __init__(self, config_file, n_envs, overrides=None, reward="queue",
+            steps_per_action=1, base_port=None):
+        overrides = overrides if overrides is not None else {}
+        job_name = cfgparse.get_valid_config(
+            argparse.Namespace(config=config_file), overrides).job.name
+
+        self.n_envs = n_envs
+        self.conns = []
+        self.processes = []
+        for i in range(n_envs):
+            # separate SUMO outputs of the environments, GUI can not be used
+            env_overrides = merge_overrides(overrides, "job", name=f"{job_name}-env{i}")
+            env_overrides = merge_overrides(env_overrides, "sumo", gui=False)
+            env_kwargs = {
+                "config_file": config_file,
+                "overrides": env_overrides,
+                "reward": reward,
+                "steps_per_action": steps_per_action,
+                "label": f"env{i}",
+                "port": None if base_port is None else base_port + i
+            }
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=env_worker, args=(child_conn, env_kwargs, i, n_envs), daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def send_all(self, cmd, data):
+        for conn, d in zip(self.conns, data):
+            conn.send((cmd, d))
+
+    def receive_all(self):
+        results = []
+        for i, conn in enumerate(self.conns):
+            status, result = conn.recv()
+            if status == "error":
+                raise RuntimeError(f"Environment {i} failed:\n{result}")
+            results.append(result)
+        return results
+
+    def reset(self, seed=None):
+        """
+        Reset all environments, environment i gets seed + i, or i
+        without seed, and its k-th automatic reset seed + i + k * n_envs
+        """
+        seeds = [None if seed is None else seed + i for i in range(self.n_envs)]
+        self.send_all("reset", seeds)
+        results = self.receive_all()
+        obs = np.stack([r[0] for r in results])
+        return obs, [r[1] for r in results]
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        assert len(actions) == self.n_envs, \
+            f"Expected actions of {self.n_envs} environments, got {len(actions)}"
+        self.send_all("step", actions)
+        results = self.receive_all()
+        obs = np.stack([r[0] for r in results])
+        rewards = np.array([r[1] for r in results], dtype=np.float32)
+        terminated = np.array([r[2] for r in results])
+        truncated = np.array([r[3] for r in results])
+        return obs, rewards, terminated, truncated, [r[4] for r in results]
+
+    def close(self):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(("close", None))
+                    conn.recv()
+                except (BrokenPipeError, EOFError):
+                    pass
+            process.join()
+        self.conns = []
+        self.processes = []
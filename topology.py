@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import xml.etree.ElementTree as ET
+
+
+# bump when the sidecar layout changes so old sidecars are rebuilt
+SIDECAR_VERSION = 1
+SIDECAR_SUFFIX = ".topology.json"
+
+# topology of the running network, set by the runner before agents are created
+active = None
+
+
+def get_file_hash(file, chunk_size=1 << 20):
+    """
+    sha1 of the file contents
+    """
+    h = hashlib.sha1()
+    with open(file, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_sidecar_path(net_file, cache_dir=None):
+    """
+    Sidecar is stored next to the network unless cache_dir is given
+    """
+    if cache_dir is None:
+        return net_file + SIDECAR_SUFFIX
+    return os.path.join(cache_dir, os.path.basename(net_file) + SIDECAR_SUFFIX)
+
+
+def get_junction_id(internal_id):
+    """
+    Junction of an internal edge, i.e. :C_w0 -> C
+    """
+    return internal_id[1:].rsplit("_", 1)[0]
+
+
+class NetworkTopology:
+    """
+    Static parts of a SUMO network needed by the runner, data pipeline
+    and agents: TLS ids, their controlled links, walking and crossing edges
+    of their junctions and phases of the programs defined in the network.
+    Parsed once from .net.xml and cached in a JSON sidecar keyed by the file hash
+    """
+    def __init__(self, data):
+        self.net_hash = data["hash"]
+        self.lanes = set(data["lanes"])
+        self.tls = data["tls"]
+        self.walking_edges = data["walking_edges"]
+        self.crossing_edges = data["crossing_edges"]
+
+    @classmethod
+    def load(cls, net_file, cache_dir=None):
+        """
+        Read the topology from the sidecar if it matches the network,
+        otherwise parse the network and write the sidecar
+        """
+        net_hash = get_file_hash(net_file)
+        sidecar = get_sidecar_path(net_file, cache_dir)
+        if os.path.isfile(sidecar):
+            with open(sidecar, "r") as fin:
+                data = json.load(fin)
+            if data.get("version") == SIDECAR_VERSION and data.get("hash") == net_hash:
+                return cls(data)
+
+        data = parse_network(net_file)
+        data["hash"] = net_hash
+        try:
+            if cache_dir is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+            with open(sidecar, "w") as fout:
+                json.dump(data, fout)
+        except OSError:
+            # read-only location, the network is parsed again next time
+            pass
+        return cls(data)
+
+    def get_tls_ids(self):
+        return list(self.tls.keys())
+
+    def has_tls(self, tls_id):
+        return tls_id in self.tls
+
+    def has_lane(self, lane_id):
+        return lane_id in self.lanes
+
+    def get_controlled_links(self, tls_id):
+        """
+        Controlled links as returned by trafficlight.getControlledLinks,
+        a list of (incoming, outgoing, via) lane triplets per link index
+        """
+        return [[tuple(link) for link in links] for links in self.tls[tls_id]["links"]]
+
+    def get_controlled_lanes(self, tls_id):
+        """
+        Incoming lane of every link index as trafficlight.getControlledLanes
+        """
+        return [links[0][0] for links in self.tls[tls_id]["links"] if links]
+
+    def get_walking_edges(self, tls_id):
+        return list(self.walking_edges.get(tls_id, []))
+
+    def get_crossing_edges(self, tls_id):
+        return list(self.crossing_edges.get(tls_id, []))
+
+    def get_phase_states(self, tls_id, program_id=None):
+        """
+        Phase states of a program defined in the network, the last
+        defined program if program_id is not given
+        """
+        programs = self.tls[tls_id]["programs"]
+        if program_id is None:
+            program_id = list(programs.keys())[-1]
+        return programs[str(program_id)]
+
+
+def parse_network(net_file):
+    """
+    Single streaming pass over the network collecting only lanes, internal
+    pedestrian edges, TLS programs and TLS controlled connections,
+    geometry, junctions and other elements are skipped
+    """
+    lanes = []
+    walking_edges = {}
+    crossing_edges = {}
+    tls = {}
+
+    context = ET.iterparse(net_file, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        tag = elem.tag
+        if tag == "lane":
+            lanes.append(elem.get("id"))
+        elif tag == "edge":
+            function = elem.get("function")
+            edge_id = elem.get("id")
+            if function == "walkingarea":
+                walking_edges.setdefault(get_junction_id(edge_id), []).append(edge_id)
+            elif function == "crossing":
+                crossing_edges.setdefault(get_junction_id(edge_id), []).append(edge_id)
+        elif tag == "tlLogic":
+            item = tls.setdefault(elem.get("id"), {"programs": {}, "links": []})
+            item["programs"][elem.get("programID")] = [
+                phase.get("state") for phase in elem.iter("phase")]
+        elif tag == "connection" and elem.get("tl") is not None:
+            item = tls.setdefault(elem.get("tl"), {"programs": {}, "links": []})
+            links = item["links"]
+            idx = int(elem.get("linkIndex"))
+            if len(links) <= idx:
+                links.extend([[] for _ in range(idx + 1 - len(links))])
+            links[idx].append([
+                "{}_{}".format(elem.get("from"), elem.get("fromLane")),
+                "{}_{}".format(elem.get("to"), elem.get("toLane")),
+                elem.get("via", "")])
+        if depth == 0:
+            root.clear()
+
+    return {
+        "version": SIDECAR_VERSION,
+        "lanes": lanes,
+        "walking_edges": walking_edges,
+        "crossing_edges": crossing_edges,
+        "tls": tls,
+    }
+
+
+def load(net_file, cache_dir=None):
+    """
+    Load topology of the network and make it the active one
+    """
+    global active
+    active = NetworkTopology.load(net_file, cache_dir)
+    return active
+
+
+def get_active():
+    return active
@@ -0,0 +1,218 @@
+import gzip
+import os
+import pickle
+import sys
+
+from traci import trafficlight
+
+
+# bump when the trace layout changes, old traces can not be replayed
+TRACE_VERSION = 1
+
+# TraCI domains whose getters are recorded
+DOMAINS = (
+    "edge", "inductionloop", "junction", "lane", "lanearea", "multientryexit",
+    "person", "route", "simulation", "trafficlight", "vehicle", "vehicletype",
+)
+
+
+def is_getter(method):
+    """
+    Only responses of getters are recorded, setters and subscribe
+    calls change SUMO and are ignored in replay
+    """
+    return method.startswith("get")
+
+
+def make_key(domain, method, args):
+    """
+    Hashable key of a call, lists in the arguments become tuples
+    """
+    return (domain, method, tuple(
+        tuple(a) if isinstance(a, list) else a for a in args))
+
+
+def to_logic(logic):
+    """
+    Plain TraCI Logic of a libsumo TraCILogic, the SWIG objects
+    returned by libsumo can not be pickled
+    """
+    phases = tuple([
+        trafficlight.Phase(p.duration, p.state, p.minDur, p.maxDur,
+            tuple(p.next), p.name, p.earlyTarget)
+        for p in logic.phases])
+    return trafficlight.Logic(logic.programID, logic.type,
+        logic.currentPhaseIndex, phases, dict(logic.subParameter))
+
+
+def compact(value):
+    """
+    Intern strings of the response, so repeated lane / vehicle ids
+    are stored once in the pickled trace
+    """
+    if type(value).__name__ == "TraCILogic":
+        return to_logic(value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, tuple):
+        return tuple([compact(v) for v in value])
+    if isinstance(value, list):
+        return [compact(v) for v in value]
+    if isinstance(value, dict):
+        return {compact(k): compact(v) for k, v in value.items()}
+    return value
+
+
+def save_trace(trace_file, trace):
+    """
+    Write the trace next to the target and rename it,
+    so a failed save does not leave a truncated trace
+    """
+    tmp_file = f"{trace_file}.tmp"
+    try:
+        with gzip.open(tmp_file, "wb") as fout:
+            pickle.dump(trace, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, trace_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_trace(trace_file):
+    with gzip.open(trace_file, "rb") as fin:
+        trace = pickle.load(fin)
+    assert trace.get("version") == TRACE_VERSION, \
+        f"Trace {trace_file} has version {trace.get('version')}, expected {TRACE_VERSION}"
+    return trace
+
+
+class RecordingDomain:
+    """
+    Domain of the recorded module, i.e. lane, forwarding calls
+    and recording responses of the getters
+    """
+    def __init__(self, recorder, name, domain):
+        self._recorder = recorder
+        self._name = name
+        self._domain = domain
+
+    def __getattr__(self, method):
+        func = getattr(self._domain, method)
+        if not callable(func):
+            return func
+        if not is_getter(method):
+            setattr(self, method, func)
+            return func
+
+        def record(*args):
+            value = func(*args)
+            self._recorder.record(self._name, method, args, value)
+            return value
+        setattr(self, method, record)
+        return record
+
+
+class TraceRecorder:
+    """
+    Wraps the TraCI module of a live backend and records the responses
+    of all getters called by the runner, data pipeline and agents per
+    simulation step. The trace is written as gzipped pickle on close
+    """
+    def __init__(self, module, trace_file):
+        self.module = module
+        self.trace_file = trace_file
+        self.trace = {"version": TRACE_VERSION, "cmd": None, "start": None, "steps": [{}]}
+
+    def record(self, domain, method, args, value):
+        step = self.trace["steps"][-1]
+        step.setdefault(make_key(domain, method, args), []).append(compact(value))
+
+    def start(self, cmd, **kwargs):
+        value = self.module.start(cmd, **kwargs)
+        self.trace["cmd"] = list(cmd)
+        self.trace["start"] = value
+        return value
+
+    def simulationStep(self, *args):
+        value = self.module.simulationStep(*args)
+        self.trace["steps"].append({})
+        return value
+
+    def close(self, *args):
+        value = self.module.close(*args)
+        save_trace(self.trace_file, self.trace)
+        return value
+
+    def __getattr__(self, attr):
+        value = getattr(self.module, attr)
+        if attr in DOMAINS:
+            value = RecordingDomain(self, attr, value)
+        setattr(self, attr, value)
+        return value
+
+
+class ReplayDomain:
+    """
+    Domain of the replayed module, getters are served from the trace
+    of the current step and everything else returns None
+    """
+    def __init__(self, player, name):
+        self._player = player
+        self._name = name
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        if is_getter(method):
+            def replay(*args):
+                return self._player.get_response(self._name, method, args)
+        else:
+            def replay(*args, **kwargs):
+                return None
+        setattr(self, method, replay)
+        return replay
+
+
+class TracePlayer:
+    """
+    TraCI module without SUMO serving the responses of a recorded
+    trace step by step. Repeated calls with the same arguments within
+    a step return the recorded responses in order, the last one is
+    repeated once the recorded ones are used up. Commands are ignored,
+    so the replayed traffic does not react to the decisions of the agents
+    """
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.trace = load_trace(trace_file)
+        self.steps = self.trace["steps"]
+        self.step = 0
+        self.served = {}
+
+    def start(self, cmd=None, **kwargs):
+        self.step = 0
+        self.served = {}
+        return self.trace["start"]
+
+    def simulationStep(self, *args):
+        self.step += 1
+        self.served = {}
+
+    def close(self, *args):
+        pass
+
+    def get_response(self, domain, method, args):
+        key = make_key(domain, method, args)
+        if self.step >= len(self.steps) or key not in self.steps[self.step]:
+            raise KeyError(
+                f"{domain}.{method}{args} at step {self.step} is not recorded in {self.trace_file}")
+        responses = self.steps[self.step][key]
+        i = self.served.get(key, 0)
+        self.served[key] = i + 1
+        return responses[min(i, len(responses) - 1)]
+
+    def __getattr__(self, attr):
+        if attr not in DOMAINS:
+            raise AttributeError(f"{attr} is not a replayed TraCI domain")
+        value = ReplayDomain(self, attr)
+        setattr(self, attr, value)
+        return value